@@ -0,0 +1,188 @@
+"""
+Пакетная генерация по JSONL: модель загружается один раз, промпты сортируются
+по длине в токенах (соседи в батче близки по длине - меньше паддинга) и идут
+через ContinuousBatcher, размер батча ограничен бюджетом памяти на KV-кэш.
+
+    python batch.py prompts.jsonl results.jsonl --device cpu --model /tmp/tiny-llama
+
+Строка входа: {"id": ..., "prompt": "..."} или {"id": ..., "messages": [...]},
+необязательно "max_tokens", "temperature", "top_p", "stop". Без "id" - номер строки.
+Результат каждой записи дописывается в выход сразу после её завершения; выходной
+файл - он же чекпоинт: при повторном запуске готовые id пропускаются, а записи,
+завершившиеся ошибкой, генерируются заново.
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import time
+
+import psutil
+import torch
+
+from src.backend import configure_cpu_threads, DEVICES, QUANTIZATIONS
+from src.batching import ContinuousBatcher, encode_prompt
+from src.config import Config
+from src.load_planner import kv_bytes_per_token
+from utils import get_model_and_tokenizer
+
+
+def read_items(path: str) -> list[dict]:
+    items = []
+    with open(path, encoding='utf-8') as file:
+        for line_number, line in enumerate(file):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault('id', line_number)
+            items.append(item)
+    return items
+
+
+def completed_ids(path: str) -> set:
+    """
+    id записей, завершённых без ошибки. Строки с ошибкой из выхода убираются - эти
+    записи генерируются заново и допишутся в конец; оборванная последняя строка
+    (запуск прервали на записи) отрезается
+    """
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    kept = []
+    with open(path, 'rb') as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+                result_id = result['id']
+            except (ValueError, KeyError):
+                break
+            if 'error' not in result and result.get('finish_reason') is not None:
+                done.add(result_id)
+                kept.append(line)
+    if sum(map(len, kept)) != os.path.getsize(path):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.writelines(kept)
+        os.replace(tmp_path, path)
+    return done
+
+
+def memory_budget_tokens(model, budget_gb: float | None) -> int:
+    """Бюджет KV-кэша батча в токенах: заданные гигабайты или доля свободной памяти устройства"""
+    if budget_gb is not None:
+        budget = budget_gb * 1024 ** 3
+    elif model.device.type == 'cuda':
+        budget = torch.cuda.mem_get_info(model.device)[0] * Config.LOAD_PLAN_HEADROOM
+    else:
+        budget = psutil.virtual_memory().available * Config.LOAD_PLAN_HEADROOM
+    return max(1, int(budget // kv_bytes_per_token(model.config, model.dtype.itemsize)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--model', default=Config.MODEL_ID)
+    parser.add_argument('--revision', default=None)
+    parser.add_argument('--device', choices=DEVICES, default=Config.DEVICE)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=Config.QUANTIZATION)
+    parser.add_argument('--threads', type=int, default=Config.CPU_INTRA_OP_THREADS)
+    parser.add_argument('--max-batch-size', type=int, default=Config.BATCH_MAX_SIZE)
+    parser.add_argument('--memory-budget-gb', type=float, default=Config.BATCH_MEMORY_BUDGET_GB,
+                        help='память под KV-кэш батча; по умолчанию доля свободной')
+    parser.add_argument('--max-tokens', type=int, default=Config.BATCH_DEFAULT_MAX_TOKENS,
+                        help='max_tokens для записей, где он не задан')
+    parser.add_argument('--temperature', type=float, default=0.0, help='для записей, где она не задана')
+    args = parser.parse_args()
+
+    items = read_items(args.input)
+    done = completed_ids(args.output)
+    pending = [item for item in items if item['id'] not in done]
+    print(f'{len(items)} items, {len(items) - len(pending)} already done, {len(pending)} to go', file=sys.stderr)
+    if not pending:
+        return
+
+    configure_cpu_threads(args.threads)
+    model, tokenizer = get_model_and_tokenizer(
+        model_id=args.model, revision=args.revision, device=args.device, quantization=args.quantization)
+    encoded, invalid = [], []
+    for item in pending:
+        try:
+            encoded.append((encode_prompt(tokenizer, prompt=item.get('prompt'), messages=item.get('messages')), item))
+        except (ValueError, KeyError, TypeError) as e:
+            invalid.append({'id': item['id'], 'error': f'Invalid item: {e}'})
+    encoded.sort(key=lambda pair: len(pair[0]))
+
+    budget_tokens = memory_budget_tokens(model, args.memory_budget_gb)
+    batcher = ContinuousBatcher(model, tokenizer, max_batch_size=args.max_batch_size, max_batch_tokens=budget_tokens)
+    batcher.start()
+    finished = queue.Queue()
+    items_by_sequence = {}
+    for prompt_ids, item in encoded:
+        stop = item.get('stop') or []
+        sequence = batcher.submit(
+            prompt_ids,
+            temperature=float(item.get('temperature', args.temperature)),
+            top_p=float(item.get('top_p', 1.0)),
+            max_tokens=int(item.get('max_tokens') or args.max_tokens),
+            stop_strings=[stop] if isinstance(stop, str) else list(stop),
+            finished=finished,
+        )
+        items_by_sequence[sequence.id] = item
+
+    start = time.perf_counter()
+    prompt_tokens = completion_tokens = 0
+    errors = len(invalid)
+    last_report = start
+    try:
+        with open(args.output, 'a', encoding='utf-8') as output:
+            for result in invalid:
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            for count in range(1, len(encoded) + 1):
+                sequence = finished.get()
+                item = items_by_sequence.pop(sequence.id)
+                result = {'id': item['id']}
+                if sequence.error is not None:
+                    errors += 1
+                    result['error'] = sequence.error
+                else:
+                    generated = sequence.generated
+                    result.update({
+                        'text': tokenizer.decode(generated, skip_special_tokens=True),
+                        'finish_reason': sequence.finish_reason,
+                        'prompt_tokens': len(sequence.prompt_ids),
+                        'completion_tokens': len(generated),
+                    })
+                    prompt_tokens += len(sequence.prompt_ids)
+                    completion_tokens += len(generated)
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                output.flush()
+                now = time.perf_counter()
+                if now - last_report >= 5.0:
+                    print(f'{count}/{len(encoded)} items, {completion_tokens / (now - start):.1f} tok/s',
+                          file=sys.stderr)
+                    last_report = now
+    finally:
+        batcher.stop()
+
+    elapsed = time.perf_counter() - start
+    stats = batcher.stats
+    padding = stats['padding_slots'] / stats['slots'] if stats['slots'] else 0.0
+    print(json.dumps({
+        'items': len(pending),
+        'errors': errors,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'elapsed': round(elapsed, 2),
+        'tokens_per_second': round(completion_tokens / elapsed, 1),
+        'decode_steps': stats['steps'],
+        'max_batch': stats['max_batch'],
+        'budget_tokens': budget_tokens,
+        'padding_waste': round(padding, 4),
+    }, indent=2), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
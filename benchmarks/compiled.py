@@ -0,0 +1,70 @@
+"""
+Бенчмарк режима compiled: время компиляции шага декодирования против прироста
+скорости декодирования (ток/с) по сравнению с обычным режимом на той же модели.
+Ответы в жадном режиме сверяются: компиляция не должна менять токены.
+
+    python -m benchmarks.compiled --model /tmp/tiny-llama --device cpu --max-new-tokens 256
+    python -m benchmarks.compiled --model /tmp/tiny-llama --device cpu --cold
+
+--cold компилирует с пустым каталогом кэша inductor (как при первом запуске);
+без него используется Config.COMPILE_CACHE_DIR, и повторный запуск показывает
+время прогрева с готовыми артефактами.
+"""
+import argparse
+import json
+import sys
+import tempfile
+
+from benchmarks.generation import add_model_arguments, DEFAULT_PROMPTS, load_model, run_one, summarize
+from src.compiled_decode import enable_compiled_decode
+from src.config import Config
+
+
+def measure(model, tokenizer, args) -> tuple[dict, list[list[int]]]:
+    runs = [run_one(model, tokenizer, prompt, 0.0, args.max_new_tokens) for prompt in DEFAULT_PROMPTS
+            for _ in range(args.repeat)]
+    return summarize(runs), [run['token_ids'] for run in runs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--max-new-tokens', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--max-context', type=int, default=Config.COMPILE_MAX_CONTEXT_TOKENS,
+                        help='размер статического KV-кэша')
+    parser.add_argument('--cold', action='store_true', help='компилировать без кэша артефактов на диске')
+    args = parser.parse_args()
+
+    model, tokenizer, _ = load_model(args)
+    run_one(model, tokenizer, DEFAULT_PROMPTS[0], 0.0, 8)
+    eager, eager_tokens = measure(model, tokenizer, args)
+
+    cache_dir = tempfile.mkdtemp(prefix='inductor-') if args.cold else Config.COMPILE_CACHE_DIR
+    timings = {}
+    decoder = enable_compiled_decode(model, tokenizer, timings, max_cache_len=args.max_context, cache_dir=cache_dir)
+    if decoder is None:
+        print(json.dumps({'fallback': timings['compile_fallback']}))
+        sys.exit(1)
+    compiled, compiled_tokens = measure(model, tokenizer, args)
+
+    eager_step = 1 / eager['decode_tokens_per_second']
+    compiled_step = 1 / compiled['decode_tokens_per_second']
+    saved = eager_step - compiled_step
+    print(json.dumps({
+        'device': str(model.device),
+        'compile_seconds': round(timings['compile'], 2),
+        'cold_cache': args.cold,
+        'eager_decode_tokens_per_second': round(eager['decode_tokens_per_second'], 1),
+        'compiled_decode_tokens_per_second': round(compiled['decode_tokens_per_second'], 1),
+        'speedup': round(eager_step / compiled_step, 3),
+        'eager_itl_p50_ms': round(eager['itl_p50'] * 1000, 3),
+        'compiled_itl_p50_ms': round(compiled['itl_p50'] * 1000, 3),
+        # Сколько токенов нужно сгенерировать, чтобы окупить компиляцию
+        'break_even_tokens': round(timings['compile'] / saved) if saved > 0 else None,
+        'same_tokens': eager_tokens == compiled_tokens,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
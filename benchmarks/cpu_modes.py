@@ -0,0 +1,70 @@
+"""
+Сравнение режимов CPU-инференса: число потоков и динамическое int8-квантование.
+Каждый режим запускается отдельным процессом benchmarks.generation, так как
+число inter-op потоков torch можно задать только до начала работы.
+
+    python -m benchmarks.cpu_modes --model /tmp/tiny-llama --threads 1 4 16 --interop-threads 1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from src.config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=Config.MODEL_ID)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, os.cpu_count()])
+    parser.add_argument('--interop-threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--quantizations', nargs='+', default=['none', 'int8'], choices=['none', 'int8'])
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--output', help='файл для сводного JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for quantization in args.quantizations:
+            for threads in args.threads:
+                for interop_threads in args.interop_threads:
+                    output = os.path.join(directory, f'{quantization}-{threads}-{interop_threads}.json')
+                    subprocess.run([
+                        sys.executable, '-m', 'benchmarks.generation',
+                        '--model', args.model,
+                        '--device', 'cpu',
+                        '--quantization', quantization,
+                        '--threads', str(threads),
+                        '--interop-threads', str(interop_threads),
+                        '--max-new-tokens', str(args.max_new_tokens),
+                        '--repeat', str(args.repeat),
+                        '--output', output,
+                    ], check=True, stderr=subprocess.DEVNULL)
+                    with open(output, encoding='utf-8') as file:
+                        result = json.load(file)
+                    summary = result['cases'][0]['summary']
+                    results.append({
+                        'quantization': quantization,
+                        'threads': threads,
+                        'interop_threads': interop_threads,
+                        'load_time': result['load_timings']['load'],
+                        'peak_rss_bytes': result['peak_rss_bytes'],
+                        **summary,
+                    })
+
+    print(f'{"quant":<6} {"threads":>7} {"interop":>7} {"ttft ms":>8} {"itl p50 ms":>10} '
+          f'{"tok/s":>8} {"rss MB":>8}')
+    for row in results:
+        print(f'{row["quantization"]:<6} {row["threads"]:>7} {row["interop_threads"]:>7} '
+              f'{row["ttft_p50"] * 1000:>8.1f} {(row["itl_p50"] or 0) * 1000:>10.2f} '
+              f'{row["tokens_per_second"]:>8.1f} {row["peak_rss_bytes"] / 1024 ** 2:>8.0f}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Headless-бенчмарк генерации через те же get_model_and_tokenizer, StreamingThread
+и PyQtStreamer, что и GUI. Результат - JSON для сравнения между версиями.
+
+    python -m benchmarks.tiny_model /tmp/tiny-llama
+    python -m benchmarks.generation --model /tmp/tiny-llama --device cpu \\
+        --temperatures 0 0.7 --max-new-tokens 32 128 --output result.json
+    python -m benchmarks.generation ... --baseline previous.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import psutil
+import torch
+
+from src.backend import configure_cpu_threads, DEVICES, QUANTIZATIONS
+from src.config import Config
+from src.speculative import speculative_stats, SPECULATIVE_MODES
+from src.streaming_thread import StreamingThread
+from utils import get_draft_model, get_model_and_tokenizer
+
+
+DEFAULT_PROMPTS = [
+    'Расскажи коротко, что такое трансформер.',
+    'Write a Python function that checks whether a number is prime.',
+    'Объясни формулу $E = mc^2$ простыми словами.',
+]
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def peak_rss_bytes() -> int:
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def add_model_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--model', default=Config.MODEL_ID, help='id модели или локальный путь')
+    parser.add_argument('--revision', default=None)
+    parser.add_argument('--device', choices=DEVICES, default=Config.DEVICE)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=Config.QUANTIZATION)
+    parser.add_argument('--threads', type=int, default=Config.CPU_INTRA_OP_THREADS)
+    parser.add_argument('--interop-threads', type=int, default=Config.CPU_INTER_OP_THREADS)
+    parser.add_argument('--no-model-cache', action='store_true')
+    parser.add_argument('--speculative', choices=SPECULATIVE_MODES, default=Config.SPECULATIVE_MODE)
+    parser.add_argument('--draft-model', default=Config.DRAFT_MODEL_ID)
+
+
+def load_model(args: argparse.Namespace):
+    timings = {}
+    configure_cpu_threads(args.threads, args.interop_threads)
+    model, tokenizer = get_model_and_tokenizer(
+        model_id=args.model,
+        revision=args.revision,
+        use_cache=not args.no_model_cache,
+        device=args.device,
+        quantization=args.quantization,
+        timings=timings,
+    )
+    if args.speculative == 'draft':
+        args.draft = get_draft_model(args.draft_model, device=args.device, timings=timings)
+    return model, tokenizer, timings
+
+
+def run_one(model, tokenizer, prompt: str, temperature: float, max_new_tokens: int, **thread_kwargs) -> dict:
+    """Одна генерация через StreamingThread.run в текущем потоке"""
+    errors = []
+    thread = StreamingThread(model, tokenizer, prompt, temperature, max_new_tokens=max_new_tokens, **thread_kwargs)
+    thread.error_occurred.connect(errors.append)
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    thread.run()
+    finished = time.perf_counter()
+    if errors:
+        raise RuntimeError(errors[0])
+
+    streamer = thread.streamer
+    times = streamer.token_times
+    tokens = len(streamer.token_ids)
+    # Интервалы между порциями: при спекулятивном декодировании порция - несколько токенов
+    inter_token = [b - a for a, b in zip(times, times[1:])]
+    return {
+        'prompt_tokens': len(tokenizer(prompt)['input_ids']),
+        'new_tokens': tokens,
+        'token_ids': streamer.token_ids,
+        'ttft': times[0] - thread.started_at if times else None,
+        'itl': inter_token,
+        'total_time': finished - thread.started_at,
+        'tokens_per_second': tokens / (finished - thread.started_at) if tokens else 0.0,
+        'decode_tokens_per_second': (tokens - 1) / (times[-1] - times[0]) if len(times) > 1 else None,
+        'decode_steps': len(times),
+        'device_peak_bytes': torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None,
+    }
+
+
+def summarize(runs: list[dict]) -> dict:
+    inter_token = [value for run in runs for value in run['itl']]
+    ttft = [run['ttft'] for run in runs if run['ttft'] is not None]
+    decode = [run['decode_tokens_per_second'] for run in runs if run['decode_tokens_per_second']]
+    device_peak = [run['device_peak_bytes'] for run in runs if run['device_peak_bytes'] is not None]
+    return {
+        'runs': len(runs),
+        'new_tokens': sum(run['new_tokens'] for run in runs),
+        'ttft_p50': percentile(ttft, 50),
+        'ttft_p95': percentile(ttft, 95),
+        'itl_p50': percentile(inter_token, 50),
+        'itl_p95': percentile(inter_token, 95),
+        'itl_p99': percentile(inter_token, 99),
+        'tokens_per_second': sum(run['new_tokens'] for run in runs) / sum(run['total_time'] for run in runs),
+        'decode_tokens_per_second': sum(decode) / len(decode) if decode else None,
+        'device_peak_bytes': max(device_peak) if device_peak else None,
+        **speculative_stats(sum(run['new_tokens'] for run in runs), sum(run['decode_steps'] for run in runs)),
+    }
+
+
+def compare(result: dict, baseline: dict) -> None:
+    print('vs baseline:')
+    previous = {case['name']: case['summary'] for case in baseline['cases']}
+    for case in result['cases']:
+        old = previous.get(case['name'])
+        if old is None:
+            continue
+        for metric in ('ttft_p50', 'itl_p50', 'itl_p99', 'tokens_per_second', 'tokens_per_step'):
+            if case['summary'][metric] and old[metric]:
+                change = (case['summary'][metric] / old[metric] - 1) * 100
+                print(f'  {case["name"]:<28} {metric:<18} {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--prompts', help='JSONL с полем "prompt"; по умолчанию встроенный набор')
+    parser.add_argument('--temperatures', type=float, nargs='+', default=[0.0])
+    parser.add_argument('--max-new-tokens', type=int, nargs='+', default=[64])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--output', help='файл для JSON с результатами (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, encoding='utf-8') as file:
+            prompts = [json.loads(line)['prompt'] for line in file if line.strip()]
+
+    model, tokenizer, load_timings = load_model(args)
+    speculative = {'speculative': args.speculative, 'draft_model': getattr(args, 'draft', None)}
+    for _ in range(args.warmup):
+        run_one(model, tokenizer, prompts[0], 0.0, 8, **speculative)
+
+    cases = []
+    for temperature in args.temperatures:
+        for max_new_tokens in args.max_new_tokens:
+            runs = [
+                run_one(model, tokenizer, prompt, temperature, max_new_tokens, **speculative)
+                for _ in range(args.repeat)
+                for prompt in prompts
+            ]
+            summary = summarize(runs)
+            name = f't={temperature:g} max_new_tokens={max_new_tokens}'
+            cases.append({'name': name, 'temperature': temperature, 'max_new_tokens': max_new_tokens,
+                          'summary': summary})
+            print(f'{name:<28} ttft_p50={summary["ttft_p50"] * 1000:7.1f}ms '
+                  f'itl_p50={(summary["itl_p50"] or 0) * 1000:6.2f}ms '
+                  f'itl_p99={(summary["itl_p99"] or 0) * 1000:6.2f}ms '
+                  f'{summary["tokens_per_second"]:7.1f} tok/s '
+                  f'{summary["tokens_per_step"] or 0:5.2f} tok/step', file=sys.stderr)
+
+    result = {
+        'model': args.model,
+        'device': str(model.device),
+        'quantization': load_timings['quantization'],
+        'speculative': args.speculative,
+        'draft_model': args.draft_model if args.speculative == 'draft' else None,
+        'threads': torch.get_num_threads(),
+        'interop_threads': torch.get_num_interop_threads(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'load_timings': load_timings,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'cases': cases,
+    }
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            compare(result, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
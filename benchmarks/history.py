@@ -0,0 +1,104 @@
+"""
+Бенчмарк истории диалогов: скорость записи потоковых токенов, время открытия
+большой базы, первой страницы и полнотекстового поиска.
+
+    python -m benchmarks.history --turns 100000 --tokens 200
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from src.history import HistoryStore
+
+
+WORDS = ('модель токен квантование память контекст генерация ответ промпт кэш '
+         'внимание слой вес градиент батч декодирование поток окно формула').split()
+
+
+def text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def populate(store: HistoryStore, turns: int, rng: random.Random) -> float:
+    """Заполнение базы готовыми ходами (по 20 на сессию); возвращает ходов в секунду"""
+    start = time.perf_counter()
+    session_id = None
+    for i in range(turns):
+        if i % 20 == 0:
+            session_id = store.start_session()
+        turn_id = store.start_turn(session_id, text(rng, 12), 'bench', {'temperature': 0.5})
+        store.append(turn_id, text(rng, 80))
+        store.finish_turn(turn_id, 'eos', {'ttft': 0.1})
+    store.flush()
+    return turns / (time.perf_counter() - start)
+
+
+def bench_stream(store: HistoryStore, tokens: int, rate: float | None, rng: random.Random) -> dict:
+    """Запись одного ответа по токену, как из update_response; rate - токенов в секунду"""
+    session_id = store.start_session()
+    turn_id = store.start_turn(session_id, text(rng, 12))
+    commits = store.stats['commits']
+    latencies = []
+    start = time.perf_counter()
+    for i in range(tokens):
+        call = time.perf_counter()
+        store.append(turn_id, rng.choice(WORDS) + ' ')
+        latencies.append(time.perf_counter() - call)
+        if rate:
+            time.sleep(max(0.0, start + (i + 1) / rate - time.perf_counter()))
+    store.finish_turn(turn_id, 'eos')
+    store.flush()
+    elapsed = time.perf_counter() - start
+    return {
+        'tokens_per_second': tokens / elapsed,
+        'append_p99_us': sorted(latencies)[int(len(latencies) * 0.99)] * 1e6,
+        'commits': store.stats['commits'] - commits,
+    }
+
+
+def timed(function, repeats: int) -> tuple[float, float]:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=100000)
+    parser.add_argument('--tokens', type=int, default=2000, help='токенов в потоковом ответе')
+    parser.add_argument('--rate', type=float, default=None, help='токенов в секунду при потоковой записи')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--path', default=None, help='файл базы (по умолчанию во временном каталоге)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    path = args.path or os.path.join(tempfile.mkdtemp(), 'history.sqlite3')
+    store = HistoryStore(path)
+    print(f'populate: {populate(store, args.turns, rng):.0f} turns/s ({args.turns} turns, {path})')
+    stream = bench_stream(store, args.tokens, args.rate, rng)
+    print(f"stream: {stream['tokens_per_second']:.0f} tokens/s, append p99 {stream['append_p99_us']:.1f} us, "
+          f"{stream['commits']} commits for {args.tokens} tokens")
+    store.close()
+
+    start = time.perf_counter()
+    store = HistoryStore(path)
+    print(f'open: {(time.perf_counter() - start) * 1000:.1f} ms, size {os.path.getsize(path) / 2 ** 20:.1f} MB')
+    first_page = store.page()
+    print('first page: p50 {:.2f} ms, p95 {:.2f} ms'.format(*(value * 1000 for value in timed(store.page, args.repeats))))
+    print('deep page: p50 {:.2f} ms, p95 {:.2f} ms'.format(*(value * 1000 for value in timed(
+        lambda: store.page(before=first_page[-1]['id'] - args.turns // 2), args.repeats))))
+    for query in ('квантование', 'кэш память', 'декод'):
+        p50, p95 = timed(lambda: store.search(query), args.repeats)
+        print(f'search {query!r}: p50 {p50 * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms')
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
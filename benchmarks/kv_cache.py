@@ -0,0 +1,87 @@
+"""
+Бенчмарк режимов хранения KV-кэша (src/kv_cache.py): длинный промпт и ответ
+в жадном режиме для каждого режима. Печатается размер кэша на токен, скорость
+декодирования и её потеря относительно full, а также сколько первых токенов
+ответа совпало с full - квантование может изменить ответ.
+
+    python -m benchmarks.kv_cache --model /tmp/tiny-llama --device cpu --context 4096 --max-new-tokens 128
+
+offload имеет смысл только на CUDA, без неё режим пропускается.
+"""
+import argparse
+import json
+
+from benchmarks.generation import add_model_arguments, load_model, run_one
+from src.chat_session import ChatSession
+from src.kv_cache import cache_mode, cache_nbytes, resolve_kv_cache_mode
+
+PARAGRAPH = ('Квантование KV-кэша уменьшает память на токен контекста, но каждый шаг декодирования '
+             'распаковывает кэш слоя. Выгрузка в ОЗУ копирует слои на устройство перед их проходом. ')
+
+
+def long_prompt(tokenizer, tokens: int) -> str:
+    ids = tokenizer(PARAGRAPH * (tokens // 8 + 1), add_special_tokens=False)['input_ids'][:tokens]
+    return tokenizer.decode(ids) + '\n\nПерескажи текст выше.'
+
+
+def matching_prefix(a: list[int], b: list[int]) -> int:
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--context', type=int, default=4096, help='токенов в промпте')
+    parser.add_argument('--max-new-tokens', type=int, default=128)
+    parser.add_argument('--modes', nargs='+', default=['full', 'int8', 'int4', 'offload'],
+                        choices=('full', 'int8', 'int4', 'offload'))
+    args = parser.parse_args()
+
+    model, tokenizer, _ = load_model(args)
+    prompt = long_prompt(tokenizer, args.context)
+    run_one(model, tokenizer, 'Привет', 0.0, 8)
+
+    results = []
+    reference = None
+    for mode in args.modes:
+        if resolve_kv_cache_mode(mode, model, 0) != mode:
+            results.append({'mode': mode, 'skipped': f'нужна CUDA, модель на {model.device}'})
+            continue
+        session = ChatSession(tokenizer, max_context_tokens=args.context * 2 + args.max_new_tokens,
+                              reserve_tokens=args.max_new_tokens)
+        run = run_one(model, tokenizer, prompt, 0.0, args.max_new_tokens,
+                      session=session, kv_cache=mode, speculative='none')
+        cache = session.cache
+        tokens = cache.get_seq_length()
+        result = {
+            'mode': cache_mode(cache),
+            'cache_tokens': tokens,
+            'cache_bytes': cache_nbytes(cache),
+            'cache_bytes_per_token': round(cache_nbytes(cache) / tokens, 1),
+            'prefill_seconds': round(run['ttft'], 3),
+            'decode_tokens_per_second': round(run['decode_tokens_per_second'], 1),
+            'device_peak_bytes': run['device_peak_bytes'],
+        }
+        if reference is None:
+            reference = (run['decode_tokens_per_second'], run['token_ids'], result['cache_bytes_per_token'])
+        else:
+            result['throughput_cost'] = round(1 - run['decode_tokens_per_second'] / reference[0], 3)
+            result['compression'] = round(reference[2] / result['cache_bytes_per_token'], 2)
+            result['matching_prefix_tokens'] = matching_prefix(run['token_ids'], reference[1])
+        results.append(result)
+        del session, cache
+    print(json.dumps({
+        'device': str(model.device),
+        'dtype': str(model.dtype),
+        'prompt_tokens': args.context,
+        'new_tokens': args.max_new_tokens,
+        'baseline': args.modes[0],
+        'modes': results,
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Нагрузочный тест OpenAI-совместимого сервера (server.py): для каждого уровня
+параллелизма запускает N клиентов со стримингом и считает суммарную пропускную
+способность и перцентили задержек.
+
+    python server.py --device cpu --model /tmp/tiny-llama &
+    python -m benchmarks.load_test --concurrency 1 4 16 --requests 8
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+from benchmarks.generation import DEFAULT_PROMPTS, percentile
+
+
+def stream_completion(url: str, prompt: str, max_tokens: int, temperature: float) -> dict:
+    body = json.dumps({
+        'messages': [{'role': 'user', 'content': prompt}],
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'stream': True,
+    }).encode()
+    request = urllib.request.Request(f'{url}/v1/chat/completions', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    first_token = None
+    usage = {}
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            line = line.strip()
+            if not line.startswith(b'data: ') or line == b'data: [DONE]':
+                continue
+            event = json.loads(line[6:])
+            if 'error' in event:
+                raise RuntimeError(event['error']['message'])
+            if first_token is None and event['choices'][0].get('delta', {}).get('content'):
+                first_token = time.perf_counter()
+            usage = event.get('usage', usage)
+    end = time.perf_counter()
+    return {
+        'ttft': (first_token or end) - start,
+        'latency': end - start,
+        'completion_tokens': usage.get('completion_tokens', 0),
+    }
+
+
+def run_level(url: str, concurrency: int, requests: int, max_tokens: int, temperature: float) -> dict:
+    results = []
+    failures = []
+    lock = threading.Lock()
+
+    def client(index: int):
+        for i in range(requests):
+            try:
+                result = stream_completion(url, DEFAULT_PROMPTS[(index + i) % len(DEFAULT_PROMPTS)],
+                                           max_tokens, temperature)
+            except Exception as e:
+                with lock:
+                    failures.append(f'{type(e).__name__}: {e}')
+                continue
+            with lock:
+                results.append(result)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    tokens = sum(result['completion_tokens'] for result in results)
+    latency = [result['latency'] for result in results]
+    ttft = [result['ttft'] for result in results]
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'failed': len(failures),
+        'errors': sorted(set(failures)),
+        'completion_tokens': tokens,
+        'elapsed': elapsed,
+        'tokens_per_second': tokens / elapsed,
+        'requests_per_second': len(results) / elapsed,
+        'latency_p50': percentile(latency, 50),
+        'latency_p95': percentile(latency, 95),
+        'latency_p99': percentile(latency, 99),
+        'ttft_p50': percentile(ttft, 50),
+        'ttft_p95': percentile(ttft, 95),
+    }
+
+
+def seconds(value: float | None) -> str:
+    return '-' if value is None else f'{value:.3f}s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=4, help='запросов на одного клиента')
+    parser.add_argument('--max-tokens', type=int, default=64)
+    parser.add_argument('--temperature', type=float, default=0.7)
+    parser.add_argument('--output', help='файл для JSON с результатами')
+    args = parser.parse_args()
+
+    levels = []
+    print(f'{"clients":>7} {"requests":>8} {"failed":>6} {"tok/s":>8} {"req/s":>6} {"ttft p50":>9} '
+          f'{"lat p50":>8} {"lat p95":>8} {"lat p99":>8}')
+    for concurrency in args.concurrency:
+        level = run_level(args.url, concurrency, args.requests, args.max_tokens, args.temperature)
+        levels.append(level)
+        print(f'{concurrency:>7} {level["requests"]:>8} {level["failed"]:>6} {level["tokens_per_second"]:>8.1f} '
+              f'{level["requests_per_second"]:>6.2f} {seconds(level["ttft_p50"]):>9} {seconds(level["latency_p50"]):>8} '
+              f'{seconds(level["latency_p95"]):>8} {seconds(level["latency_p99"]):>8}')
+        for error in level['errors']:
+            print(f'        {error}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(levels, file, indent=2)
+    # Пропускная способность и задержки по неполному набору запросов ничего не значат
+    for concurrency, level in zip(args.concurrency, levels):
+        expected = concurrency * args.requests
+        assert level['requests'] == expected, \
+            f'{concurrency} клиентов: выполнено {level["requests"]} запросов из {expected}'
+
+
+if __name__ == '__main__':
+    main()
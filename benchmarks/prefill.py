@@ -0,0 +1,100 @@
+"""
+Пик памяти и время префилла длинного промпта с разбиением на куски и без.
+Каждый случай запускается отдельным процессом, чтобы пиковый RSS не смешивался.
+Логиты первого токена сверяются с префиллом без разбиения с допуском --atol:
+куски меняют только порядок сложений.
+
+    python -m benchmarks.tiny_model /tmp/tiny-long --context 65536
+    python -m benchmarks.prefill --model /tmp/tiny-long --device cpu --lengths 4096 16384 --chunks 0 1024
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import torch
+
+from benchmarks.generation import add_model_arguments, load_model, peak_rss_bytes
+from src.streaming_thread import StreamingThread
+
+
+def run_case(args: argparse.Namespace) -> dict:
+    model, tokenizer, _ = load_model(args)
+    # Один и тот же промпт во всех процессах: ответы разных случаев сравниваются между собой
+    generator = torch.Generator().manual_seed(args.length)
+    prompt_ids = torch.randint(3, len(tokenizer), (args.length,), generator=generator).tolist()
+    prompt = tokenizer.decode(prompt_ids)
+    rss_before = peak_rss_bytes()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    errors, progress, logits = [], [], []
+    # Логиты последней позиции каждого прохода: первые len(progress) - 1 - куски префилла
+    hook = model.register_forward_hook(lambda module, inputs, output: logits.append(output.logits[0, -1].float()))
+    thread = StreamingThread(model, tokenizer, prompt, 0.0, max_new_tokens=args.max_new_tokens,
+                             speculative='none', prefill_chunk_tokens=args.chunk or None)
+    thread.error_occurred.connect(errors.append)
+    thread.prefill_progress.connect(lambda done, total: progress.append((time.perf_counter(), done)))
+    thread.run()
+    hook.remove()
+    if errors:
+        return {'error': errors[0]}
+    times = thread.streamer.token_times
+    return {
+        'prompt_tokens': len(tokenizer(prompt)['input_ids']),
+        'ttft': times[0] - thread.started_at if times else None,
+        'first_progress': progress[0][0] - thread.started_at if progress else None,
+        'progress_events': len(progress),
+        'peak_rss_growth_bytes': peak_rss_bytes() - rss_before,
+        'device_peak_bytes': torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None,
+        'tokens': thread.streamer.token_ids,
+        'first_logits': logits[max(0, len(progress) - 1)].tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[2048, 8192, 32768])
+    parser.add_argument('--chunks', type=int, nargs='+', default=[0, 2048], help='0 - без разбиения')
+    parser.add_argument('--max-new-tokens', type=int, default=8)
+    parser.add_argument('--atol', type=float, default=1e-3,
+                        help='допустимое расхождение логитов первого токена с префиллом без разбиения')
+    parser.add_argument('--length', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--chunk', type=int, help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.length is not None:
+        print(json.dumps(run_case(args)))
+        return
+
+    print(f'{"length":>7} {"chunk":>6} {"ttft s":>8} {"progress s":>10} {"rss +MB":>8} {"device MB":>9} '
+          f'{"max dlogit":>10}  same')
+    failures = 0
+    for length in args.lengths:
+        reference = None
+        for chunk in args.chunks:
+            command = [sys.executable, '-m', 'benchmarks.prefill', *sys.argv[1:],
+                       '--length', str(length), '--chunk', str(chunk)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            if 'error' in result:
+                print(f'{length:>7} {chunk:>6}  error: {result["error"]}')
+                continue
+            reference = reference or result
+            # Куски меняют порядок сложений в attention и matmul, поэтому логиты сравниваются
+            # с допуском, а токены ответа могут разойтись только при почти равных кандидатах
+            drift = (torch.tensor(result['first_logits']) - torch.tensor(reference['first_logits'])).abs().max().item()
+            same = drift <= args.atol
+            failures += not same
+            device_peak = result['device_peak_bytes']
+            print(f'{length:>7} {chunk:>6} {result["ttft"]:>8.2f} '
+                  f'{result["first_progress"] if result["first_progress"] is not None else float("nan"):>10.3f} '
+                  f'{result["peak_rss_growth_bytes"] / 1024 ** 2:>8.0f} '
+                  f'{device_peak / 1024 ** 2 if device_peak is not None else float("nan"):>9.0f}  '
+                  f'{drift:>10.2e}  {same}{"" if result["tokens"] == reference["tokens"] else " (tokens differ)"}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
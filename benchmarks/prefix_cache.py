@@ -0,0 +1,79 @@
+"""
+Проверка и замер PrefixCache: запросы с общим длинным префиксом (системная
+инструкция, документ) генерируются при temperature=0 с кэшем и без него.
+Ответы должны совпадать токен в токен; печатается TTFT и статистика кэша.
+
+    python -m benchmarks.prefix_cache --model /tmp/tiny-llama --device cpu
+"""
+import argparse
+import sys
+
+from benchmarks.generation import add_model_arguments, load_model, percentile
+from src.prefix_cache import PrefixCache
+from src.streaming_thread import StreamingThread
+
+
+SHARED_PREFIX = (
+    'Ты - помощник, который отвечает кратко и по делу. Используй только факты из документа ниже.\n\n'
+    'Документ:\n' + ' '.join(f'Пункт {i}: значение параметра номер {i} равно {i * 7 % 13}.' for i in range(60))
+)
+QUESTIONS = [
+    'Чему равен параметр номер 5?',
+    'Перечисли первые три пункта.',
+    'Какой параметр самый большой?',
+    'Summarize the document in one sentence.',
+]
+
+
+def generate(model, tokenizer, prompt: str, max_new_tokens: int, prefix_cache: PrefixCache | None) -> dict:
+    errors = []
+    thread = StreamingThread(model, tokenizer, prompt, 0.0, max_new_tokens=max_new_tokens,
+                             speculative='none', prefix_cache=prefix_cache)
+    thread.error_occurred.connect(errors.append)
+    thread.run()
+    if errors:
+        raise RuntimeError(errors[0])
+    times = thread.streamer.token_times
+    return {'ids': thread.streamer.token_ids, 'ttft': times[0] - thread.started_at if times else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--max-new-tokens', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--budget-mb', type=float, default=64)
+    args = parser.parse_args()
+
+    model, tokenizer, _ = load_model(args)
+    prefix_cache = PrefixCache(budget_bytes=int(args.budget_mb * 1024 ** 2))
+    prompts = [f'{SHARED_PREFIX}\n\nВопрос: {question}' for question in QUESTIONS] * args.repeat
+    generate(model, tokenizer, prompts[0], 4, None)  # прогрев
+
+    mismatches = 0
+    ttft = {'off': [], 'on': []}
+    for prompt in prompts:
+        reference = generate(model, tokenizer, prompt, args.max_new_tokens, None)
+        cached = generate(model, tokenizer, prompt, args.max_new_tokens, prefix_cache)
+        ttft['off'].append(reference['ttft'])
+        ttft['on'].append(cached['ttft'])
+        if reference['ids'] != cached['ids']:
+            mismatches += 1
+            print(f'MISMATCH: {prompt[-40:]!r}', file=sys.stderr)
+
+    prompt_tokens = len(tokenizer(prompts[0])['input_ids'])
+    print(f'prompt ~{prompt_tokens} tokens, {len(prompts)} requests')
+    for mode in ('off', 'on'):
+        print(f'  cache {mode:<3} ttft p50={percentile(ttft[mode], 50) * 1000:7.1f}ms '
+              f'p95={percentile(ttft[mode], 95) * 1000:7.1f}ms')
+    stats = prefix_cache.stats
+    print(f"  hits={stats['hits']} misses={stats['misses']} "
+          f"hit_tokens={stats['hit_tokens']}/{stats['lookup_tokens']} "
+          f"blocks={stats['blocks']} bytes={stats['bytes'] / 1024 ** 2:.1f}MB evicted={stats['evicted_blocks']}")
+    assert stats['bytes'] <= prefix_cache.budget_bytes
+    print('OK: outputs identical' if not mismatches else f'FAIL: {mismatches} mismatches')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Бенчмарк рендера ответа: стоимость одного токена на протяжении длинного ответа.
+
+    python -m benchmarks.render --tokens 20000 --compare-full 3000
+    python -m benchmarks.render --math 200
+
+--math N рендерит ответ из N формул дважды: с пустым кэшем формул и с заполненным.
+"""
+import argparse
+import itertools
+import time
+
+from markdown import markdown
+
+from src.renderer import IncrementalMarkdown, markdown as render_answer, render_math
+
+
+SAMPLE = """## Раздел {n}
+
+Обычный абзац текста с **выделением**, `кодом` и формулой $x^{n} + y^2$, который
+продолжается на второй строке и заканчивается точкой.
+
+- пункт списка {n}
+- ещё один пункт
+
+```python
+def f(x):
+
+    return x * {n}
+```
+
+"""
+
+
+def tokens(count: int):
+    """Поток «токенов» по 1-4 символа, как у реального стримера"""
+    text = itertools.cycle(SAMPLE.format(n=n) for n in range(1000))
+    produced = 0
+    for chunk in text:
+        pos = 0
+        while pos < len(chunk):
+            size = 1 + (pos + produced) % 4
+            yield chunk[pos:pos + size]
+            pos += size
+            produced += 1
+            if produced >= count:
+                return
+
+
+def bench_incremental(count: int, bucket: int) -> list[float]:
+    renderer = IncrementalMarkdown()
+    result = []
+    start = time.perf_counter()
+    for i, token in enumerate(tokens(count), 1):
+        renderer.feed(token)
+        if i % bucket == 0:
+            now = time.perf_counter()
+            result.append((now - start) / bucket)
+            start = now
+    return result
+
+
+def bench_full(count: int, bucket: int) -> list[float]:
+    answer = ''
+    result = []
+    start = time.perf_counter()
+    for i, token in enumerate(tokens(count), 1):
+        answer += token
+        markdown(answer)
+        if i % bucket == 0:
+            now = time.perf_counter()
+            result.append((now - start) / bucket)
+            start = now
+    return result
+
+
+MATH_SAMPLE = r"""Шаг {n}: $\sum_{{k=1}}^{{{n}}} k^2 = \frac{{n(n+1)(2n+1)}}{{6}}$, где $n = {n}$.
+
+$$\int_0^{{{n}}} e^{{-x^2}} \, dx \approx \sqrt{{\pi}} / 2$$
+
+"""
+
+
+def bench_math(count: int) -> tuple[float, float]:
+    answer = ''.join(MATH_SAMPLE.format(n=n) for n in range(count))
+    render_math.cache_clear()
+    start = time.perf_counter()
+    render_answer(answer)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    render_answer(answer)
+    warm = time.perf_counter() - start
+    return cold, warm
+
+
+def report(title: str, per_token: list[float], bucket: int) -> None:
+    print(title)
+    for i, value in enumerate(per_token, 1):
+        print(f'  tokens {i * bucket:>6}: {value * 1e6:8.1f} us/token')
+    if per_token:
+        print(f'  last/first bucket ratio: {per_token[-1] / per_token[0]:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tokens', type=int, default=20000)
+    parser.add_argument('--bucket', type=int, default=2000)
+    parser.add_argument('--compare-full', type=int, default=0, metavar='N',
+                        help='также замерить полный ре-рендер на первых N токенах')
+    parser.add_argument('--math', type=int, default=0, metavar='N',
+                        help='замерить рендер ответа из N абзацев с формулами без кэша и с кэшем')
+    args = parser.parse_args()
+
+    if args.math:
+        cold, warm = bench_math(args.math)
+        info = render_math.cache_info()
+        print(f'math: cold {cold * 1000:.1f} ms, warm {warm * 1000:.1f} ms '
+              f'({cold / warm:.1f}x), formulas cached {info.currsize}')
+        return
+    report('incremental', bench_incremental(args.tokens, args.bucket), args.bucket)
+    if args.compare_full:
+        bucket = max(1, min(args.bucket, args.compare_full // 5))
+        report('full re-render', bench_full(args.compare_full, bucket), bucket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Проверка ResponseCache: прогон набора промптов при temperature=0 дважды -
+второй раз ответы должны прийти из кэша и совпасть с первым прогоном
+токен в токен. Печатает время обоих прогонов и счётчики кэша.
+
+    python -m benchmarks.response_cache --model /tmp/tiny-llama --device cpu
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from benchmarks.generation import add_model_arguments, DEFAULT_PROMPTS, load_model
+from src.chat_session import ChatSession
+from src.response_cache import model_fingerprint, ResponseCache
+from src.streaming_thread import StreamingThread
+
+
+def generate(model, tokenizer, prompt: str, max_new_tokens: int, cache: ResponseCache,
+             session: ChatSession | None = None) -> dict:
+    errors, parts = [], []
+    thread = StreamingThread(model, tokenizer, prompt, 0.0, max_new_tokens=max_new_tokens,
+                             session=session, response_cache=cache)
+    thread.error_occurred.connect(errors.append)
+    thread.update_response.connect(parts.append)
+    thread.run()
+    if errors:
+        raise RuntimeError(errors[0])
+    return {'ids': thread.streamer.token_ids, 'text': ''.join(parts), 'reason': thread.stop_reason,
+            'hit': thread.cache_hit}
+
+
+def run(model, tokenizer, prompts: list[str], max_new_tokens: int, cache: ResponseCache) -> tuple[list, float]:
+    start = time.perf_counter()
+    results = [generate(model, tokenizer, prompt, max_new_tokens, cache) for prompt in prompts]
+    # Диалог: второй ход зависит от ответа на первый, в том числе взятого из кэша
+    session = ChatSession(tokenizer)
+    results += [generate(model, tokenizer, prompt, max_new_tokens, cache, session) for prompt in prompts[:2]]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    args = parser.parse_args()
+
+    model, tokenizer, _ = load_model(args)
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(root=directory)
+        cache.set_model(model_fingerprint(model))
+        cold, cold_time = run(model, tokenizer, DEFAULT_PROMPTS, args.max_new_tokens, cache)
+        warm, warm_time = run(model, tokenizer, DEFAULT_PROMPTS, args.max_new_tokens, cache)
+        for first, second in zip(cold, warm):
+            if first['hit'] or not second['hit'] or (first['ids'], first['text'], first['reason']) != (
+                    second['ids'], second['text'], second['reason']):
+                failures += 1
+        print(f'cold {cold_time:.2f}s, warm {warm_time:.2f}s, hit rate {cache.hit_rate:.0%}, stats {cache.stats}')
+
+        # Другая модель не видит чужих ответов, а при возврате к первой её записи на месте
+        fingerprint = cache.fingerprint
+        cache.set_model('another-model')
+        other = generate(model, tokenizer, DEFAULT_PROMPTS[0], args.max_new_tokens, cache)
+        if other['hit']:
+            failures += 1
+            print('FAIL: answer of another model replayed', file=sys.stderr)
+        cache.set_model(fingerprint)
+        back = generate(model, tokenizer, DEFAULT_PROMPTS[0], args.max_new_tokens, cache)
+        if not back['hit']:
+            failures += 1
+            print('FAIL: entries lost after switching models back', file=sys.stderr)
+    print('OK' if not failures else f'FAIL: {failures} problems')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Отчёт о времени импорта при старте GUI (на основе python -X importtime) и проверка,
+что тяжёлые модули (torch, transformers, ...) не импортируются в потоке окна.
+Импорт main.py - это код уровня модуля; затем в отдельном процессе с
+QT_QPA_PLATFORM=offscreen строится MainWindow, как в main(), и до конца загрузки
+модели записывается, какой поток впервые импортировал каждый тяжёлый модуль:
+загрузчик в фоне может, поток окна - нет.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --top 30 --module main --load-timeout 300
+"""
+import argparse
+import importlib.abc
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from src.warmup import HEAVY_MODULES
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """(модуль, собственное время мкс, накопленное время мкс) в порядке импорта"""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, env=env)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return rows
+
+
+def window_imports(load_timeout: float) -> None:
+    """
+    Выполняется в отдельном процессе: строит и показывает MainWindow, ждёт конца
+    загрузки модели (или load_timeout секунд) и печатает JSON - в каком потоке
+    впервые импортирован каждый тяжёлый модуль и какие были в sys.modules при показе окна
+    """
+    first_import = {}
+
+    class ImportRecorder(importlib.abc.MetaPathFinder):
+        def find_spec(self, name, path, target=None):
+            if name in HEAVY_MODULES and name not in first_import:
+                first_import[name] = threading.current_thread().name
+            return None
+
+    sys.meta_path.insert(0, ImportRecorder())
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from PyQt6.QtWidgets import QApplication
+
+    import main as gui
+
+    app = QApplication(sys.argv[:1])
+    window = gui.MainWindow()
+    window.show()
+    app.processEvents()
+    at_show = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    loop = QEventLoop()
+    outcome = {'load': 'timeout'}
+    if window.registry is not None:
+        ready, failed = window.registry.ready, window.registry.failed
+    else:
+        ready, failed = window.worker.model_loaded, window.worker.load_error
+    ready.connect(lambda *args: (outcome.update(load='ready'), loop.quit()))
+    failed.connect(lambda *args: (outcome.update(load='failed'), loop.quit()))
+    QTimer.singleShot(round(load_timeout * 1000), loop.quit)
+    loop.exec()
+    print(json.dumps({'first_import': first_import, 'at_show': at_show, **outcome}), flush=True)
+    # Потоки загрузки и телеметрии не ждём
+    os._exit(0)
+
+
+def check_window(load_timeout: float) -> dict:
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    result = subprocess.run([sys.executable, '-c',
+                             f'from benchmarks.startup import window_imports; window_imports({load_timeout!r})'],
+                            capture_output=True, text=True, env=env)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError((result.stderr.strip().splitlines() or ['no output'])[-1])
+    return json.loads(lines[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main', help='модуль, импорт которого замеряется')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--load-timeout', type=float, default=120.0,
+                        help='сколько секунд ждать загрузки модели после показа окна')
+    args = parser.parse_args()
+
+    rows = import_times(args.module)
+    top_level = [row for row in rows if '.' not in row[0]]
+    total = sum(row[1] for row in rows)
+    print(f'import {args.module}: {total / 1e6:.2f}s, {len(rows)} modules')
+    print(f'{"cumulative ms":>13} {"self ms":>8}  module')
+    for name, self_us, cumulative_us in sorted(top_level, key=lambda row: -row[2])[:args.top]:
+        print(f'{cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {name}')
+
+    imported = {row[0] for row in rows}
+    heavy = [name for name in HEAVY_MODULES if name in imported]
+    if heavy:
+        print(f'FAIL: heavy modules imported by import {args.module}: {", ".join(heavy)}')
+        sys.exit(1)
+
+    window = check_window(args.load_timeout)
+    print(f'window shown with {", ".join(window["at_show"]) or "no heavy modules"} loaded; '
+          f'model load: {window["load"]}')
+    for name, thread in window['first_import'].items():
+        print(f'  {name} first imported in {thread}')
+    on_gui_thread = [name for name, thread in window['first_import'].items() if thread == 'MainThread']
+    if on_gui_thread:
+        print(f'FAIL: heavy modules imported in the window thread: {", ".join(on_gui_thread)}')
+        sys.exit(1)
+    print('OK: no heavy modules imported in the window thread')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Проверка и замер PyQtStreamer: текст, собранный из сигналов, должен совпадать
+с полным декодированием тех же токенов.
+
+    python -m benchmarks.streamer --model path/to/model
+"""
+import argparse
+import random
+import sys
+import time
+
+import torch
+from transformers import AutoTokenizer
+
+from src.streamer import PyQtStreamer
+
+
+SAMPLES = [
+    'Hello, world! This is a plain English sentence with  double  spaces.',
+    'Привет, мир! Кириллица собирается из многобайтных токенов.',
+    'Emoji 🤖🚀 и иероглифы 漢字かな混じり文 в одной строке.',
+    'def f(x):\n    return x ** 2  # код с отступами\n\n$$\\int_0^1 x^2 dx$$',
+]
+
+
+class Collector:
+    def __init__(self):
+        self.chunks: list[str] = []
+
+    def emit(self, text: str) -> None:
+        self.chunks.append(text)
+
+
+def stream(tokenizer, ids: list[int], step_sizes, **kwargs) -> tuple[str, int, float]:
+    collector = Collector()
+    streamer = PyQtStreamer(tokenizer, collector, **kwargs)
+    streamer.put(torch.tensor([ids[:1]]))  # запрос
+    start = time.perf_counter()
+    pos = 1
+    while pos < len(ids):
+        step = next(step_sizes)
+        streamer.put(torch.tensor(ids[pos:pos + step]))
+        pos += step
+    streamer.end()
+    return ''.join(collector.chunks), len(collector.chunks), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', required=True, help='id или путь к токенизатору')
+    parser.add_argument('--repeat', type=int, default=50, help='повторить образцы для длинного ответа')
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    rng = random.Random(0)
+    failed = False
+    for sample in SAMPLES + ['\n\n'.join(SAMPLES) * args.repeat]:
+        ids = tokenizer.encode(sample, add_special_tokens=False)
+        expected = tokenizer.decode(ids[1:], skip_special_tokens=True)
+        for name, steps, kwargs in (
+                ('per token', iter(lambda: 1, None), {'batch_tokens': 1, 'batch_interval': 0.0}),
+                ('batched', iter(lambda: 1, None), {}),
+                ('multi-token', iter(lambda: rng.randint(1, 4), None), {}),
+        ):
+            text, emits, elapsed = stream(tokenizer, ids, steps, **kwargs)
+            ok = text == expected
+            failed |= not ok
+            print(f'{"OK  " if ok else "FAIL"} {name:<12} tokens={len(ids) - 1:>6} emits={emits:>6} '
+                  f'{elapsed / max(1, len(ids) - 1) * 1e6:7.1f} us/token')
+            if not ok:
+                print(f'  expected: {expected[:80]!r}\n  got:      {text[:80]!r}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
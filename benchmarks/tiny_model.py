@@ -0,0 +1,70 @@
+"""
+Создать крошечную случайно инициализированную Llama-модель с BPE-токенизатором
+для бенчмарков на CPU без загрузки весов из сети.
+
+    python -m benchmarks.tiny_model /tmp/tiny-llama
+"""
+import argparse
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+
+CORPUS = [
+    'The quick brown fox jumps over the lazy dog.',
+    'Съешь же ещё этих мягких французских булок, да выпей чаю.',
+    'def main():\n    print("hello, world")\n',
+    'Формула $E = mc^2$ и интеграл $\\int_0^1 x^2 dx = 1/3$.',
+]
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<s>{{ message['role'] }}: {{ message['content'] }}</s>{% endfor %}"
+    "{% if add_generation_prompt %}<s>assistant: {% endif %}"
+)
+
+
+def make_tiny_model(path: str, vocab_size: int = 512, hidden_size: int = 64,
+                    layers: int = 2, context: int = 4096, seed: int = 0) -> None:
+    tokenizer = Tokenizer(models.BPE(unk_token='<unk>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=['<unk>', '<s>', '</s>'],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tokenizer.train_from_iterator(CORPUS * 100, trainer)
+    fast_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token='<s>', eos_token='</s>', unk_token='<unk>',
+        model_input_names=['input_ids', 'attention_mask'])
+    fast_tokenizer.chat_template = CHAT_TEMPLATE
+    fast_tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(fast_tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=context,
+        bos_token_id=fast_tokenizer.bos_token_id,
+        eos_token_id=fast_tokenizer.eos_token_id,
+    )
+    LlamaForCausalLM(config).save_pretrained(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path')
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--layers', type=int, default=2)
+    parser.add_argument('--context', type=int, default=4096)
+    args = parser.parse_args()
+    make_tiny_model(args.path, hidden_size=args.hidden_size, layers=args.layers, context=args.context)
+
+
+if __name__ == '__main__':
+    main()
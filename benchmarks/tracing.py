@@ -0,0 +1,79 @@
+"""
+Накладные расходы трассировки: стоимость span() выключенного и включённого
+трассировщика и, если задана модель, скорость генерации без трассировки и с ней.
+
+    python -m benchmarks.tracing
+    python -m benchmarks.tracing --model /tmp/tiny-llama --device cpu --trace trace.json
+"""
+import argparse
+import time
+
+from benchmarks.generation import add_model_arguments, DEFAULT_PROMPTS, load_model, run_one
+from src.tracing import span, TRACER
+
+
+def bench_span(calls: int) -> dict[str, float]:
+    """Наносекунды на один with span(...) сверх пустого цикла"""
+    def loop(body) -> float:
+        start = time.perf_counter_ns()
+        body()
+        return (time.perf_counter_ns() - start) / calls
+
+    def bare():
+        for _ in range(calls):
+            pass
+
+    def traced():
+        for _ in range(calls):
+            with span('bench'):
+                pass
+
+    baseline = min(loop(bare) for _ in range(3))
+    TRACER.enable(False)
+    disabled = min(loop(traced) for _ in range(3)) - baseline
+    TRACER.enable()
+    enabled = min(loop(traced) for _ in range(3)) - baseline
+    TRACER.enable(False)
+    TRACER.clear()
+    return {'disabled_ns': disabled, 'enabled_ns': enabled}
+
+
+def bench_generation(args: argparse.Namespace) -> None:
+    model, tokenizer, _ = load_model(args)
+    run_one(model, tokenizer, DEFAULT_PROMPTS[0], 0.0, 8)
+    results = {}
+    # Чередуем режимы, чтобы дрейф частоты процессора не попал в разницу
+    for _ in range(args.repeat):
+        for enabled in (False, True):
+            TRACER.enable(enabled)
+            runs = [run_one(model, tokenizer, prompt, 0.0, args.max_new_tokens) for prompt in DEFAULT_PROMPTS]
+            totals = results.setdefault(enabled, [0, 0.0])
+            totals[0] += sum(run['new_tokens'] for run in runs)
+            totals[1] += sum(run['total_time'] for run in runs)
+    TRACER.enable(False)
+    off, on = (tokens / seconds for tokens, seconds in (results[False], results[True]))
+    print(f'generation: {off:.1f} tok/s without tracing, {on:.1f} tok/s with tracing ({(on / off - 1) * 100:+.1f}%)')
+    print(TRACER.format_summary())
+    if args.trace:
+        TRACER.export_chrome(args.trace)
+        print(f'trace saved to {args.trace}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument('--calls', type=int, default=1_000_000)
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--trace', help='сохранить трассу прогона с моделью (Chrome trace JSON)')
+    parser.add_argument('--no-generation', action='store_true', help='только микробенчмарк span()')
+    args = parser.parse_args()
+
+    cost = bench_span(args.calls)
+    print(f"span(): {cost['disabled_ns']:.0f} ns disabled, {cost['enabled_ns']:.0f} ns enabled")
+    if not args.no_generation:
+        bench_generation(args)
+
+
+if __name__ == '__main__':
+    main()
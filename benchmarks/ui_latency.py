@@ -0,0 +1,146 @@
+"""
+Бенчмарк отзывчивости GUI во время генерации: таймер кадров 16 мс в главном
+потоке и опоздание каждого срабатывания, пока модель декодирует в потоке того же
+процесса (InferenceWorker) или в отдельном процессе (ProcessInferenceWorker).
+Обработчик токенов, как в окне, разбирает ответ IncrementalMarkdown.
+
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.ui_latency --model /tmp/tiny-llama --device cpu
+"""
+import argparse
+import json
+import time
+
+from PyQt6.QtCore import QEventLoop, Qt, QTimer
+from PyQt6.QtWidgets import QApplication
+
+from src.backend import DEVICES, QUANTIZATIONS
+from src.config import Config
+from src.renderer import IncrementalMarkdown
+from src.scheduler import GenerationRequest, InferenceWorker
+
+PROMPT = 'Расскажи подробно, как устроено квантование весов языковой модели.'
+
+
+class FrameClock:
+    """Опоздание срабатываний таймера относительно расписания, пока он запущен"""
+
+    def __init__(self, interval_ms: int):
+        self.interval = interval_ms / 1000
+        self.lateness: list[float] = []
+        self._timer = QTimer()
+        self._timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self._tick)
+        self._expected = 0.0
+
+    def start(self) -> None:
+        self._expected = time.perf_counter() + self.interval
+        self._timer.start()
+
+    def stop(self) -> None:
+        self._timer.stop()
+
+    def _tick(self) -> None:
+        now = time.perf_counter()
+        self.lateness.append(max(0.0, now - self._expected))
+        # Пропущенные кадры не копятся: следующий ожидается через интервал от этого
+        self._expected = max(self._expected + self.interval, now)
+
+    def report(self) -> dict:
+        values = sorted(self.lateness)
+        if not values:
+            return {'frames': 0}
+
+        def percentile(q):
+            return round(values[min(len(values) - 1, int(q / 100 * len(values)))] * 1000, 2)
+        return {
+            'frames': len(values),
+            'late_p50_ms': percentile(50),
+            'late_p99_ms': percentile(99),
+            'late_max_ms': round(values[-1] * 1000, 2),
+            'dropped_frames': sum(1 for value in values if value > self.interval),
+        }
+
+
+def wait(loop: QEventLoop, signal) -> list:
+    result = []
+
+    def done(*args):
+        result.extend(args)
+        loop.quit()
+    signal.connect(done)
+    loop.exec()
+    signal.disconnect(done)
+    return result
+
+
+def run(mode: str, args) -> dict:
+    loop = QEventLoop()
+    load_kwargs = dict(model_id=args.model, use_cache=False, device=args.device,
+                       quantization=args.quantization, warmup=True, load_plan=False)
+    session = None
+    if mode == 'process':
+        from src.process_worker import ProcessInferenceWorker
+        worker = ProcessInferenceWorker(load_kwargs)
+        worker.start()
+        worker.load()
+        failure = []
+        worker.load_error.connect(lambda message: (failure.append(message), loop.quit()))
+        wait(loop, worker.model_loaded)
+        if failure:
+            raise RuntimeError(failure[0])
+    else:
+        from src.chat_session import ChatSession
+        from src.model_loader import load_model
+        model, tokenizer, _, _ = load_model(**load_kwargs)
+        worker = InferenceWorker(response_cache=False)
+        worker.set_model(model, tokenizer)
+        worker.start()
+        session = ChatSession(tokenizer)
+
+    clock = FrameClock(args.frame_ms)
+    view = IncrementalMarkdown()
+    tokens = 0
+    start = time.perf_counter()
+    clock.start()
+    for _ in range(args.requests):
+        # Каждый запрос - новый диалог, чтобы контекст не рос от запроса к запросу
+        if mode == 'process':
+            worker.reset_session()
+        else:
+            session.reset()
+        view.clear()
+        request = GenerationRequest(PROMPT, args.temperature, session=session, max_new_tokens=args.max_new_tokens)
+        request.update_response.connect(view.feed)
+        request.error_occurred.connect(lambda message: print(f'error: {message}'))
+        request.error_occurred.connect(loop.quit)
+        worker.submit(request)
+        wait(loop, request.generation_finished)
+        tokens += request.timings['new_tokens']
+    clock.stop()
+    elapsed = time.perf_counter() - start
+    worker.stop()
+    return {'mode': mode, 'tokens': tokens, 'tokens_per_second': round(tokens / elapsed, 1), **clock.report()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=Config.MODEL_ID)
+    parser.add_argument('--device', choices=DEVICES, default=Config.DEVICE)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=Config.QUANTIZATION)
+    parser.add_argument('--mode', choices=('thread', 'process', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--max-new-tokens', type=int, default=256)
+    parser.add_argument('--temperature', type=float, default=0.7, help='> 0, чтобы не срабатывал кэш ответов')
+    parser.add_argument('--frame-ms', type=int, default=16)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    modes = ('thread', 'process') if args.mode == 'both' else (args.mode,)
+    for mode in modes:
+        print(json.dumps(run(mode, args)))
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()
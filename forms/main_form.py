@@ -149,7 +149,14 @@ class Ui_GPT(object):
         font.setPointSize(10)
         self.btnSend.setFont(font)
         self.btnSend.setObjectName("btnSend")
-        self.gridLayout_3.addWidget(self.btnSend, 3, 0, 1, 2)
+        self.gridLayout_3.addWidget(self.btnSend, 3, 0, 1, 1)
+        self.btnStop = QtWidgets.QPushButton(parent=self.widget_5)
+        font = QtGui.QFont()
+        font.setFamily("MS Shell Dlg 2")
+        font.setPointSize(10)
+        self.btnStop.setFont(font)
+        self.btnStop.setObjectName("btnStop")
+        self.gridLayout_3.addWidget(self.btnStop, 3, 1, 1, 1)
         self.line_3 = QtWidgets.QFrame(parent=self.widget_5)
         self.line_3.setFrameShape(QtWidgets.QFrame.Shape.HLine)
         self.line_3.setFrameShadow(QtWidgets.QFrame.Shadow.Sunken)
@@ -183,5 +190,6 @@ class Ui_GPT(object):
         self.label_RAM.setText(_translate("GPT", "RAM"))
         self.textRAM.setText(_translate("GPT", "___"))
         self.btnSend.setText(_translate("GPT", "ОТПРАВИТЬ"))
+        self.btnStop.setText(_translate("GPT", "СТОП"))
 from PyQt6 import QtWebEngineWidgets
 from widgets.loader import LoaderWidget
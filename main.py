@@ -1,46 +1,125 @@
-import gc
+import argparse
 import sys
+import time
+
+START_TIME = time.perf_counter()
 
-import GPUtil
-import torch
 from PyQt6 import QtCore, QtWidgets
-from PyQt6.QtCore import Qt, QEvent, QUrl
+from PyQt6.QtCore import Qt, QEvent
 from PyQt6.QtGui import QIcon, QKeyEvent, QKeySequence, QShortcut
-from PyQt6.QtWidgets import QApplication, QMainWindow, QMessageBox, QWidget
-
-import psutil
+from PyQt6.QtWidgets import QApplication, QComboBox, QDockWidget, QMainWindow, QMessageBox, QWidget
 
 from forms.main_form import Ui_GPT
-from src.model_loader import ModelLoaderThread
-from src.streaming_thread import StreamingThread
+from src.backend import configure_cpu_threads, DEVICES, KV_CACHE_MODES, QUANTIZATIONS
+from src.model_registry import ModelRegistry
+from src.process_worker import ProcessInferenceWorker
+from src.speculative import speculative_stats, SPECULATIVE_MODES
+from src.scheduler import GenerationRequest, InferenceWorker, Priority, QueueFullError
+from src.tracing import span, TRACER
+from src.telemetry import GpuProbe, TelemetrySampler, TorchAllocatorProbe, WakeupMonitor, default_probes
+from src.warmup import HEAVY_MODULES, WarmupThread
 from utils import getGb
 from src.config import Config
+from src.history import HistoryStore
+from src.renderer import MarkdownView
+from widgets.history import HistoryPanel
 from widgets.loader import LoaderWidget
-from markdown import markdown
+
+IMPORTS_DONE = time.perf_counter()
 
 
 class MainWindow(QMainWindow, Ui_GPT):
-    def __init__(self):
+    def __init__(self,
+                 load_timings: bool = False,
+                 use_model_cache: bool = Config.MODEL_CACHE_ENABLED,
+                 device: str = Config.DEVICE,
+                 quantization: str = Config.QUANTIZATION,
+                 telemetry_export: str | None = None,
+                 speculative: str = Config.SPECULATIVE_MODE,
+                 draft_model_id: str | None = Config.DRAFT_MODEL_ID,
+                 startup_report: bool = False,
+                 history: bool = Config.HISTORY_ENABLED,
+                 trace_path: str | None = None,
+                 load_plan: bool = Config.LOAD_PLAN_ENABLED,
+                 out_of_process: bool = Config.WORKER_OUT_OF_PROCESS,
+                 compiled: bool = Config.COMPILED_DECODE,
+                 kv_cache: str = Config.KV_CACHE_MODE,
+                 ):
         super().__init__()
+        self.load_timings = load_timings
+        self.use_model_cache = use_model_cache
+        # 'auto' разрешается в потоке загрузки, чтобы не импортировать torch до показа окна
+        self.device = device
+        self.startup_report = startup_report
+        self.quantization = quantization
+        self.telemetry_export = telemetry_export
+        self.speculative = speculative
+        self.draft_model_id = draft_model_id if speculative == 'draft' else None
+        self.trace_path = trace_path
+        self.load_plan = load_plan
+        self.out_of_process = out_of_process
+        self.compiled = compiled
+        self.kv_cache = kv_cache
+        self.send_started: float | None = None
+        if trace_path:
+            TRACER.enable()
+        self.load_started = 0.0
 
         self.model = None
         self.tokenizer = None
+        self.model_name: str | None = None  # загруженная модель; в режиме --out-of-process самой модели здесь нет
+        self.draft_model = None
+        self.session = None
+        self.request: GenerationRequest | None = None
+        self.registry: ModelRegistry | None = None
+        self.pending_entry = None  # загруженная модель, на которую переключимся после текущего ответа
+        if out_of_process:
+            # Модель, диалог и кэши живут в процессе модели, сюда приходят только токены
+            self.worker = ProcessInferenceWorker(dict(use_cache=use_model_cache, device=device,
+                                                      quantization=quantization, draft_model_id=self.draft_model_id,
+                                                      load_plan=load_plan, compiled=compiled))
+            self.worker.plan_ready.connect(self.on_load_plan)
+            self.worker.model_loaded.connect(self.on_worker_loaded)
+            self.worker.load_error.connect(self.on_model_error)
+            self.worker.crashed.connect(self.on_worker_crashed)
+        else:
+            self.worker = InferenceWorker()
+            self.registry = ModelRegistry(use_cache=use_model_cache, device=device, quantization=quantization,
+                                          draft_model_id=self.draft_model_id, load_plan=load_plan, compiled=compiled)
+            self.registry.loading.connect(self.on_model_loading)
+            self.registry.ready.connect(self.on_model_ready)
+            self.registry.failed.connect(self.on_registry_error)
+            self.registry.plan_ready.connect(self.on_load_plan)
+            self.registry.timings_ready.connect(self.on_load_timings)
+            self.registry.changed.connect(self.updateModelPicker)
+            self.registry.unloading.connect(self.on_model_unloading)
+        self.worker.start()
+        self.history = HistoryStore() if history else None
+        self.history_session_id: int | None = None
+        self.history_turn_id: int | None = None
 
         self.initUi()
         self.temperature: float = 0.5
         self.changeTemperature()
-        self.answer = ''
 
         self.reloadBtn.clicked.connect(self.reload_model)
         self.sliderTemperatureModel.valueChanged.connect(self.changeTemperature)
         self.btnPastPrompt.clicked.connect(self.slotPastPrompt)
         self.btnSend.clicked.connect(self.generate_response)
+        self.btnStop.clicked.connect(self.stop_generation)
+        self.newChatShortcut = QShortcut(QKeySequence.StandardKey.New, self)
+        self.newChatShortcut.activated.connect(self.new_chat)
+        self.traceShortcut = QShortcut(QKeySequence('Ctrl+Shift+T'), self)
+        self.traceShortcut.activated.connect(self.toggleTracing)
+        if self.history is not None:
+            self.historyShortcut = QShortcut(QKeySequence('Ctrl+H'), self)
+            self.historyShortcut.activated.connect(lambda: self.historyDock.setVisible(not self.historyDock.isVisible()))
 
         self.setUIEnabled(False)
-        self.timer = QtCore.QTimer()
-        self.timer.setInterval(Config.GPU_CPU_UPDATE_INTERVAL)
-        self.timer.timeout.connect(self.updateGPU_RAM)
-        self.timer.start()
+        # Своего таймера у окна нет: показатели обновляются по новым сэмплам телеметрии
+        self.sampler = TelemetrySampler(default_probes(self.device))
+        self.sampler.sampled.connect(self.updateGPU_RAM)
+        self.sampler.start()
         self.inputPrompt.installEventFilter(self)
 
         self.start_model_loading()
@@ -50,9 +129,34 @@ class MainWindow(QMainWindow, Ui_GPT):
 
     def initUi(self):
         self.setupUi(self)
+        self.markdownView = MarkdownView(self.resultView)
+        self.markdownView.painted.connect(self.on_answer_painted)
+        if self.history is not None:
+            # Панель скрыта до Ctrl+H, поэтому база не читается при запуске
+            self.historyPanel = HistoryPanel(self.history)
+            self.historyPanel.turn_selected.connect(self.show_history_turn)
+            self.historyDock = QDockWidget('История', self)
+            self.historyDock.setObjectName('historyDock')
+            self.historyDock.setWidget(self.historyPanel)
+            self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.historyDock)
+            self.historyDock.hide()
+        self.modelPicker = QComboBox(self.reload_panel)
+        self.modelPicker.setEditable(True)  # можно ввести id модели с хаба или локальный путь
+        self.modelPicker.setInsertPolicy(QComboBox.InsertPolicy.NoInsert)
+        self.modelPicker.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToContents)
+        self.modelPicker.activated.connect(self.on_model_picked)
+        self.horizontalLayout.insertWidget(0, self.modelPicker)
+        self.updateModelPicker()
+        self.setDeviceWidgets(self.device)
         self.btnPastPrompt.setIcon(QIcon('images/paste.png'))
         self.setWindowIcon(QIcon('images/icon.svg'))
 
+    def setDeviceWidgets(self, device: str) -> None:
+        gpu = device == 'cuda'
+        self.label_GPU.setText('GPU' if gpu else 'CPU')
+        for widget in (self.textGPU, self.textTemperatureGPU, self.GPUprogressBar, self.line):
+            widget.setVisible(gpu)
+
     def changeTemperature(self):
         self.temperature = Config.TEMPERATURE_MAXIMUM * self.sliderTemperatureModel.value() / self.sliderTemperatureModel.maximum()
         self.textTemperatureModel.setText(f't={self.temperature:.2f}')
@@ -60,22 +164,22 @@ class MainWindow(QMainWindow, Ui_GPT):
     def slotPastPrompt(self):
         self.inputPrompt.setText(QtWidgets.QApplication.clipboard().text())
 
-    def updateGPU_RAM(self):
-        memory_info = psutil.virtual_memory()
-        total_memory = memory_info.total
-        free_memory = memory_info.available
-        used_memory = total_memory - free_memory
-        self.RAMprogressBar.setValue(round(self.GPUprogressBar.maximum() * used_memory / total_memory))
-        self.textRAM.setText(f'{getGb(used_memory)}/{getGb(total_memory)} GB')
-
-        gpu = GPUtil.getGPUs()[0]
-
-        total_memory = round(gpu.memoryTotal * 1024 * 1024)
-        used_memory = round(gpu.memoryUsed * 1024 * 1024)
-        self.GPUprogressBar.setValue(round(self.GPUprogressBar.maximum() * used_memory / total_memory))
-        self.textGPU.setText(f'{getGb(used_memory)}/{getGb(total_memory)} GB')
-        temperature = int(gpu.temperature)
-        self.textTemperatureGPU.setText(f'{temperature} °C')
+    def updateGPU_RAM(self, sample: dict | None = None):
+        # Опрос идёт в потоке TelemetrySampler; свёрнутое окно не перерисовываем
+        if self.isMinimized():
+            return
+        sample = sample or self.sampler.latest()
+        if sample is None:
+            return
+        if 'ram_total' in sample:
+            total_memory, used_memory = sample['ram_total'], sample['ram_used']
+            self.RAMprogressBar.setValue(round(self.RAMprogressBar.maximum() * used_memory / total_memory))
+            self.textRAM.setText(f'{getGb(used_memory)}/{getGb(total_memory)} GB')
+        if 'gpu_total' in sample:
+            total_memory, used_memory = sample['gpu_total'], sample['gpu_used']
+            self.GPUprogressBar.setValue(round(self.GPUprogressBar.maximum() * used_memory / total_memory))
+            self.textGPU.setText(f'{getGb(used_memory)}/{getGb(total_memory)} GB')
+            self.textTemperatureGPU.setText(f"{int(sample['gpu_temperature'])} °C")
 
     def setUIEnabled(self, status: bool) -> None:
         self.inputPrompt.setEnabled(status)
@@ -84,35 +188,192 @@ class MainWindow(QMainWindow, Ui_GPT):
         self.sliderTemperatureModel.setEnabled(status)
         self.btnPastPrompt.setEnabled(status)
         self.btnSend.setEnabled(status)
+        self.btnStop.setEnabled(False)
         self.resultView.setEnabled(status)
 
-    def start_model_loading(self):
-        self.model = None
-        self.tokenizer = None
-        gc.collect()
-        torch.cuda.empty_cache()
-        self.loader_thread = ModelLoaderThread()
-        self.loader_thread.model_loaded.connect(self.on_model_loaded)
-        self.loader_thread.error.connect(self.on_model_error)
-        self.loader_thread.start()
-
-    def on_model_loaded(self, model, tokenizer):
-        self.model = model
-        self.tokenizer = tokenizer
+    def setGenerating(self, status: bool) -> None:
+        self.btnSend.setEnabled(not status)
+        self.btnStop.setEnabled(status)
+        self.reloadBtn.setEnabled(not status)
+
+    def isGenerating(self) -> bool:
+        return self.request is not None
+
+    def start_model_loading(self, model_id: str = Config.MODEL_ID, reload: bool = False):
+        self.load_started = time.perf_counter()
+        if self.out_of_process:
+            # В процессе модели помещается одна модель: окно ждёт, пока загрузится новая
+            self.model_name = None
+            self.setUIEnabled(False)
+            self.worker.load(model_id)
+            return
+        self.registry.request(model_id, reload)
+
+    def on_model_loading(self, model_id: str):
+        self.loadingProgressBar.setEnabled(True)
+        if self.model_name is not None:
+            self.statusBar().showMessage(f'Загрузка {model_id} в фоне, пока отвечает {self.model_name}')
+
+    def on_model_unloading(self, model_id: str):
+        """Перезагружаемая модель выгружается заранее: до готовности новой копии окно ждёт, как при запуске"""
+        if model_id != self.model_name:
+            return
+        self.model = self.tokenizer = self.draft_model = None
+        self.model_name = None
+        self.worker.set_model(None, None)
+        if self.session is not None:
+            # Сообщения диалога остаются, KV-кэш выгружаемой модели - нет
+            self.session.cache = None
+            self.session.cached_ids = []
+        self.setUIEnabled(False)
+        self.statusBar().showMessage(f'Перезагрузка {model_id}')
+
+    def on_model_ready(self, entry):
+        if self.isGenerating():
+            self.pending_entry = entry
+            self.statusBar().showMessage(f'{entry.model_id} загружена, переключение после ответа')
+            return
+        self.swapModel(entry)
+
+    def swapModel(self, entry):
+        """Переключиться на загруженную модель; запросы уже идут к ней, старая остаётся в реестре"""
+        from src.chat_session import ChatSession
+        first = self.model_name is None
+        self.pending_entry = None
+        self.model = entry.model
+        self.tokenizer = entry.tokenizer
+        self.draft_model = entry.draft_model
+        self.model_name = entry.model_id
+        self.worker.set_model(entry.model, entry.tokenizer, entry.draft_model)
+        previous = self.session
+        self.session = ChatSession(entry.tokenizer)
+        if previous is not None:
+            # Диалог продолжается с новой моделью, её KV-кэш посчитается на следующем ходу
+            self.session.messages = list(previous.messages)
+        self.registry.set_active(entry.model_id)
+        self.setUIEnabled(True)
+        self.updateModelPicker()
+        if not first:
+            self.statusBar().showMessage(f'Модель {entry.describe()}')
+        elif self.startup_report:
+            print(f'model ready: {time.perf_counter() - START_TIME:.2f}s after start')
+
+    def applyPendingModel(self):
+        if self.pending_entry is not None and self.registry.get(self.pending_entry.model_id) is self.pending_entry:
+            self.swapModel(self.pending_entry)
+        self.pending_entry = None
+
+    def on_registry_error(self, model_id: str, error_message: str):
+        self.on_model_error(f'{model_id}: {error_message}')
+        if self.model_name is not None:
+            self.loadingProgressBar.setEnabled(False)
+        self.updateModelPicker()
+
+    def on_model_picked(self):
+        index = self.modelPicker.currentIndex()
+        text = self.modelPicker.currentText().strip()
+        model_id = self.modelPicker.itemData(index) if self.modelPicker.itemText(index) == text else text
+        if self.out_of_process and self.isGenerating():
+            self.updateModelPicker()
+            return
+        if model_id and model_id != self.model_name:
+            self.start_model_loading(model_id)
+
+    def updateModelPicker(self):
+        """Список моделей: загруженные (с временем загрузки и размером в памяти), затем из Config.MODEL_CHOICES"""
+        entries = {entry.model_id: entry for entry in self.registry.entries()} if self.registry is not None else {}
+        model_ids = list(entries) + [model_id for model_id in Config.MODEL_CHOICES if model_id not in entries]
+        if self.model_name is not None and self.model_name not in model_ids:
+            model_ids.insert(0, self.model_name)
+        self.modelPicker.blockSignals(True)
+        self.modelPicker.clear()
+        for model_id in model_ids:
+            self.modelPicker.addItem(entries[model_id].describe() if model_id in entries else model_id, model_id)
+        current = self.model_name or (self.registry.loading_id if self.registry is not None else None)
+        self.modelPicker.setCurrentIndex(max(0, self.modelPicker.findData(current or Config.MODEL_ID)))
+        self.modelPicker.blockSignals(False)
+
+    def on_worker_loaded(self, info):
+        self.model_name = info['model']
+        self.on_load_timings(info['timings'])
         self.setUIEnabled(True)
+        self.updateModelPicker()
+        if self.startup_report:
+            print(f'model ready: {time.perf_counter() - START_TIME:.2f}s after start')
+
+    def on_worker_crashed(self, message):
+        # Запрос, если он шёл, уже завершён ошибкой; модель перезагружается в новом процессе
+        print(message)
+        self.model_name = None
+        self.setUIEnabled(False)
+        self.statusBar().showMessage(message)
+
+    def on_load_timings(self, timings):
+        if timings['device'] != self.device:
+            self.device = timings['device']
+            self.setDeviceWidgets(self.device)
+            if self.device == 'cuda':
+                # Аллокатор torch виден только в процессе, где загружена модель
+                self.sampler.add_probes([GpuProbe()] if self.out_of_process else [TorchAllocatorProbe(), GpuProbe()])
+        if 'load_plan' in timings:
+            check = timings['load_plan']
+            self.statusBar().showMessage(f"Модель загружена: {check['plan']}, веса по оценке "
+                                         f"{check['estimated_weights_gb']} GB, по факту {check['measured_gb']} GB")
+        if 'compile_fallback' in timings:
+            self.statusBar().showMessage(f"Режим compiled недоступен, генерация без компиляции: "
+                                         f"{timings['compile_fallback']}")
+        if not self.load_timings:
+            return
+        total = time.perf_counter() - self.load_started
+        stages = ', '.join(f'{name}={value:.2f}s' for name, value in timings.items() if isinstance(value, float))
+        print(f"model load from {timings['source']} ({timings['device']}, {timings['quantization']}): "
+              f"total={total:.2f}s, {stages}")
+        if 'load_plan' in timings:
+            print(f"load plan check: {timings['load_plan']}")
+
+    def on_load_plan(self, plan):
+        self.statusBar().showMessage(f'План загрузки: {plan.describe()}')
+        if self.load_timings:
+            for candidate in plan.candidates:
+                print(f"{'*' if candidate is plan else ' '} {candidate.describe()}"
+                      f"{'' if candidate.fits else ' - не помещается'}")
 
     def on_model_error(self, error_message):
         print(error_message)
+        self.statusBar().showMessage(error_message)
 
     def reload_model(self):
-        self.setUIEnabled(False)
-        self.answer = ''
-        # self.resultView.close()
-        self.start_model_loading()
+        # Текущая копия модели отвечает, пока в фоне загружается новая, если на две копии хватает памяти
+        self.start_model_loading(self.model_name or Config.MODEL_ID, reload=True)
+
+    def new_chat(self):
+        if self.isGenerating():
+            return
+        if self.session is not None:
+            self.session.reset()
+        if self.out_of_process:
+            self.worker.reset_session()
+        self.history_session_id = None
+        self.markdownView.clear()
+        self.statusBar().showMessage('Новый диалог')
+
+    def show_history_turn(self, turn_id: int):
+        if self.isGenerating():
+            return
+        turn = self.history.turn(turn_id)
+        if turn is None:
+            return
+        self.markdownView.clear()
+        self.markdownView.append(turn['answer'])
+        self.markdownView.finish()
+        created = time.strftime('%d.%m.%Y %H:%M', time.localtime(turn['created']))
+        self.statusBar().showMessage(f"{created}: {' '.join(turn['prompt'].split())[:200]}")
 
     def generate_response(self):
+        if self.isGenerating():
+            return
         # Проверяем, что модель загружена
-        if not self.model or not self.tokenizer:
+        if self.model_name is None:
             QMessageBox(QMessageBox.Icon.Warning, '', "Модель не загружена.").show()
             return
 
@@ -121,54 +382,153 @@ class MainWindow(QMainWindow, Ui_GPT):
         if not user_input:
             QMessageBox(self, QMessageBox.Icon.Warning, "Введите текст, чтобы получить ответ.").show()
             return
-        # self.resultView.close()
-        self.answer = None
-        self.streaming_thread = StreamingThread(self.model, self.tokenizer, user_input, self.temperature)
-        self.streaming_thread.update_response.connect(self.update_response)
-        self.streaming_thread.generation_finished.connect(self.on_generation_finished)
-        self.streaming_thread.error_occurred.connect(self.on_generation_error)
-        self.streaming_thread.start()
+        self.send_started = time.perf_counter()
+        self.markdownView.clear()
+        request = GenerationRequest(user_input, self.temperature, priority=Priority.INTERACTIVE,
+                                    session=self.session, speculative=self.speculative, kv_cache=self.kv_cache)
+        request.update_response.connect(self.update_response)
+        request.prefill_stats.connect(self.on_prefill_stats)
+        request.prefill_progress.connect(self.on_prefill_progress)
+        request.generation_finished.connect(self.on_generation_finished)
+        request.error_occurred.connect(self.on_generation_error)
+        try:
+            with span('submit'):
+                self.worker.submit(request)
+        except QueueFullError as e:
+            QMessageBox(QMessageBox.Icon.Warning, '', str(e)).show()
+            return
+        self.request = request
+        self.sampler.set_active(True)
+        self.setGenerating(True)
+        if self.history is not None:
+            if self.history_session_id is None:
+                self.history_session_id = self.history.start_session()
+            params = {'temperature': self.temperature, 'speculative': self.speculative,
+                      'kv_cache': self.kv_cache, 'max_new_tokens': request.max_new_tokens}
+            self.history_turn_id = self.history.start_turn(
+                self.history_session_id, user_input, self.model_name, params)
+
+    def stop_generation(self):
+        if self.isGenerating():
+            self.btnStop.setEnabled(False)
+            self.request.cancel()
 
     def update_response(self, text):
-        if self.answer is None:
-            self.answer = ''
-            return
-        self.answer += text
-
-        self.resultView.setHtml(markdown(self.answer), QUrl(''))
-        # self.resultView.page().runJavaScript('window.scrollTo(0, document.body.scrollHeight);')
-
-    def on_generation_finished(self):
-        mathjax_script = """
-                        <script type="text/javascript" async
-                          src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.7/MathJax.js?config=TeX-MML-AM_CHTML">
-                        </script>
-                        <script type="text/x-mathjax-config">
-                          MathJax.Hub.Config({
-                            tex2jax: {inlineMath: [['$','$']]},
-                            messageStyle: 'none'
-                          });
-                        </script>
-                        """
-        html_content = f"""
-                        <!DOCTYPE html>
-                        <html>
-                        <head>
-                        {mathjax_script}
-                        </head>
-                        <body>
-                        {markdown(self.answer)}
-                        </body>
-                        </html>
-                        """
-        self.resultView.setHtml(html_content, QUrl(''))
-        self.resultView.page().runJavaScript('window.scrollTo(0, document.body.scrollHeight);')
+        TRACER.arrive('update_response', 'signal_delivery')
+        with span('update_response', chars=len(text)):
+            self.markdownView.append(text)
+            if self.history_turn_id is not None:
+                self.history.append(self.history_turn_id, text)
+
+    def toggleTracing(self):
+        if not TRACER.enabled:
+            TRACER.clear()
+            TRACER.enable()
+            self.statusBar().showMessage('Трассировка включена (Ctrl+Shift+T - выключить и сохранить)')
+            return
+        TRACER.enable(False)
+        self.saveTrace()
+
+    def saveTrace(self):
+        path = self.trace_path or Config.TRACE_PATH
+        TRACER.export_chrome(path)
+        print(TRACER.format_summary())
+        self.statusBar().showMessage(f'Трасса сохранена в {path}')
+
+    def finishHistoryTurn(self, reason: str, timings: dict):
+        if self.history_turn_id is None:
+            return
+        self.history.finish_turn(self.history_turn_id, reason, timings)
+        self.history_turn_id = None
+        self.historyPanel.invalidate()
+
+    def on_prefill_stats(self, stats):
+        message = (f"Ход {stats['turn']}: префилл {stats['prefill_tokens']} из {stats['prompt_tokens']} токенов, "
+                   f"из кэша {stats['reused_tokens']}")
+        if stats.get('prefix_cache_tokens'):
+            message += f" (общий префикс {stats['prefix_cache_tokens']})"
+        self.statusBar().showMessage(message)
+
+    def on_prefill_progress(self, done, total):
+        if done >= total:
+            self.hidePrefillProgress()
+            return
+        self.loadingProgressBar.progress = done / total
+        self.loadingProgressBar.setEnabled(True)
+        self.statusBar().showMessage(f'Обработка запроса: {done} из {total} токенов')
+
+    def hidePrefillProgress(self):
+        # Индикатор остаётся, если в фоне грузится другая модель
+        self.loadingProgressBar.setEnabled(self.registry is not None and self.registry.loading_id is not None)
+        self.loadingProgressBar.progress = None
+
+    def on_generation_finished(self, reason):
+        timings = self.request.timings if self.request is not None else {}
+        self.request = None
+        self.sampler.set_active(False)
+        self.setGenerating(False)
+        self.hidePrefillProgress()
+        self.markdownView.finish()
+        self.finishHistoryTurn(reason, timings)
+        self.applyPendingModel()
+        message = f'Генерация завершена: {reason}'
+        if timings.get('response_cached'):
+            hit_rate = self.worker.response_cache_hit_rate
+            message += f', ответ из кэша (попаданий {hit_rate:.0%})'
+        if timings.get('decode_time'):
+            message += f", {timings['new_tokens'] / timings['decode_time']:.1f} ток/с"
+        if self.speculative != 'none':
+            stats = speculative_stats(timings.get('new_tokens', 0), timings.get('decode_steps', 0))
+            if stats['tokens_per_step']:
+                message += (f", {stats['tokens_per_step']:.2f} ток/шаг, "
+                            f"принято кандидатов {stats['accepted_tokens']} (~{stats['acceptance']:.0%})")
+        self.statusBar().showMessage(message)
         print('finished')
 
+    def on_answer_painted(self, seconds: float):
+        if self.send_started is not None:
+            TRACER.complete('send_to_paint', self.send_started)
+            self.send_started = None
+        message = self.statusBar().currentMessage()
+        if message.startswith('Генерация завершена'):
+            self.statusBar().showMessage(f'{message}, отрисовка {seconds * 1000:.0f} мс')
+
     def on_generation_error(self, error_message):
+        timings = self.request.timings if self.request is not None else {}
+        self.request = None
+        self.sampler.set_active(False)
+        self.setGenerating(False)
+        self.hidePrefillProgress()
+        self.finishHistoryTurn('error', timings)
+        self.applyPendingModel()
         print(error_message)
         QMessageBox(QMessageBox.Icon.Critical, '', f"Ошибка: {error_message}").show()
 
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() in (QEvent.Type.WindowStateChange, QEvent.Type.ActivationChange):
+            self.updateBackgroundState()
+
+    def updateBackgroundState(self):
+        if self.isMinimized():
+            self.sampler.set_background_interval(Config.TELEMETRY_MINIMIZED_INTERVAL)
+        elif not self.isActiveWindow():
+            self.sampler.set_background_interval(Config.TELEMETRY_UNFOCUSED_INTERVAL)
+        else:
+            self.sampler.set_background_interval(None)
+            self.updateGPU_RAM()
+
+    def closeEvent(self, event):
+        self.worker.stop()
+        if TRACER.enabled:
+            self.saveTrace()
+        if self.history is not None:
+            self.history.close()
+        self.sampler.stop()
+        if self.telemetry_export:
+            self.sampler.export(self.telemetry_export)
+        super().closeEvent(event)
+
     def eventFilter(self, source: QWidget, event: QEvent):
         if source == self.inputPrompt and event.type() == QEvent.Type.KeyPress.value:
             if event.key() == Qt.Key.Key_Return and event.modifiers() == Qt.KeyboardModifier.ShiftModifier:
@@ -183,14 +543,64 @@ def except_hook(cls, exception, traceback):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load-timings', action='store_true', help='печатать время загрузки модели')
+    parser.add_argument('--no-model-cache', action='store_true', help='не использовать кэш квантованных весов')
+    parser.add_argument('--device', choices=DEVICES, default=Config.DEVICE)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=Config.QUANTIZATION)
+    parser.add_argument('--threads', type=int, default=Config.CPU_INTRA_OP_THREADS, help='потоков torch на CPU')
+    parser.add_argument('--interop-threads', type=int, default=Config.CPU_INTER_OP_THREADS)
+    parser.add_argument('--speculative', choices=SPECULATIVE_MODES, default=Config.SPECULATIVE_MODE,
+                        help='спекулятивное декодирование: черновая модель или поиск по промпту')
+    parser.add_argument('--draft-model', default=Config.DRAFT_MODEL_ID, help='черновая модель для --speculative draft')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='печатать этапы запуска и тяжёлые модули, импортированные до показа окна')
+    parser.add_argument('--no-history', action='store_true', help='не сохранять историю диалогов')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='трассировать с запуска и сохранить Chrome trace JSON при выходе')
+    parser.add_argument('--no-load-plan', action='store_true',
+                        help='не оценивать память перед загрузкой, грузить с --device/--quantization как есть')
+    parser.add_argument('--idle-report', action='store_true',
+                        help='печатать пробуждения потока GUI в секунду и его процессорное время')
+    parser.add_argument('--out-of-process', action='store_true', default=Config.WORKER_OUT_OF_PROCESS,
+                        help='модель в отдельном процессе: декодирование не держит GIL окна, падение не закрывает его')
+    parser.add_argument('--compiled', action='store_true', default=Config.COMPILED_DECODE,
+                        help='статический KV-кэш и torch.compile шага декодирования; компиляция при загрузке модели')
+    parser.add_argument('--kv-cache', choices=KV_CACHE_MODES, default=Config.KV_CACHE_MODE,
+                        help='хранение KV-кэша: квантование int8/int4 или выгрузка в ОЗУ для длинных контекстов; '
+                             'auto - выбор по прогнозу размера кэша')
+    parser.add_argument('--telemetry-export', metavar='PATH', help='сохранить телеметрию в CSV/JSON при выходе')
+    args, qt_args = parser.parse_known_args()
+    configure_cpu_threads(args.threads, args.interop_threads)
+
     if hasattr(QtCore.Qt, 'AA_EnableHighDpiScaling'):
         QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
     if hasattr(QtCore.Qt, 'AA_UseHighDpiPixmaps'):
         QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True)
 
     sys.excepthook = except_hook
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setStyle('fusion')
-    ex = MainWindow()
+    ex = MainWindow(load_timings=args.load_timings, use_model_cache=not args.no_model_cache,
+                    device=args.device, quantization=args.quantization, telemetry_export=args.telemetry_export,
+                    speculative=args.speculative, draft_model_id=args.draft_model,
+                    startup_report=args.startup_report, history=not args.no_history,
+                    trace_path=args.trace, load_plan=not args.no_load_plan, out_of_process=args.out_of_process,
+                    compiled=args.compiled, kv_cache=args.kv_cache)
     ex.show()
+    if args.load_timings or args.startup_report:
+        print(f'window shown: {time.perf_counter() - START_TIME:.2f}s after start')
+    if args.startup_report:
+        # Загрузчик модели уже работает в фоне, поэтому список снят сразу после show
+        heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+        print(f'imports: {IMPORTS_DONE - START_TIME:.2f}s, heavy modules before show: {", ".join(heavy) or "none"}')
+        QtCore.QTimer.singleShot(0, lambda: print(f'event loop: {time.perf_counter() - START_TIME:.2f}s after start'))
+    if args.idle_report:
+        idle_monitor = WakeupMonitor(parent=ex)
+        idle_monitor.start()
+    warmup_thread = WarmupThread()
+    if args.startup_report:
+        warmup_thread.finished_warmup.connect(lambda timings: print(
+            'warmup imports: ' + ', '.join(f'{name}={value:.2f}s' for name, value in timings.items())))
+    warmup_thread.start()
     sys.exit(app.exec())
@@ -0,0 +1,214 @@
+"""
+Локальный OpenAI-совместимый HTTP-сервер: модель загружается один раз через
+get_model_and_tokenizer, запросы обслуживаются циклом непрерывного батчинга.
+
+    python server.py --port 8000 --device cpu --model /tmp/tiny-llama
+
+Эндпоинты: GET /v1/models, POST /v1/completions, POST /v1/chat/completions
+(с "stream": true ответ приходит как SSE).
+"""
+import argparse
+import json
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.backend import configure_cpu_threads, DEVICES, QUANTIZATIONS
+from src.batching import BatchSequence, ContinuousBatcher, encode_prompt
+from src.config import Config
+from utils import get_model_and_tokenizer
+
+
+# В OpenAI API причин завершения две: stop - модель или критерий остановили ответ,
+# length - исчерпан лимит токенов или времени
+FINISH_REASONS = {
+    'eos': 'stop',
+    'stop_string': 'stop',
+    'repetition': 'stop',
+    'cancelled': 'stop',
+    'max_tokens': 'length',
+    'deadline': 'length',
+}
+
+
+class CompletionServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer с очередью соединений под размер батча: при стандартных
+    пяти соединениях одновременные клиенты сверх неё получают сброс соединения
+    """
+    daemon_threads = True
+
+    def __init__(self, address, handler, max_batch_size: int = Config.SERVER_MAX_BATCH_SIZE):
+        self.request_queue_size = max_batch_size * Config.SERVER_BACKLOG_FACTOR
+        super().__init__(address, handler)
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    batcher: ContinuousBatcher = None
+    model_name: str = ''
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json({'object': 'list', 'data': [{'id': self.model_name, 'object': 'model'}]})
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, 'Not found')
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path not in ('/v1/completions', '/v1/chat/completions'):
+            self._send_error(HTTPStatus.NOT_FOUND, 'Not found')
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            chat = path == '/v1/chat/completions'
+            prompt_ids = self._prompt_ids(body, chat)
+            stop = body.get('stop') or []
+            params = {
+                'temperature': float(body.get('temperature', 1.0)),
+                'top_p': float(body.get('top_p', 1.0)),
+                'max_tokens': int(body.get('max_tokens') or Config.SERVER_DEFAULT_MAX_TOKENS),
+                'stop_strings': [stop] if isinstance(stop, str) else [str(item) for item in stop],
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, f'Invalid request: {e}')
+            return
+
+        sequence = self.batcher.submit(prompt_ids, **params)
+        try:
+            if body.get('stream'):
+                self._stream(sequence, chat)
+            else:
+                self._complete(sequence, chat)
+        except (BrokenPipeError, ConnectionResetError):
+            sequence.cancel()
+
+    def _prompt_ids(self, body: dict, chat: bool) -> list[int]:
+        if chat:
+            return encode_prompt(self.batcher.tokenizer, messages=body['messages'])
+        return encode_prompt(self.batcher.tokenizer, prompt=body['prompt'])
+
+    def _complete(self, sequence: BatchSequence, chat: bool) -> None:
+        parts = []
+        for kind, value in self._events(sequence):
+            if kind == 'text':
+                parts.append(value)
+            elif kind == 'error':
+                self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, value)
+                return
+        text = ''.join(parts)
+        choice = {'index': 0, 'finish_reason': FINISH_REASONS.get(sequence.finish_reason, 'stop')}
+        if chat:
+            choice['message'] = {'role': 'assistant', 'content': text}
+        else:
+            choice['text'] = text
+        self._send_json({
+            **self._envelope(sequence, 'chat.completion' if chat else 'text_completion'),
+            'choices': [choice],
+            'usage': self._usage(sequence),
+        })
+
+    def _stream(self, sequence: BatchSequence, chat: bool) -> None:
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        envelope = self._envelope(sequence, 'chat.completion.chunk' if chat else 'text_completion')
+        if chat:
+            self._send_event({**envelope, 'choices': [{'index': 0, 'delta': {'role': 'assistant'},
+                                                       'finish_reason': None}]})
+        for kind, value in self._events(sequence):
+            if kind == 'error':
+                self._send_event({'error': {'message': value}})
+                break
+            if kind == 'text':
+                choice = {'index': 0, 'finish_reason': None}
+            else:
+                choice = {'index': 0, 'finish_reason': FINISH_REASONS.get(value, 'stop')}
+                value = ''
+            if chat:
+                choice['delta'] = {'content': value} if value else {}
+            else:
+                choice['text'] = value
+            event = {**envelope, 'choices': [choice]}
+            if kind == 'done':
+                event['usage'] = self._usage(sequence)
+            self._send_event(event)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    @staticmethod
+    def _events(sequence: BatchSequence):
+        while True:
+            kind, value = sequence.events.get()
+            yield kind, value
+            if kind in ('done', 'error'):
+                return
+
+    def _envelope(self, sequence: BatchSequence, kind: str) -> dict:
+        return {'id': f'cmpl-{sequence.id}', 'object': kind, 'created': int(time.time()), 'model': self.model_name}
+
+    @staticmethod
+    def _usage(sequence: BatchSequence) -> dict:
+        return {
+            'prompt_tokens': len(sequence.prompt_ids),
+            'completion_tokens': len(sequence.generated),
+            'total_tokens': len(sequence.prompt_ids) + len(sequence.generated),
+        }
+
+    def _send_event(self, payload: dict) -> None:
+        self.wfile.write(f'data: {json.dumps(payload, ensure_ascii=False)}\n\n'.encode())
+        self.wfile.flush()
+
+    def _send_json(self, payload: dict, status: HTTPStatus = HTTPStatus.OK) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        self._send_json({'error': {'message': message, 'code': status.value}}, status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT)
+    parser.add_argument('--model', default=Config.MODEL_ID)
+    parser.add_argument('--revision', default=None)
+    parser.add_argument('--device', choices=DEVICES, default=Config.DEVICE)
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=Config.QUANTIZATION)
+    parser.add_argument('--threads', type=int, default=Config.CPU_INTRA_OP_THREADS)
+    parser.add_argument('--max-batch-size', type=int, default=Config.SERVER_MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    configure_cpu_threads(args.threads)
+    model, tokenizer = get_model_and_tokenizer(
+        model_id=args.model, revision=args.revision, device=args.device, quantization=args.quantization)
+    batcher = ContinuousBatcher(model, tokenizer, max_batch_size=args.max_batch_size)
+    batcher.start()
+    CompletionHandler.batcher = batcher
+    CompletionHandler.model_name = args.model
+
+    server = CompletionServer((args.host, args.port), CompletionHandler, max_batch_size=args.max_batch_size)
+    print(f'serving {args.model} on http://{args.host}:{args.port}/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        print(f'batcher stats: {batcher.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import sys
+
+from src.config import Config
+
+# torch импортируется внутри функций: модуль нужен GUI при старте, до загрузки модели
+
+
+DEVICES = ('auto', 'cuda', 'cpu')
+QUANTIZATIONS = ('auto', 'nf4', 'int8', 'none')
+KV_CACHE_MODES = ('auto', 'full', 'int8', 'int4', 'offload')
+
+
+def resolve_device(device: str = Config.DEVICE) -> str:
+    if device not in DEVICES:
+        raise ValueError(f'Unknown device: {device}')
+    import torch
+    if device == 'auto':
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device == 'cuda' and not torch.cuda.is_available():
+        raise RuntimeError('CUDA недоступна, используйте device=cpu')
+    return device
+
+
+def resolve_quantization(device: str, quantization: str | None = Config.QUANTIZATION) -> str | None:
+    """
+    nf4 (bitsandbytes) работает только на CUDA, динамическое int8 - только на CPU
+    """
+    if quantization is None or quantization == 'none':
+        return None
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f'Unknown quantization: {quantization}')
+    if quantization == 'auto':
+        return 'nf4' if device == 'cuda' else Config.CPU_QUANTIZATION
+    if quantization == 'nf4' and device != 'cuda':
+        raise ValueError('nf4 quantization requires CUDA')
+    if quantization == 'int8' and device != 'cpu':
+        raise ValueError('dynamic int8 quantization is only supported on CPU')
+    return quantization
+
+
+def configure_cpu_threads(intra_op: int | None = Config.CPU_INTRA_OP_THREADS,
+                          inter_op: int | None = Config.CPU_INTER_OP_THREADS) -> None:
+    """
+    Число потоков внутри операции и между операциями. inter_op можно задать
+    только до первой параллельной работы torch, поэтому вызывать при старте
+    """
+    if not intra_op and not inter_op:
+        return
+    import torch
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            print(f'inter-op threads not changed: {e}')
+
+
+def quantize_dynamic_int8(model):
+    """Динамическое int8-квантование Linear-слоёв для CPU"""
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def empty_device_cache(device: str) -> None:
+    if 'torch' not in sys.modules:
+        return  # модель ещё не загружалась - освобождать нечего
+    import torch
+    if device in ('cuda', 'auto') and torch.cuda.is_available():
+        torch.cuda.empty_cache()
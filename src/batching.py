@@ -0,0 +1,303 @@
+import inspect
+import queue
+import threading
+import time
+import uuid
+
+import torch
+from transformers import DynamicCache
+
+from src.config import Config
+from src.stopping import GenerationStopper
+from src.streamer import PyQtStreamer
+
+
+def encode_prompt(tokenizer, prompt: str | list[str] | None = None, messages: list[dict] | None = None) -> list[int]:
+    """
+    Токены промпта: сообщения чата через шаблон модели (если он есть) или обычный текст.
+    Пустой промпт - ValueError: модели нечего продолжать
+    """
+    if messages is not None:
+        if not messages:
+            raise ValueError('messages не может быть пустым')
+        if tokenizer.chat_template is None:
+            prompt_ids = tokenizer('\n\n'.join(message['content'] for message in messages))['input_ids']
+        else:
+            prompt_ids = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+    else:
+        if isinstance(prompt, list):
+            prompt = ''.join(prompt)
+        if not prompt:
+            raise ValueError('prompt не может быть пустым')
+        prompt_ids = tokenizer(prompt)['input_ids']
+    if not prompt_ids:
+        raise ValueError('Промпт не содержит ни одного токена')
+    return prompt_ids
+
+
+class BatchSequence:
+    """
+    Одна последовательность в непрерывном батче. Текст и завершение приходят
+    в events: ('text', str), ('done', reason) или ('error', message)
+    """
+
+    def __init__(self,
+                 tokenizer,
+                 prompt_ids: list[int],
+                 temperature: float,
+                 top_p: float,
+                 max_tokens: int,
+                 stop_strings: list[str],
+                 finished: queue.Queue | None = None,
+                 ):
+        self.id = uuid.uuid4().hex
+        self.prompt_ids = prompt_ids
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.generated: list[int] = []
+        self.events: queue.Queue = queue.Queue()
+        self.finish_reason: str | None = None
+        self.error: str | None = None  # сообщение об ошибке, если последовательность завершилась ею
+        self.submitted_at = time.perf_counter()
+        self.first_token_at: float | None = None
+        self.finished_queue = finished  # сюда кладётся сама последовательность, когда она завершена
+        self._eos_token_id = tokenizer.eos_token_id
+        # Детокенизация и критерии остановки - те же, что и в GUI
+        self.streamer = PyQtStreamer(tokenizer, self, skip_prompt=False, batch_tokens=1, batch_interval=0.0)
+        # Критерию нужны только сгенерированные токены: они пишутся в буфер, выделенный один раз,
+        # и на шаге передаётся его срез, а не новый тензор из промпта и ответа
+        self.stopper = GenerationStopper(tokenizer, 0, max_new_tokens=max_tokens,
+                                         timeout=None, stop_strings=stop_strings)
+        self._generated_ids = torch.empty((1, max(1, max_tokens)), dtype=torch.long)
+
+    def cancel(self) -> None:
+        self.stopper.cancel()
+
+    def emit(self, text: str) -> None:
+        self.events.put(('text', text))
+
+    def push(self, token: int) -> bool:
+        """Добавить токен; True, если последовательность завершена"""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.generated.append(token)
+        if token == self._eos_token_id:
+            self._finish('eos')
+            return True
+        self.streamer.put(torch.tensor([token]))
+        # Больше max_tokens токенов не бывает: на max_tokens-м критерий останавливает последовательность
+        count = len(self.generated)
+        self._generated_ids[0, count - 1] = token
+        if self.stopper(self._generated_ids[:, :count], None)[0]:
+            self._finish(self.stopper.reason)
+            return True
+        return False
+
+    @property
+    def remaining_tokens(self) -> int:
+        return max(0, self.max_tokens - len(self.generated))
+
+    def fail(self, message: str) -> None:
+        self.error = message
+        self.events.put(('error', message))
+        if self.finished_queue is not None:
+            self.finished_queue.put(self)
+
+    def _finish(self, reason: str) -> None:
+        self.finish_reason = reason
+        self.streamer.end()
+        self.events.put(('done', reason))
+        if self.finished_queue is not None:
+            self.finished_queue.put(self)
+
+
+class ContinuousBatcher:
+    """
+    Цикл декодирования с непрерывным батчингом: между шагами новые
+    последовательности проходят префилл и добавляются в общий батч
+    (KV-кэш выравнивается паддингом слева), завершённые - удаляются из него.
+    max_batch_tokens ограничивает размер KV-кэша батча (строки x длина с паддингом
+    к концу генерации): новая последовательность ждёт, пока не поместится
+    """
+
+    def __init__(self,
+                 model,
+                 tokenizer,
+                 max_batch_size: int = Config.SERVER_MAX_BATCH_SIZE,
+                 max_batch_tokens: int | None = None,
+                 ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        # slots/padding_slots - позиции KV-кэша, обработанные на шагах декодирования, и доля паддинга в них
+        self.stats = {'steps': 0, 'prefills': 0, 'max_batch': 0, 'finished': 0, 'slots': 0, 'padding_slots': 0}
+        self._waiting: BatchSequence | None = None  # первая в очереди, не поместившаяся в бюджет
+        self._pending: queue.Queue[BatchSequence] = queue.Queue()
+        self._active: list[BatchSequence] = []
+        self._cache: DynamicCache | None = None
+        self._mask: torch.Tensor | None = None  # [batch, длина кэша], 0 - паддинг
+        self._positions: list[int] = []  # число настоящих токенов в кэше у каждой последовательности
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='continuous-batcher', daemon=True)
+        self._logits_kwargs = (
+            {'num_logits_to_keep': 1}
+            if 'num_logits_to_keep' in inspect.signature(model.forward).parameters else {}
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def submit(self,
+               prompt_ids: list[int],
+               temperature: float = 1.0,
+               top_p: float = 1.0,
+               max_tokens: int = Config.SERVER_DEFAULT_MAX_TOKENS,
+               stop_strings: list[str] | None = None,
+               finished: queue.Queue | None = None,
+               ) -> BatchSequence:
+        sequence = BatchSequence(self.tokenizer, prompt_ids, temperature, top_p, max_tokens, stop_strings or [],
+                                 finished)
+        self._pending.put(sequence)
+        return sequence
+
+    def _loop(self) -> None:
+        with torch.no_grad():
+            while not self._stop.is_set():
+                if not self._active and self._waiting is None:
+                    try:
+                        self._waiting = self._pending.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                while len(self._active) < self.max_batch_size:
+                    if self._waiting is None:
+                        if self._pending.empty():
+                            break
+                        self._waiting = self._pending.get_nowait()
+                    # Пустой батч принимает последовательность даже сверх бюджета, иначе она ждала бы вечно
+                    if self._active and not self._fits(self._waiting):
+                        break
+                    sequence, self._waiting = self._waiting, None
+                    self._safe_prefill(sequence)
+                if self._active:
+                    try:
+                        self._step()
+                    except Exception as e:
+                        self._fail_all(str(e))
+
+    def _safe_prefill(self, sequence: BatchSequence) -> None:
+        try:
+            self._prefill(sequence)
+        except Exception as e:
+            sequence.fail(str(e))
+
+    def _fits(self, sequence: BatchSequence) -> bool:
+        """Худший случай: все строки батча дорастают до длины самой длинной к концу генерации"""
+        if self.max_batch_tokens is None:
+            return True
+        length = max(self._mask.shape[1] if self._mask is not None else 0, len(sequence.prompt_ids))
+        steps = max([active.remaining_tokens for active in self._active] + [sequence.max_tokens])
+        return (len(self._active) + 1) * (length + steps) <= self.max_batch_tokens
+
+    def _prefill(self, sequence: BatchSequence) -> None:
+        device = self.model.device
+        input_ids = torch.tensor([sequence.prompt_ids], device=device)
+        cache = DynamicCache()
+        output = self.model(input_ids=input_ids, past_key_values=cache, use_cache=True, **self._logits_kwargs)
+        self.stats['prefills'] += 1
+        if sequence.push(self._sample(sequence, output.logits[0, -1])):
+            return
+        self._merge(sequence, cache, len(sequence.prompt_ids))
+
+    def _merge(self, sequence: BatchSequence, cache: DynamicCache, length: int) -> None:
+        mask = torch.ones((1, length), dtype=torch.long, device=self.model.device)
+        if self._cache is None:
+            self._cache, self._mask = cache, mask
+        else:
+            batch_length = self._mask.shape[1]
+            if length < batch_length:
+                cache, mask = self._pad_left(cache, mask, batch_length - length)
+            elif length > batch_length:
+                self._cache, self._mask = self._pad_left(self._cache, self._mask, length - batch_length)
+            for layer in range(len(self._cache.key_cache)):
+                self._cache.key_cache[layer] = torch.cat([self._cache.key_cache[layer], cache.key_cache[layer]])
+                self._cache.value_cache[layer] = torch.cat([self._cache.value_cache[layer], cache.value_cache[layer]])
+            self._mask = torch.cat([self._mask, mask])
+        self._active.append(sequence)
+        self._positions.append(length)
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(self._active))
+
+    def _step(self) -> None:
+        device = self.model.device
+        input_ids = torch.tensor([[sequence.generated[-1]] for sequence in self._active], device=device)
+        position_ids = torch.tensor([[position] for position in self._positions], device=device)
+        self._mask = torch.cat([self._mask, torch.ones((len(self._active), 1), dtype=torch.long, device=device)],
+                               dim=1)
+        self.stats['slots'] += self._mask.numel()
+        self.stats['padding_slots'] += self._mask.numel() - int(self._mask.sum())
+        output = self.model(
+            input_ids=input_ids,
+            attention_mask=self._mask,
+            position_ids=position_ids,
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        self.stats['steps'] += 1
+        keep = []
+        for i, sequence in enumerate(self._active):
+            self._positions[i] += 1
+            if not sequence.push(self._sample(sequence, output.logits[i, -1])):
+                keep.append(i)
+        if len(keep) < len(self._active):
+            self._remove(keep)
+
+    def _fail_all(self, message: str) -> None:
+        for sequence in self._active:
+            sequence.fail(message)
+        self._active, self._positions = [], []
+        self._cache = self._mask = None
+
+    def _remove(self, keep: list[int]) -> None:
+        self.stats['finished'] += len(self._active) - len(keep)
+        self._active = [self._active[i] for i in keep]
+        self._positions = [self._positions[i] for i in keep]
+        if not keep:
+            self._cache = self._mask = None
+            return
+        indices = torch.tensor(keep, device=self._mask.device)
+        self._cache.batch_select_indices(indices)
+        self._mask = self._mask[indices]
+        # Столбцы, где у всех оставшихся только паддинг, больше не нужны
+        first = int((self._mask.sum(dim=0) > 0).nonzero()[0])
+        if first:
+            for layer in range(len(self._cache.key_cache)):
+                self._cache.key_cache[layer] = self._cache.key_cache[layer][:, :, first:]
+                self._cache.value_cache[layer] = self._cache.value_cache[layer][:, :, first:]
+            self._mask = self._mask[:, first:]
+
+    @staticmethod
+    def _pad_left(cache: DynamicCache, mask: torch.Tensor, amount: int) -> tuple[DynamicCache, torch.Tensor]:
+        for layer in range(len(cache.key_cache)):
+            for tensors in (cache.key_cache, cache.value_cache):
+                tensor = tensors[layer]
+                padding = tensor.new_zeros(tensor.shape[:2] + (amount,) + tensor.shape[3:])
+                tensors[layer] = torch.cat([padding, tensor], dim=2)
+        mask = torch.cat([mask.new_zeros((mask.shape[0], amount)), mask], dim=1)
+        return cache, mask
+
+    @staticmethod
+    def _sample(sequence: BatchSequence, logits: torch.Tensor) -> int:
+        if sequence.temperature <= 0:
+            return int(logits.argmax())
+        probs = torch.softmax(logits.float() / sequence.temperature, dim=-1)
+        if sequence.top_p < 1.0:
+            sorted_probs, sorted_indices = torch.sort(probs, descending=True)
+            cumulative = torch.cumsum(sorted_probs, dim=-1)
+            sorted_probs[cumulative - sorted_probs > sequence.top_p] = 0.0
+            probs = torch.zeros_like(probs).scatter_(0, sorted_indices, sorted_probs)
+        return int(torch.multinomial(probs, 1))
@@ -0,0 +1,112 @@
+import torch
+from transformers import AutoTokenizer, DynamicCache
+
+from src.config import Config
+from src.prefix_cache import PrefixCache
+
+
+class ChatSession:
+    """
+    Многоходовый диалог: история сообщений в формате chat template и KV-кэш,
+    сохраняемый между ходами - на новом ходу префилл идёт только по новым токенам
+    """
+
+    def __init__(self,
+                 tokenizer: AutoTokenizer,
+                 max_context_tokens: int = Config.CHAT_MAX_CONTEXT_TOKENS,
+                 reserve_tokens: int = Config.CHAT_RESERVE_TOKENS,
+                 system_prompt: str | None = Config.SYSTEM_PROMPT,
+                 ):
+        self.tokenizer = tokenizer
+        self.max_context_tokens = max_context_tokens
+        self.reserve_tokens = reserve_tokens  # место под ответ
+        self.system_prompt = system_prompt
+        self.messages: list[dict[str, str]] = []
+        self.cache: DynamicCache | None = None
+        self.cached_ids: list[int] = []
+        self.last_stats: dict[str, int] = {}
+        self._pending_user: str | None = None
+        self._turn = 0
+
+    def reset(self) -> None:
+        self.messages = []
+        self.cache = None
+        self.cached_ids = []
+        self.last_stats = {}
+        self._pending_user = None
+        self._turn = 0
+
+    def prepare(self, user_input: str, prefix_cache: PrefixCache | None = None) -> tuple[torch.Tensor, DynamicCache]:
+        """
+        Собрать вход для нового хода: ids всего диалога и кэш, обрезанный до общего префикса.
+        Если свой кэш диалога не подошёл, префикс ищется в общем prefix_cache
+        """
+        evicted = 0
+        ids = self._encode(self.messages + [{'role': 'user', 'content': user_input}])
+        while len(ids) + self.reserve_tokens > self.max_context_tokens and self.messages:
+            # Вытесняем самую старую пару вопрос-ответ
+            self.messages = self.messages[2:]
+            evicted += 1
+            ids = self._encode(self.messages + [{'role': 'user', 'content': user_input}])
+        if len(ids) + self.reserve_tokens > self.max_context_tokens:
+            raise ValueError(f'Запрос слишком длинный: {len(ids)} токенов, '
+                             f'максимум {self.max_context_tokens - self.reserve_tokens}')
+
+        # Хотя бы один токен должен пройти через модель, чтобы получить логиты
+        reused = min(self._common_prefix(self.cached_ids, ids), len(ids) - 1)
+        if reused and self.cache is not None:
+            self.cache.crop(reused)
+        else:
+            reused = 0
+            self.cache = DynamicCache()
+        shared = 0
+        if not reused and prefix_cache is not None:
+            cache, shared = prefix_cache.lookup(ids)
+            if cache is not None:
+                self.cache, reused = cache, shared
+        # Кэш валиден только для общего префикса, пока ход не завершён через commit
+        self.cached_ids = ids[:reused]
+
+        self._pending_user = user_input
+        self._turn += 1
+        self.last_stats = {
+            'turn': self._turn,
+            'prompt_tokens': len(ids),
+            'reused_tokens': reused,
+            'prefill_tokens': len(ids) - reused,
+            'evicted_turns': evicted,
+            'prefix_cache_tokens': shared,
+        }
+        return torch.tensor([ids]), self.cache
+
+    def commit(self, sequence: torch.Tensor, answer: str) -> None:
+        """Запомнить ответ и токены, для которых кэш уже посчитан"""
+        self.messages += [
+            {'role': 'user', 'content': self._pending_user},
+            {'role': 'assistant', 'content': answer},
+        ]
+        self._pending_user = None
+        self.cached_ids = sequence[:self.cache.get_seq_length()].tolist()
+
+    def suspend(self, sequence: torch.Tensor) -> None:
+        """
+        Ход прерван и будет запущен заново (вытеснение в очереди): сообщения не меняются,
+        ожидающий вопрос остаётся, а посчитанный кэш переиспользуется при повторном prepare
+        """
+        self.cached_ids = sequence[:self.cache.get_seq_length()].tolist()
+
+    def _encode(self, messages: list[dict[str, str]]) -> list[int]:
+        if self.system_prompt:
+            messages = [{'role': 'system', 'content': self.system_prompt}] + messages
+        if self.tokenizer.chat_template is None:
+            text = '\n\n'.join(message['content'] for message in messages)
+            return self.tokenizer(text)['input_ids']
+        return self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+
+    @staticmethod
+    def _common_prefix(a: list[int], b: list[int]) -> int:
+        n = min(len(a), len(b))
+        for i in range(n):
+            if a[i] != b[i]:
+                return i
+        return n
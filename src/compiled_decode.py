@@ -0,0 +1,157 @@
+import functools
+import os
+import time
+
+import torch
+from transformers import DynamicCache, StaticCache
+
+from src.config import Config
+
+
+def configure_compile_cache(cache_dir: str | None = Config.COMPILE_CACHE_DIR) -> None:
+    """
+    Кэш артефактов inductor на диске: граф, собранный при первом запуске, при
+    следующих берётся из кэша, и прогрев занимает секунды, а не минуты.
+    cache_dir=None оставляет TORCHINDUCTOR_CACHE_DIR или каталог torch по умолчанию
+    """
+    if cache_dir is not None:
+        # torch сам записывает в окружение каталог по умолчанию при первом обращении,
+        # поэтому setdefault здесь не сработал бы
+        os.environ['TORCHINDUCTOR_CACHE_DIR'] = os.path.expanduser(cache_dir)
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = os.environ['TORCHINDUCTOR_FX_GRAPH_CACHE'] == '1'
+
+
+def unsupported_reason(model) -> str | None:
+    """Почему модель нельзя декодировать со статическим кэшем и компиляцией; None - можно"""
+    if not getattr(model, '_supports_static_cache', False):
+        return f'{type(model).__name__} не поддерживает StaticCache'
+    if getattr(model, 'hf_quantizer', None) is not None:
+        return 'веса квантованы bitsandbytes'
+    if len(set(getattr(model, 'hf_device_map', {}).values())) > 1:
+        return 'модель разнесена по нескольким устройствам'
+    if not torch._dynamo.is_dynamo_supported():
+        return 'torch.compile недоступен в этой версии Python'
+    return None
+
+
+class CompiledDecoder:
+    """
+    Режим «compiled»: KV-кэш выделяется один раз на max_cache_len токенов
+    (StaticCache), а проход по одному новому токену компилируется torch.compile -
+    у него постоянные формы, поэтому граф собирается один раз. Префилл идёт без
+    компиляции. На CUDA шаг декодирования со StaticCache компилирует сам generate
+    (CUDA graphs), здесь - подмена model.forward, которая отправляет в
+    скомпилированную функцию только шаги по одному токену.
+    Кэш диалога между ходами остаётся DynamicCache: перед generate его префикс
+    копируется в статический кэш, после - обратно
+    """
+
+    def __init__(self, model, max_cache_len: int = Config.COMPILE_MAX_CONTEXT_TOKENS, mode: str | None = Config.COMPILE_MODE):
+        self.model = model
+        self.max_cache_len = min(max_cache_len, getattr(model.config, 'max_position_embeddings', max_cache_len))
+        self.mode = mode
+        self.cache = StaticCache(model.config, max_batch_size=1, max_cache_len=self.max_cache_len,
+                                 device=model.device, dtype=model.dtype)
+        self.compile_time: float | None = None
+        self.error: str | None = None
+        self._eager_forward = model.forward
+        self._compiled_forward = None
+
+    def install(self) -> None:
+        if self.model.device.type != 'cuda':
+            self._compiled_forward = torch.compile(self._eager_forward, mode=self.mode, dynamic=False)
+            self.model.forward = self._dispatch()
+        self.model.compiled_decoder = self
+
+    def uninstall(self) -> None:
+        vars(self.model).pop('forward', None)
+        self.model.compiled_decoder = None
+
+    def _dispatch(self):
+        # wraps сохраняет сигнатуру forward: generate и префилл проверяют её параметры
+        @functools.wraps(self._eager_forward)
+        def forward(*args, **kwargs):
+            input_ids = kwargs.get('input_ids', args[0] if args else None)
+            if (self._compiled_forward is None or kwargs.get('past_key_values') is not self.cache
+                    or input_ids is None or input_ids.shape[1] != 1):
+                return self._eager_forward(*args, **kwargs)
+            try:
+                return self._compiled_forward(*args, **kwargs)
+            except Exception as e:
+                # Сбой компиляции не ломает генерацию: дальше этот процесс декодирует без неё
+                self.error = str(e)
+                self._compiled_forward = None
+                print(f'compiled decode disabled: {e}')
+                return self._eager_forward(*args, **kwargs)
+        return forward
+
+    @property
+    def active(self) -> bool:
+        return self.model.device.type == 'cuda' or self._compiled_forward is not None
+
+    def fits(self, total_tokens: int) -> bool:
+        return self.active and total_tokens <= self.max_cache_len
+
+    def load(self, cache: DynamicCache | None) -> StaticCache:
+        """Статический кэш для generate с префиксом из кэша диалога"""
+        self.cache.reset()
+        length = cache.get_seq_length() if cache is not None else 0
+        if length:
+            positions = torch.arange(length, device=self.model.device)
+            for layer, (keys, values) in enumerate(zip(cache.key_cache, cache.value_cache)):
+                self.cache.update(keys, values, layer, {'cache_position': positions})
+        return self.cache
+
+    def store(self, cache: DynamicCache, length: int) -> DynamicCache:
+        """Перенести первые length позиций статического кэша в кэш диалога"""
+        cache.crop(0)
+        for layer, (keys, values) in enumerate(zip(self.cache.key_cache, self.cache.value_cache)):
+            cache.update(keys[:, :, :length].clone(), values[:, :, :length].clone(), layer)
+        return cache
+
+    def warmup(self, tokenizer, new_tokens: int = 3) -> float:
+        """Компиляция шага декодирования коротким generate; возвращает время в секундах"""
+        input_ids = tokenizer('Привет', return_tensors='pt')['input_ids'].to(self.model.device)
+        start = time.perf_counter()
+        with torch.no_grad():
+            self.model.generate(input_ids, attention_mask=torch.ones_like(input_ids), past_key_values=self.load(None),
+                                max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False,
+                                pad_token_id=tokenizer.eos_token_id)
+        self.compile_time = time.perf_counter() - start
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.compile_time
+
+
+def enable_compiled_decode(model, tokenizer, timings: dict | None = None,
+                           max_cache_len: int = Config.COMPILE_MAX_CONTEXT_TOKENS,
+                           cache_dir: str | None = Config.COMPILE_CACHE_DIR,
+                           ) -> CompiledDecoder | None:
+    """
+    Включить режим compiled для загруженной модели и сразу скомпилировать шаг
+    декодирования. Если модель или бэкенд не поддерживаются, модель остаётся
+    в обычном режиме, причина пишется в timings['compile_fallback']
+    """
+    reason = unsupported_reason(model)
+    decoder = None
+    if reason is None:
+        configure_compile_cache(cache_dir)
+        decoder = CompiledDecoder(model, max_cache_len)
+        decoder.install()
+        try:
+            compile_time = decoder.warmup(tokenizer)
+        except Exception as e:
+            decoder.uninstall()
+            decoder = None
+            reason = str(e)
+        else:
+            if timings is not None:
+                timings['compile'] = compile_time
+    if reason is not None:
+        print(f'compiled decode unavailable, using eager: {reason}')
+        if timings is not None:
+            timings['compile_fallback'] = reason
+    return decoder
@@ -1,3 +1,82 @@
 class Config:
     TEMPERATURE_MAXIMUM = 2.0
-    GPU_CPU_UPDATE_INTERVAL = 500
+    RENDER_FPS = 30
+    STREAMER_BATCH_TOKENS = 8
+    STREAMER_BATCH_INTERVAL = 0.05
+    SYSTEM_PROMPT = None
+    CHAT_MAX_CONTEXT_TOKENS = 32 * 1024
+    CHAT_RESERVE_TOKENS = 2048
+    MODEL_ID = "mistralai/Ministral-8B-Instruct-2410"
+    MODEL_REVISION = "4847e87e5975a573a2a190399ca62cd266c899ad"
+    MODEL_CACHE_ENABLED = True
+    MODEL_CACHE_DIR = "~/.cache/gpt/models"
+    MODEL_CACHE_BUDGET_GB = 32
+    DEVICE = 'auto'  # auto / cuda / cpu
+    QUANTIZATION = 'auto'  # auto / nf4 / int8 / none
+    CPU_QUANTIZATION = None  # 'int8' - динамическое квантование на CPU
+    LOAD_PLAN_ENABLED = True  # оценить память по заголовкам safetensors и выбрать точность до загрузки
+    LOAD_PLAN_HEADROOM = 0.9  # доля свободной памяти, которую можно занять
+    LOAD_PLAN_OVERHEAD_GB = 1.0  # активации, контекст CUDA и прочее сверх весов и KV-кэша
+    CPU_DTYPE = 'float32'
+    CPU_INTRA_OP_THREADS = None  # None - по умолчанию torch
+    CPU_INTER_OP_THREADS = None
+    MAX_NEW_TOKENS = 128 * 1024
+    TELEMETRY_BUFFER_SIZE = 3600
+    TELEMETRY_INTERVAL = 1.0  # секунды, в простое
+    TELEMETRY_ACTIVE_INTERVAL = 0.25  # во время генерации
+    TELEMETRY_MAX_INTERVAL = 5.0
+    TELEMETRY_GPU_INTERVAL = 1.0
+    TELEMETRY_CHANGE_THRESHOLD = 0.01
+    TELEMETRY_UNFOCUSED_INTERVAL = 3.0  # не чаще, пока окно не в фокусе
+    TELEMETRY_MINIMIZED_INTERVAL = 30.0  # пока окно свёрнуто
+    IDLE_REPORT_INTERVAL = 5.0  # период отчёта --idle-report, секунды
+    GENERATION_TIMEOUT = None  # секунды, None - без ограничения
+    STOP_STRINGS = ()
+    REPETITION_MAX_PERIOD = 64  # 0 - не искать зацикливание
+    REPETITION_MIN_SPAN = 48  # минимальная длина повторяющегося участка в токенах
+    REPETITION_MIN_REPEATS = 3
+    SCHEDULER_MAX_QUEUE = 32
+    SCHEDULER_PREEMPTION = True
+    SERVER_HOST = '127.0.0.1'
+    SERVER_PORT = 8000
+    SERVER_MAX_BATCH_SIZE = 16
+    SERVER_BACKLOG_FACTOR = 8  # очередь соединений сервера - столько размеров батча
+    SERVER_DEFAULT_MAX_TOKENS = 256
+    SPECULATIVE_MODE = 'none'  # none / draft / prompt_lookup
+    DRAFT_MODEL_ID = None  # маленькая модель с тем же токенизатором, для режима draft
+    DRAFT_MODEL_REVISION = None
+    SPECULATIVE_NUM_TOKENS = 10  # сколько токенов-кандидатов предлагается за шаг
+    PREFIX_CACHE_ENABLED = True
+    PREFIX_CACHE_BLOCK_TOKENS = 32
+    PREFIX_CACHE_BUDGET_MB = 1024
+    PREFILL_CHUNK_TOKENS = 2048  # None - префилл одним проходом
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_DIR = "~/.cache/gpt/responses"
+    RESPONSE_CACHE_BUDGET_MB = 256
+    RESPONSE_CACHE_REPLAY_TOKENS_PER_SECOND = None  # None - ответ из кэша выдаётся сразу
+    WARMUP_ENABLED = True
+    MATH_CACHE_SIZE = 4096  # формул в памяти (отрендеренный MathML по исходнику LaTeX)
+    TRACE_BUFFER_EVENTS = 200000  # последних этапов в памяти трассировщика
+    TRACE_PATH = "trace.json"  # куда сохранить трассу, если --trace не задан
+    HISTORY_ENABLED = True
+    HISTORY_PATH = "~/.local/share/gpt/history.sqlite3"
+    HISTORY_FLUSH_INTERVAL = 0.5  # секунды: токены ответа пишутся одной транзакцией за период
+    HISTORY_PAGE_SIZE = 50  # ходов на страницу в панели истории
+    BATCH_MAX_SIZE = 64  # последовательностей в батче batch.py
+    BATCH_MEMORY_BUDGET_GB = None  # KV-кэш батча; None - доля свободной памяти (LOAD_PLAN_HEADROOM)
+    BATCH_DEFAULT_MAX_TOKENS = 256
+    WORKER_OUT_OF_PROCESS = False  # модель в отдельном процессе (--out-of-process)
+    WORKER_RING_BYTES = 4 * 1024 * 1024  # кольцевой буфер токенов в разделяемой памяти
+    WORKER_MAX_RESTARTS = 3  # перезапусков упавшего процесса модели за сессию
+    WORKER_SHUTDOWN_TIMEOUT = 5.0  # секунды на штатное завершение процесса модели
+    COMPILED_DECODE = False  # статический KV-кэш и torch.compile шага декодирования (--compiled)
+    COMPILE_MAX_CONTEXT_TOKENS = 4096  # размер статического кэша; длиннее - обычный режим
+    COMPILE_MODE = None  # режим torch.compile на CPU: None (default) / 'max-autotune-no-cudagraphs'
+    COMPILE_CACHE_DIR = "~/.cache/gpt/inductor"  # артефакты компиляции; None - TORCHINDUCTOR_CACHE_DIR или кэш torch
+    MODEL_CHOICES = (MODEL_ID,)  # модели в выпадающем списке окна; можно ввести и другой id или путь
+    MODEL_REGISTRY_MAX_MODELS = 2  # моделей в памяти одновременно
+    MODEL_REGISTRY_BUDGET_GB = None  # память под модели реестра; None - доля памяти устройства (LOAD_PLAN_HEADROOM)
+    KV_CACHE_MODE = 'full'  # full / int8 / int4 / offload / auto - по прогнозу размера кэша запроса (--kv-cache)
+    KV_CACHE_AUTO_BUDGET_GB = None  # порог для auto; None - доля свободной памяти устройства (LOAD_PLAN_HEADROOM)
+    KV_CACHE_GROUP_SIZE = 64  # значений K/V на один масштаб при квантовании
+    KV_CACHE_RESIDUAL_TOKENS = 128  # последние токены слоя, которые хранятся без квантования
@@ -0,0 +1,204 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from src.config import Config
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    created REAL NOT NULL,
+    prompt TEXT NOT NULL,
+    answer TEXT NOT NULL DEFAULT '',
+    model TEXT,
+    params TEXT,
+    timings TEXT,
+    finish_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS turns_session ON turns(session_id, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    prompt, answer, content='turns', content_rowid='id'
+);
+"""
+
+
+class HistoryStore:
+    """
+    История диалогов в SQLite (WAL). Запись идёт в отдельном потоке: токены
+    ответа копятся и дописываются одной транзакцией не чаще раза в flush_interval.
+    Полнотекстовый индекс FTS5 по промптам и ответам обновляется, когда ход
+    завершён, а не на каждом куске ответа. Чтение (страницы, поиск) - через своё
+    соединение в потоке GUI, WAL не даёт ему ждать записи
+    """
+
+    def __init__(self,
+                 path: str = Config.HISTORY_PATH,
+                 flush_interval: float = Config.HISTORY_FLUSH_INTERVAL,
+                 ):
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.flush_interval = flush_interval
+        self.stats = {'commits': 0, 'appends': 0}
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._recover()
+        self._reader = self._connect()
+        self._commands: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _recover(self) -> None:
+        """Ходы, прерванные закрытием программы, помечаются и попадают в индекс"""
+        self._writer.execute('BEGIN')
+        # rowid самой turns_fts берётся из turns (external content), проиндексированные - в _docsize
+        last = self._writer.execute('SELECT coalesce(max(id), 0) FROM turns_fts_docsize').fetchone()[0]
+        for (turn_id,) in self._writer.execute(
+                'SELECT id FROM turns WHERE id > ? AND finish_reason IS NULL', (last,)).fetchall():
+            self._finish(turn_id, 'interrupted', '{}')
+        self._writer.execute('COMMIT')
+
+    # Запись: команды выполняются в потоке записи по порядку
+
+    def start_session(self) -> int:
+        return self._call('session', time.time()).result()
+
+    def start_turn(self, session_id: int, prompt: str, model: str | None = None, params: dict | None = None) -> int:
+        return self._call('turn', session_id, time.time(), prompt, model, json.dumps(params or {})).result()
+
+    def append(self, turn_id: int, text: str) -> None:
+        if text:
+            self._commands.put(('append', (turn_id, text), None))
+
+    def finish_turn(self, turn_id: int, reason: str, timings: dict | None = None) -> None:
+        self._commands.put(('finish', (turn_id, reason, json.dumps(timings or {}, default=str)), None))
+
+    def flush(self) -> None:
+        """Дождаться, пока всё поставленное в очередь будет записано"""
+        self._call('flush').result()
+
+    def close(self) -> None:
+        self._call('close').result()
+        self._thread.join()
+        self._reader.close()
+
+    def _call(self, kind: str, *args) -> Future:
+        future = Future()
+        self._commands.put((kind, args, future))
+        return future
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._commands.get()]
+            # Дописывание ответа ждёт flush_interval, чтобы собрать побольше токенов
+            # в одну транзакцию; команды, результат которых ждут, выполняются сразу
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1][2] is None:
+                try:
+                    batch.append(self._commands.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            closing = self._execute(batch)
+            if closing:
+                self._writer.close()
+                return
+
+    def _execute(self, batch: list) -> bool:
+        results = []
+        closing = False
+        appended: dict[int, list[str]] = {}
+        try:
+            self._writer.execute('BEGIN')
+            for kind, args, future in batch:
+                if kind == 'append':
+                    appended.setdefault(args[0], []).append(args[1])
+                    self.stats['appends'] += 1
+                    continue
+                # Перед другими командами дописываем накопленное, чтобы сохранить порядок
+                self._write_appends(appended)
+                result = None
+                if kind == 'session':
+                    result = self._writer.execute('INSERT INTO sessions(created) VALUES (?)', args).lastrowid
+                elif kind == 'turn':
+                    result = self._writer.execute(
+                        'INSERT INTO turns(session_id, created, prompt, model, params) VALUES (?, ?, ?, ?, ?)',
+                        args).lastrowid
+                elif kind == 'finish':
+                    self._finish(*args)
+                elif kind == 'close':
+                    closing = True
+                results.append((future, result))
+            self._write_appends(appended)
+            self._writer.execute('COMMIT')
+            self.stats['commits'] += 1
+        except sqlite3.Error as e:
+            if self._writer.in_transaction:
+                self._writer.execute('ROLLBACK')
+            print(f'history write failed: {e}')
+            for _, _, future in batch:
+                if future is not None:
+                    future.set_exception(e)
+            return any(kind == 'close' for kind, _, _ in batch)
+        for future, result in results:
+            if future is not None:
+                future.set_result(result)
+        return closing
+
+    def _write_appends(self, appended: dict[int, list[str]]) -> None:
+        self._writer.executemany('UPDATE turns SET answer = answer || ? WHERE id = ?',
+                                 [(''.join(parts), turn_id) for turn_id, parts in appended.items()])
+        appended.clear()
+
+    def _finish(self, turn_id: int, reason: str, timings: str) -> None:
+        self._writer.execute('UPDATE turns SET finish_reason = ?, timings = ? WHERE id = ?',
+                             (reason, timings, turn_id))
+        self._writer.execute('INSERT INTO turns_fts(rowid, prompt, answer) SELECT id, prompt, answer '
+                             'FROM turns WHERE id = ?', (turn_id,))
+
+    # Чтение: страницы по ключу (id < before), без OFFSET и COUNT(*)
+
+    def page(self, limit: int = Config.HISTORY_PAGE_SIZE, before: int | None = None) -> list[dict]:
+        """Последние ходы, от новых к старым; для следующей страницы before = id последнего"""
+        rows = self._reader.execute(
+            'SELECT id, session_id, created, substr(prompt, 1, 200) AS prompt FROM turns '
+            'WHERE id < ? ORDER BY id DESC LIMIT ?',
+            (before if before is not None else 2 ** 63 - 1, limit))
+        return [dict(row) for row in rows]
+
+    def search(self, query: str, limit: int = Config.HISTORY_PAGE_SIZE, before: int | None = None) -> list[dict]:
+        """Поиск по промптам и ответам; запрос - слова, каждое ищется как префикс"""
+        match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in query.split())
+        if not match:
+            return self.page(limit, before)
+        rows = self._reader.execute(
+            "SELECT turns.id, turns.session_id, turns.created, substr(turns.prompt, 1, 200) AS prompt, "
+            "snippet(turns_fts, -1, '[', ']', '…', 12) AS snippet "
+            'FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid '
+            'WHERE turns_fts MATCH ? AND turns_fts.rowid < ? ORDER BY turns_fts.rowid DESC LIMIT ?',
+            (match, before if before is not None else 2 ** 63 - 1, limit))
+        return [dict(row) for row in rows]
+
+    def turn(self, turn_id: int) -> dict | None:
+        row = self._reader.execute('SELECT * FROM turns WHERE id = ?', (turn_id,)).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result['params'] = json.loads(result['params'] or '{}')
+        result['timings'] = json.loads(result['timings'] or '{}')
+        return result
@@ -0,0 +1,250 @@
+import psutil
+import torch
+from transformers import DynamicCache, OffloadedCache
+
+from src.backend import KV_CACHE_MODES
+from src.config import Config
+from src.load_planner import kv_bytes_per_token
+
+GB = 1024 ** 3
+
+
+class QuantizedKVCache(DynamicCache):
+    """
+    KV-кэш с квантованием int8/int4 на чистом torch (quanto и hqq не нужны).
+    Последние residual_tokens токенов каждого слоя хранятся в исходной точности
+    (key_cache/value_cache), накопившийся хвост квантуется целиком и дописывается
+    к квантованной части. Квантование асимметричное, по группам из group_size
+    значений внутри вектора одного токена - поэтому токены квантуются независимо,
+    а crop и срезы по позициям не требуют переквантования. На каждом шаге
+    квантованная часть слоя распаковывается только на время его прохода
+    """
+
+    def __init__(self,
+                 bits: int = 8,
+                 group_size: int = Config.KV_CACHE_GROUP_SIZE,
+                 residual_tokens: int = Config.KV_CACHE_RESIDUAL_TOKENS,
+                 ):
+        if bits not in (4, 8):
+            raise ValueError(f'Квантование KV-кэша бывает 8- или 4-битным, не {bits}')
+        super().__init__()
+        self.bits = bits
+        self.group_size = group_size
+        self.residual_tokens = residual_tokens
+        self._levels = 2 ** bits - 1
+        # Квантованная часть слоя: (коды, масштаб, минимум) или None, пока её нет
+        self._keys: list[tuple[torch.Tensor, torch.Tensor, torch.Tensor] | None] = []
+        self._values: list[tuple[torch.Tensor, torch.Tensor, torch.Tensor] | None] = []
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        if layer_idx == 0:
+            self._seen_tokens += key_states.shape[-2]
+        if len(self.key_cache) < layer_idx:
+            raise ValueError('QuantizedKVCache не поддерживает пропуск слоёв')
+        if len(self.key_cache) == layer_idx:
+            self.key_cache.append(key_states)
+            self.value_cache.append(value_states)
+            self._keys.append(None)
+            self._values.append(None)
+        else:
+            self.key_cache[layer_idx] = torch.cat([self.key_cache[layer_idx], key_states], dim=-2)
+            self.value_cache[layer_idx] = torch.cat([self.value_cache[layer_idx], value_states], dim=-2)
+        keys, values = self.layer_states(layer_idx)
+        residual = self.key_cache[layer_idx]
+        if residual.shape[-2] >= self.residual_tokens:
+            self._keys[layer_idx] = self._append(self._keys[layer_idx], self._quantize(residual))
+            self._values[layer_idx] = self._append(self._values[layer_idx],
+                                                   self._quantize(self.value_cache[layer_idx]))
+            # Новый пустой тензор, а не срез: срез удерживал бы в памяти весь остаток
+            self.key_cache[layer_idx] = residual.new_empty(*residual.shape[:2], 0, residual.shape[-1])
+            self.value_cache[layer_idx] = residual.new_empty(*residual.shape[:2], 0, residual.shape[-1])
+        return keys, values
+
+    def get_seq_length(self, layer_idx: int | None = 0) -> int:
+        if len(self.key_cache) <= layer_idx:
+            return 0
+        return self._quantized_length(layer_idx) + self.key_cache[layer_idx].shape[-2]
+
+    def crop(self, max_length: int) -> None:
+        length = self.get_seq_length()
+        if max_length < 0:
+            max_length = length - abs(max_length)
+        if length <= max_length:
+            return
+        self._seen_tokens = max_length
+        for layer in range(len(self.key_cache)):
+            quantized = self._quantized_length(layer)
+            if max_length < quantized:
+                self._keys[layer] = self._slice(self._keys[layer], 0, max_length) if max_length else None
+                self._values[layer] = self._slice(self._values[layer], 0, max_length) if max_length else None
+            keep = max(0, max_length - quantized)
+            self.key_cache[layer] = self.key_cache[layer][..., :keep, :]
+            self.value_cache[layer] = self.value_cache[layer][..., :keep, :]
+
+    def layer_states(self, layer_idx: int, start: int = 0, stop: int | None = None
+                     ) -> tuple[torch.Tensor, torch.Tensor]:
+        """K и V слоя в исходной точности для позиций [start, stop)"""
+        residual_keys, residual_values = self.key_cache[layer_idx], self.value_cache[layer_idx]
+        quantized = self._quantized_length(layer_idx)
+        stop = self.get_seq_length(layer_idx) if stop is None else stop
+        keys = residual_keys[..., max(0, start - quantized):max(0, stop - quantized), :]
+        values = residual_values[..., max(0, start - quantized):max(0, stop - quantized), :]
+        if start < quantized:
+            dtype = residual_keys.dtype
+            keys = torch.cat([self._dequantize(self._slice(self._keys[layer_idx], start, min(stop, quantized)), dtype),
+                              keys], dim=-2)
+            values = torch.cat([self._dequantize(self._slice(self._values[layer_idx], start, min(stop, quantized)),
+                                                 dtype), values], dim=-2)
+        return keys, values
+
+    def __getitem__(self, layer_idx: int):
+        if layer_idx >= len(self):
+            raise KeyError(f'Cache only has {len(self)} layers, attempted to access layer with index {layer_idx}')
+        return self.layer_states(layer_idx)
+
+    def __iter__(self):
+        for layer_idx in range(len(self)):
+            yield self.layer_states(layer_idx)
+
+    def to_legacy_cache(self):
+        return tuple(self)
+
+    def _quantized_length(self, layer_idx: int) -> int:
+        quantized = self._keys[layer_idx]
+        return quantized[0].shape[-2] if quantized is not None else 0
+
+    def _group(self, head_dim: int) -> int:
+        return self.group_size if head_dim % self.group_size == 0 else head_dim
+
+    def _quantize(self, tensor: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        batch, heads, tokens, head_dim = tensor.shape
+        groups = tensor.reshape(batch, heads, tokens, head_dim // self._group(head_dim), -1).float()
+        minimum = groups.amin(dim=-1, keepdim=True)
+        scale = (groups.amax(dim=-1, keepdim=True) - minimum).clamp_(min=1e-6) / self._levels
+        codes = ((groups - minimum) / scale).round_().clamp_(0, self._levels).to(torch.uint8)
+        codes = codes.reshape(batch, heads, tokens, head_dim)
+        if self.bits == 4:
+            codes = codes[..., 0::2] | (codes[..., 1::2] << 4)
+        # Масштаб и минимум в 16 битах: для fp32-модели на CPU это вдвое меньше накладных расходов
+        meta_dtype = tensor.dtype if tensor.element_size() <= 2 else torch.float16
+        return codes, scale.to(meta_dtype), minimum.to(meta_dtype)
+
+    def _dequantize(self, quantized: tuple[torch.Tensor, torch.Tensor, torch.Tensor], dtype: torch.dtype
+                    ) -> torch.Tensor:
+        codes, scale, minimum = quantized
+        if self.bits == 4:
+            codes = torch.stack((codes & 15, codes >> 4), dim=-1).flatten(-2)
+        batch, heads, tokens, head_dim = codes.shape
+        groups = codes.reshape(batch, heads, tokens, head_dim // self._group(head_dim), -1).to(dtype)
+        return (groups * scale.to(dtype) + minimum.to(dtype)).reshape(batch, heads, tokens, head_dim)
+
+    @staticmethod
+    def _append(quantized, new):
+        if quantized is None:
+            return new
+        return tuple(torch.cat([old, part], dim=2) for old, part in zip(quantized, new))
+
+    @staticmethod
+    def _slice(quantized, start: int, stop: int):
+        return tuple(part[:, :, start:stop] for part in quantized)
+
+
+def bytes_per_element(mode: str, dtype_bytes: int, group_size: int = Config.KV_CACHE_GROUP_SIZE) -> float:
+    """Средний размер одного значения K/V в режиме mode с учётом масштабов групп"""
+    meta = 2 * min(dtype_bytes, 2) / group_size
+    if mode == 'int8':
+        return 1 + meta
+    if mode == 'int4':
+        return 0.5 + meta
+    return dtype_bytes
+
+
+def resolve_kv_cache_mode(mode: str, model, tokens: int, budget_gb: float | None = Config.KV_CACHE_AUTO_BUDGET_GB
+                          ) -> str:
+    """
+    Режим KV-кэша для запроса на tokens токенов (промпт плюс ожидаемая длина
+    ответа - StreamingThread берёт резерв диалога CHAT_RESERVE_TOKENS, а не
+    предел max_new_tokens, который почти никогда не выбирается целиком).
+    auto оставляет полную точность, пока прогнозируемый размер кэша меньше
+    бюджета, иначе выбирает int8, затем int4; на CUDA, если не помещается и int4,
+    кэш выгружается в ОЗУ. offload без CUDA - то же, что full: кэш и так в ОЗУ
+    """
+    if mode not in KV_CACHE_MODES:
+        raise ValueError(f'Неизвестный режим KV-кэша: {mode}')
+    cuda = model.device.type == 'cuda'
+    if mode == 'offload' and not cuda:
+        return 'full'
+    if mode != 'auto':
+        return mode
+    tokens = min(tokens, getattr(model.config, 'max_position_embeddings', tokens))
+    dtype_bytes = torch.tensor([], dtype=model.dtype).element_size()
+    elements = kv_bytes_per_token(model.config, 1) * tokens
+    if budget_gb is not None:
+        budget = budget_gb * GB
+    else:
+        free = torch.cuda.mem_get_info(model.device)[0] if cuda else psutil.virtual_memory().available
+        budget = free * Config.LOAD_PLAN_HEADROOM - Config.LOAD_PLAN_OVERHEAD_GB * GB
+    for candidate in ('full', 'int8', 'int4'):
+        if elements * bytes_per_element(candidate, dtype_bytes) <= budget:
+            return candidate
+    host_budget = psutil.virtual_memory().available * Config.LOAD_PLAN_HEADROOM
+    if cuda and elements * dtype_bytes <= host_budget:
+        return 'offload'
+    return 'int4'
+
+
+def new_cache(mode: str) -> DynamicCache:
+    if mode in ('int8', 'int4'):
+        return QuantizedKVCache(bits=8 if mode == 'int8' else 4)
+    if mode == 'offload':
+        # Слои лежат в ОЗУ, следующий копируется на GPU в отдельном потоке CUDA, пока считается текущий
+        return OffloadedCache()
+    return DynamicCache()
+
+
+def cache_mode(cache: DynamicCache) -> str:
+    if isinstance(cache, QuantizedKVCache):
+        return f'int{cache.bits}'
+    if isinstance(cache, OffloadedCache):
+        return 'offload'
+    return 'full'
+
+
+def layer_states(cache: DynamicCache, layer_idx: int, start: int = 0, stop: int | None = None
+                 ) -> tuple[torch.Tensor, torch.Tensor]:
+    """K и V слоя в исходной точности на устройстве модели - для любого режима кэша"""
+    if isinstance(cache, QuantizedKVCache):
+        return cache.layer_states(layer_idx, start, stop)
+    keys, values = cache.key_cache[layer_idx][:, :, start:stop], cache.value_cache[layer_idx][:, :, start:stop]
+    if isinstance(cache, OffloadedCache):
+        device = cache.original_device[layer_idx]
+        keys, values = keys.to(device), values.to(device)
+    return keys, values
+
+
+def convert_cache(cache: DynamicCache | None, mode: str) -> DynamicCache:
+    """
+    Кэш в режиме mode с тем же содержимым. Подходящий кэш возвращается как есть;
+    иначе слои переносятся по одному, и перенесённый слой старого кэша сразу
+    освобождается - старый кэш после этого использовать нельзя
+    """
+    if cache is None:
+        return new_cache(mode)
+    if cache_mode(cache) == mode and (mode != 'full' or type(cache) is DynamicCache):
+        return cache
+    converted = new_cache(mode)
+    for layer in range(len(cache)):
+        keys, values = layer_states(cache, layer)
+        converted.update(keys, values, layer)
+        cache.key_cache[layer] = cache.value_cache[layer] = []
+        if isinstance(cache, QuantizedKVCache):
+            cache._keys[layer] = cache._values[layer] = None
+    return converted
+
+
+def cache_nbytes(cache: DynamicCache) -> int:
+    """Сколько памяти занимает кэш, включая квантованную часть и масштабы"""
+    tensors = [tensor for tensor in cache.key_cache + cache.value_cache if isinstance(tensor, torch.Tensor)]
+    if isinstance(cache, QuantizedKVCache):
+        tensors += [part for quantized in cache._keys + cache._values if quantized is not None for part in quantized]
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
@@ -0,0 +1,248 @@
+import json
+import os
+import struct
+
+import psutil
+
+from src.backend import resolve_device, resolve_quantization
+from src.config import Config
+
+# torch и transformers импортируются внутри функций, как в src/backend.py
+
+
+DTYPE_BYTES = {
+    'F64': 8, 'I64': 8, 'F32': 4, 'I32': 4, 'F16': 2, 'BF16': 2, 'I16': 2,
+    'I8': 1, 'U8': 1, 'BOOL': 1, 'F8_E4M3': 1, 'F8_E5M2': 1,
+}
+# NF4: полбайта на вес плюс fp32-масштаб на блок из 64 весов
+NF4_BYTES_PER_PARAM = 0.5 + 4 / 64
+GB = 1024 ** 3
+
+
+def _read_header(path: str) -> dict:
+    """Заголовок safetensors: 8 байт длины и JSON с dtype и shape тензоров - без чтения весов"""
+    with open(path, 'rb') as file:
+        length = struct.unpack('<Q', file.read(8))[0]
+        header = json.loads(file.read(length))
+    header.pop('__metadata__', None)
+    return header
+
+
+def _local_files(path: str) -> list[str] | None:
+    index = os.path.join(path, 'model.safetensors.index.json')
+    if os.path.exists(index):
+        with open(index, encoding='utf-8') as file:
+            names = sorted(set(json.load(file)['weight_map'].values()))
+    else:
+        names = sorted(name for name in os.listdir(path) if name.endswith('.safetensors'))
+    files = [os.path.join(path, name) for name in names]
+    return files if files and all(os.path.exists(file) for file in files) else None
+
+
+def read_tensors(model_id: str, revision: str | None = None) -> list[tuple[str, str, int]]:
+    """
+    (имя, dtype, число элементов) каждого тензора модели. Локальная папка или
+    снимок в кэше HF читаются с диска, иначе заголовки скачиваются с хаба
+    HTTP range-запросами (get_safetensors_metadata), веса не загружаются
+    """
+    path = model_id if os.path.isdir(model_id) else None
+    if path is None:
+        from huggingface_hub import snapshot_download
+        try:
+            path = snapshot_download(model_id, revision=revision, local_files_only=True,
+                                     allow_patterns=['*.safetensors', '*.json'])
+        except Exception:
+            path = None
+    files = _local_files(path) if path is not None else None
+    if files is not None:
+        tensors = []
+        for file in files:
+            for name, info in _read_header(file).items():
+                numel = 1
+                for size in info['shape']:
+                    numel *= size
+                tensors.append((name, info['dtype'], numel))
+        return tensors
+    from huggingface_hub import get_safetensors_metadata
+    metadata = get_safetensors_metadata(model_id, revision=revision)
+    tensors = []
+    for file in metadata.files_metadata.values():
+        for name, info in file.tensors.items():
+            tensors.append((name, info.dtype, info.parameter_count))
+    return tensors
+
+
+def _quantizable(name: str) -> bool:
+    """Веса Linear-слоёв; эмбеддинги, lm_head и нормы квантование не трогает"""
+    return name.endswith('.weight') and not any(part in name for part in ('embed', 'lm_head', 'norm'))
+
+
+def kv_bytes_per_token(config, dtype_bytes: int) -> int:
+    """Размер K и V одного токена во всех слоях"""
+    head_dim = getattr(config, 'head_dim', None) or config.hidden_size // config.num_attention_heads
+    kv_heads = getattr(config, 'num_key_value_heads', None) or config.num_attention_heads
+    return 2 * config.num_hidden_layers * kv_heads * head_dim * dtype_bytes
+
+
+class LoadPlan:
+    """
+    План загрузки: устройство, точность, device_map и оценка памяти (байты).
+    device_bytes - на GPU, ram_bytes - в ОЗУ (для CPU и выгруженных на CPU слоёв).
+    После загрузки measure() записывает фактический расход для сравнения с оценкой
+    """
+
+    def __init__(self,
+                 device: str,
+                 quantization: str | None,
+                 offload: bool,
+                 weights_bytes: int,
+                 kv_bytes: int,
+                 device_bytes: int,
+                 ram_bytes: int,
+                 fits: bool,
+                 context_tokens: int,
+                 max_memory: dict | None = None,
+                 ):
+        self.device = device
+        self.quantization = quantization
+        self.offload = offload
+        self.weights_bytes = weights_bytes
+        self.kv_bytes = kv_bytes
+        self.device_bytes = device_bytes
+        self.ram_bytes = ram_bytes
+        self.fits = fits
+        self.context_tokens = context_tokens
+        self.max_memory = max_memory
+        self.free_device = 0
+        self.free_ram = 0
+        self.candidates: list['LoadPlan'] = []
+        self.measured: dict[str, int] = {}
+        self._baseline: dict[str, int] = {}
+
+    @property
+    def device_map(self) -> str:
+        return 'auto' if self.offload else self.device
+
+    @property
+    def name(self) -> str:
+        return f"{self.quantization or 'none'} на {self.device}" + (' с выгрузкой на CPU' if self.offload else '')
+
+    def describe(self) -> str:
+        memory = [f"{self.device_bytes / GB:.2f} GB GPU"] if self.device == 'cuda' else []
+        if self.ram_bytes:
+            memory.append(f"{self.ram_bytes / GB:.2f} GB RAM")
+        free = [f'{self.free_device / GB:.1f} GB GPU'] if self.device == 'cuda' else []
+        free.append(f'{self.free_ram / GB:.1f} GB RAM')
+        return (f"{self.name}: веса {self.weights_bytes / GB:.2f} GB, KV-кэш на {self.context_tokens} токенов "
+                f"{self.kv_bytes / GB:.2f} GB; нужно {' + '.join(memory)}, свободно {', '.join(free)}")
+
+    def start_measure(self) -> None:
+        import torch
+        self._baseline = {'ram': psutil.Process().memory_info().rss}
+        if self.device == 'cuda':
+            self._baseline['device'] = torch.cuda.memory_allocated()
+
+    def measure(self) -> dict:
+        """Фактический прирост памяти после загрузки против оценки весов"""
+        import torch
+        self.measured = {'ram': psutil.Process().memory_info().rss - self._baseline.get('ram', 0)}
+        if self.device == 'cuda':
+            self.measured['device'] = torch.cuda.memory_allocated() - self._baseline.get('device', 0)
+        estimate = self.weights_bytes if not self.offload else self.weights_bytes - self.ram_bytes
+        actual = self.measured.get('device', self.measured['ram'])
+        return {
+            'plan': self.name,
+            'estimated_weights_gb': round(estimate / GB, 2),
+            'measured_gb': round(actual / GB, 2),
+            'error_percent': round((actual / estimate - 1) * 100, 1) if estimate else None,
+        }
+
+
+def _precisions(device: str, quantization: str | None) -> list[str | None]:
+    """
+    Точности для плана, от лучшей по качеству: на CUDA при quantization='auto' -
+    без квантования, затем nf4, иначе только заданная. На CPU int8 не перебирается:
+    Linear квантуются после загрузки в CPU_DTYPE, пик памяти тот же, что без
+    квантования, и int8 не поместится там, где не поместилась полная точность
+    """
+    if quantization == 'auto' and device == 'cuda':
+        return [None, 'nf4']
+    return [resolve_quantization(device, quantization)]
+
+
+def plan_load(model_id: str = Config.MODEL_ID,
+              revision: str | None = None,
+              device: str = Config.DEVICE,
+              quantization: str | None = Config.QUANTIZATION,
+              context_tokens: int = Config.CHAT_MAX_CONTEXT_TOKENS,
+              ) -> LoadPlan:
+    """
+    Оценить память для каждого варианта загрузки и выбрать первый, который помещается:
+    точности по убыванию качества на GPU, они же с выгрузкой части слоёв на CPU, затем CPU.
+    Если не помещается ничего, возвращается первый вариант с fits=False
+    """
+    import torch
+    from transformers import AutoConfig
+
+    if revision is None and model_id == Config.MODEL_ID:
+        revision = Config.MODEL_REVISION
+    tensors = read_tensors(model_id, revision)
+    config = AutoConfig.from_pretrained(model_id, revision=revision)
+    context_tokens = min(context_tokens, getattr(config, 'max_position_embeddings', context_tokens))
+    kv_elements = kv_bytes_per_token(config, 1) * context_tokens
+
+    free_ram = psutil.virtual_memory().available
+    free_device = torch.cuda.mem_get_info()[0] if torch.cuda.is_available() else 0
+    ram_budget = free_ram * Config.LOAD_PLAN_HEADROOM - Config.LOAD_PLAN_OVERHEAD_GB * GB
+    device_budget = free_device * Config.LOAD_PLAN_HEADROOM - Config.LOAD_PLAN_OVERHEAD_GB * GB
+    cpu_dtype_bytes = torch.tensor([], dtype=getattr(torch, Config.CPU_DTYPE)).element_size()
+
+    def weights(target_dtype_bytes: int | None, quantized: str | None) -> int:
+        total = 0
+        for name, dtype, numel in tensors:
+            if quantized == 'nf4' and _quantizable(name):
+                total += numel * NF4_BYTES_PER_PARAM
+            else:
+                # Пиковый расход int8: Linear квантуются уже после загрузки в CPU_DTYPE
+                total += numel * (target_dtype_bytes or DTYPE_BYTES.get(dtype, 4))
+        return int(total)
+
+    devices = ['cuda', 'cpu'] if device == 'auto' and torch.cuda.is_available() else [resolve_device(device)]
+    candidates = []
+    for target in devices:
+        try:
+            precisions = _precisions(target, quantization)
+        except ValueError:
+            continue
+        if target == 'cuda':
+            kv_bytes = kv_elements * 2  # bf16
+            for precision in precisions:
+                weights_bytes = weights(None, precision)
+                candidates.append(LoadPlan('cuda', precision, False, weights_bytes, kv_bytes,
+                                           weights_bytes + kv_bytes, 0,
+                                           weights_bytes + kv_bytes <= device_budget, context_tokens))
+            # Выгрузка слоёв на CPU медленнее любой точности целиком на GPU, поэтому она после них.
+            # Не поместившиеся на GPU слои лежат на CPU; при nf4 - в fp32 (llm_int8_enable_fp32_cpu_offload)
+            on_device = max(0, int(device_budget - kv_bytes))
+            for precision in precisions:
+                weights_bytes = weights(None, precision)
+                offloaded_fraction = max(0.0, 1 - on_device / weights_bytes) if weights_bytes else 0.0
+                ram_bytes = int(weights(4 if precision == 'nf4' else None, None) * offloaded_fraction)
+                candidates.append(LoadPlan('cuda', precision, True, weights_bytes, kv_bytes,
+                                           min(weights_bytes, on_device) + kv_bytes, ram_bytes,
+                                           on_device > 0 and ram_bytes <= ram_budget, context_tokens,
+                                           max_memory={0: on_device, 'cpu': max(0, int(ram_budget))}))
+        else:
+            kv_bytes = kv_elements * cpu_dtype_bytes
+            for precision in precisions:
+                weights_bytes = weights(cpu_dtype_bytes, precision)
+                candidates.append(LoadPlan('cpu', precision, False, weights_bytes, kv_bytes, 0,
+                                           weights_bytes + kv_bytes, weights_bytes + kv_bytes <= ram_budget,
+                                           context_tokens))
+    if not candidates:
+        raise ValueError(f'Нет подходящего устройства для device={device}, quantization={quantization}')
+    plan = next((candidate for candidate in candidates if candidate.fits), candidates[0])
+    for candidate in candidates:
+        candidate.free_device, candidate.free_ram = free_device, free_ram
+    plan.candidates = candidates
+    return plan
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from src.config import Config
+
+
+def weights_signature(path: str) -> str | None:
+    """Отпечаток весов в локальной папке по именам, размерам и времени изменения файлов; None - не папка"""
+    if not os.path.isdir(path):
+        return None
+    files = sorted(
+        (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+        for entry in os.scandir(path)
+        if entry.name.endswith(('.safetensors', '.bin'))
+    )
+    return hashlib.sha256(json.dumps(files).encode()).hexdigest()[:16]
+
+
+class ModelCache:
+    """
+    Локальный кэш уже квантованных/сконвертированных весов в формате safetensors.
+    Запись определяется id модели, ревизией и конфигом квантования; при загрузке
+    safetensors читаются через mmap. Старые записи вытесняются по бюджету диска (LRU)
+    """
+
+    META_FILE = 'cache_meta.json'
+
+    def __init__(self,
+                 root: str = Config.MODEL_CACHE_DIR,
+                 budget_bytes: int = Config.MODEL_CACHE_BUDGET_GB * 1024 ** 3,
+                 ):
+        self.root = os.path.expanduser(root)
+        self.budget_bytes = budget_bytes
+
+    @staticmethod
+    def key(model_id: str, revision: str | None, quantization: dict | None) -> str:
+        payload = json.dumps([model_id, revision, quantization], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> str | None:
+        """Путь к записи или None; обновляет время последнего использования"""
+        path = self.path(key)
+        meta = self._read_meta(path)
+        if meta is None:
+            return None
+        meta['last_used'] = time.time()
+        self._write_meta(path, meta)
+        return path
+
+    def meta(self, key: str) -> dict | None:
+        return self._read_meta(self.path(key))
+
+    def put(self, key: str, model, tokenizer, description: dict) -> str:
+        path = self.path(key)
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        model.save_pretrained(tmp_path, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_path)
+        meta = {
+            **description,
+            'size': self._dir_size(tmp_path),
+            'created': time.time(),
+            'last_used': time.time(),
+        }
+        self._write_meta(tmp_path, meta)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.evict(keep=key)
+        return path
+
+    def entries(self) -> list[tuple[str, dict]]:
+        if not os.path.isdir(self.root):
+            return []
+        result = []
+        for name in os.listdir(self.root):
+            meta = self._read_meta(os.path.join(self.root, name))
+            if meta is not None:
+                result.append((name, meta))
+        return result
+
+    def evict(self, keep: str | None = None) -> list[str]:
+        """Удалить самые давно использованные записи, пока кэш не уложится в бюджет"""
+        entries = sorted(self.entries(), key=lambda entry: entry[1]['last_used'])
+        total = sum(meta['size'] for _, meta in entries)
+        removed = []
+        for key, meta in entries:
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= meta['size']
+            removed.append(key)
+        return removed
+
+    def _read_meta(self, path: str) -> dict | None:
+        try:
+            with open(os.path.join(path, self.META_FILE), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, path: str, meta: dict) -> None:
+        with open(os.path.join(path, self.META_FILE), 'w', encoding='utf-8') as file:
+            json.dump(meta, file, indent=2)
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, files in os.walk(path)
+            for name in files
+        )
@@ -1,14 +1,105 @@
 from PyQt6.QtCore import QThread, pyqtSignal
 
-from utils import get_model_and_tokenizer
+from src.config import Config
+from src.load_planner import plan_load
+from src.warmup import warmup_model
+from utils import get_draft_model, get_model_and_tokenizer
+
+
+def load_model(model_id: str = Config.MODEL_ID,
+               use_cache: bool = Config.MODEL_CACHE_ENABLED,
+               device: str = Config.DEVICE,
+               quantization: str = Config.QUANTIZATION,
+               draft_model_id: str | None = None,
+               warmup: bool = Config.WARMUP_ENABLED,
+               load_plan: bool = Config.LOAD_PLAN_ENABLED,
+               compiled: bool = Config.COMPILED_DECODE,
+               on_plan=None,
+               ) -> tuple:
+    """
+    Полная загрузка: план памяти, модель и токенизатор, прогрев, компиляция шага
+    декодирования (compiled), черновая модель.
+    Возвращает (model, tokenizer, draft_model, timings); общая для потока загрузки
+    и процесса модели (src/process_worker.py)
+    """
+    timings = {}
+    plan = None
+    if load_plan:
+        try:
+            plan = plan_load(model_id, device=device, quantization=quantization)
+        except Exception as e:
+            # Без заголовков (нет сети, не safetensors) грузим как раньше, без плана
+            print(f'load plan unavailable: {e}')
+    if plan is not None:
+        if on_plan is not None:
+            on_plan(plan)
+        if not plan.fits:
+            raise MemoryError(f'Недостаточно памяти для загрузки модели. {plan.describe()}')
+        plan.start_measure()
+    model, tokenizer = get_model_and_tokenizer(
+        model_id=model_id,
+        use_cache=use_cache,
+        device=device,
+        quantization=quantization,
+        timings=timings,
+        plan=plan,
+    )
+    if plan is not None:
+        timings['load_plan'] = plan.measure()
+    if warmup:
+        warmup_model(model, tokenizer, timings)
+    if compiled:
+        from src.compiled_decode import enable_compiled_decode
+        enable_compiled_decode(model, tokenizer, timings)
+    draft_model = None
+    if draft_model_id:
+        draft_model = get_draft_model(draft_model_id, device=device, timings=timings)
+    return model, tokenizer, draft_model, timings
 
 
 class ModelLoaderThread(QThread):
     model_loaded = pyqtSignal(object, object)  # Сигнал для передачи модели и токенизатора
     error = pyqtSignal(str)  # Сигнал для передачи ошибки
+    draft_loaded = pyqtSignal(object)  # Черновая модель для спекулятивного декодирования
+    timings_ready = pyqtSignal(object)  # Время этапов загрузки
+    plan_ready = pyqtSignal(object)  # LoadPlan до начала загрузки
+
+    def __init__(self,
+                 model_id: str = Config.MODEL_ID,
+                 use_cache: bool = Config.MODEL_CACHE_ENABLED,
+                 device: str = Config.DEVICE,
+                 quantization: str = Config.QUANTIZATION,
+                 draft_model_id: str | None = None,
+                 warmup: bool = Config.WARMUP_ENABLED,
+                 load_plan: bool = Config.LOAD_PLAN_ENABLED,
+                 compiled: bool = Config.COMPILED_DECODE,
+                 ):
+        super().__init__()
+        self.model_id = model_id
+        self.use_cache = use_cache
+        self.device = device
+        self.quantization = quantization
+        self.draft_model_id = draft_model_id
+        self.warmup = warmup
+        self.load_plan = load_plan
+        self.compiled = compiled
 
     def run(self):
         try:
-            self.model_loaded.emit(*get_model_and_tokenizer())
+            model, tokenizer, draft_model, timings = load_model(
+                model_id=self.model_id,
+                use_cache=self.use_cache,
+                device=self.device,
+                quantization=self.quantization,
+                draft_model_id=self.draft_model_id,
+                warmup=self.warmup,
+                load_plan=self.load_plan,
+                compiled=self.compiled,
+                on_plan=self.plan_ready.emit,
+            )
+            if draft_model is not None:
+                self.draft_loaded.emit(draft_model)
+            self.timings_ready.emit(timings)
+            self.model_loaded.emit(model, tokenizer)
         except Exception as e:
             self.error.emit(str(e))
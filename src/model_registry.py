@@ -0,0 +1,211 @@
+import gc
+import time
+from collections import OrderedDict
+
+import psutil
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from src.backend import empty_device_cache
+from src.config import Config
+from src.model_loader import ModelLoaderThread
+
+GB = 1024 ** 3
+
+
+class ModelEntry:
+    """Загруженная модель в реестре: веса, токенизатор и что показать в выборе модели"""
+
+    def __init__(self, model_id: str, model, tokenizer, draft_model, timings: dict, load_seconds: float):
+        self.model_id = model_id
+        self.model = model
+        self.tokenizer = tokenizer
+        self.draft_model = draft_model
+        self.timings = timings
+        self.load_seconds = load_seconds
+        self.resident_bytes = sum(
+            candidate.get_memory_footprint() for candidate in (model, draft_model) if candidate is not None)
+        self.device = timings.get('device', 'cpu')
+
+    def describe(self) -> str:
+        return f'{self.model_id} ({self.load_seconds:.1f} с, {self.resident_bytes / GB:.2f} GB)'
+
+
+class ModelRegistry(QObject):
+    """
+    Несколько моделей в памяти одновременно. Запрошенная модель, если она уже
+    загружена, выдаётся сразу, иначе загружается в фоне, пока текущая продолжает
+    отвечать, - окно переключается на неё по сигналу ready. Модели сверх
+    max_models или бюджета памяти выгружаются, начиная с давно не использованной;
+    активная (та, что сейчас отвечает) выгружается, только если её перезагрузке
+    не хватает места на вторую копию
+    """
+    loading = pyqtSignal(str)
+    ready = pyqtSignal(object)  # ModelEntry
+    failed = pyqtSignal(str, str)  # id модели, ошибка
+    plan_ready = pyqtSignal(object)
+    timings_ready = pyqtSignal(object)
+    changed = pyqtSignal()  # изменился состав загруженных моделей
+    unloading = pyqtSignal(str)  # модель выгружается до перезагрузки - окно должно отпустить ссылки на неё
+
+    def __init__(self,
+                 use_cache: bool = Config.MODEL_CACHE_ENABLED,
+                 device: str = Config.DEVICE,
+                 quantization: str = Config.QUANTIZATION,
+                 draft_model_id: str | None = None,
+                 load_plan: bool = Config.LOAD_PLAN_ENABLED,
+                 compiled: bool = Config.COMPILED_DECODE,
+                 budget_gb: float | None = Config.MODEL_REGISTRY_BUDGET_GB,
+                 max_models: int = Config.MODEL_REGISTRY_MAX_MODELS,
+                 ):
+        super().__init__()
+        self.loader_kwargs = dict(use_cache=use_cache, device=device, quantization=quantization,
+                                  draft_model_id=draft_model_id, load_plan=load_plan, compiled=compiled)
+        self.budget_gb = budget_gb
+        self.max_models = max_models
+        self.active_id: str | None = None
+        self._entries: OrderedDict[str, ModelEntry] = OrderedDict()  # от давно использованной к недавней
+        self._sizes: dict[str, int] = {}  # размеры загружавшихся раньше моделей, для оценки перед загрузкой
+        self._loader: ModelLoaderThread | None = None
+        self._loading_id: str | None = None
+        self._pending: tuple[str, bool] | None = None
+        self._load_started = 0.0
+        self._draft_model = None
+        self._timings: dict = {}
+        self._replaced_device: str | None = None  # устройство заменённой при перезагрузке копии
+
+    @property
+    def loading_id(self) -> str | None:
+        return self._loading_id
+
+    def entries(self) -> list[ModelEntry]:
+        """Загруженные модели, недавно использованные первыми"""
+        return list(reversed(self._entries.values()))
+
+    def get(self, model_id: str) -> ModelEntry | None:
+        return self._entries.get(model_id)
+
+    def request(self, model_id: str, reload: bool = False) -> None:
+        """
+        Сделать модель доступной: из памяти сразу или загрузкой в фоне. reload загружает
+        свежую копию, старая отвечает, пока новая не готова. Новый запрос во время
+        загрузки ждёт её окончания, из нескольких ожидающих остаётся последний
+        """
+        entry = self._entries.get(model_id)
+        if entry is not None and not reload:
+            self._entries.move_to_end(model_id)
+            self.ready.emit(entry)
+            return
+        if self._loader is not None:
+            self._pending = (model_id, reload)
+            return
+        # При перезагрузке старая копия остаётся в памяти и отвечает, пока грузится новая, -
+        # новая копия считается в бюджете, как ещё одна модель
+        incoming_bytes = self._estimate(model_id)
+        self._make_room(incoming_bytes, incoming=True, keep=model_id)
+        if entry is not None and self._over_budget(incoming_bytes, incoming=True):
+            # Две копии не помещаются: старая выгружается до загрузки новой, иначе план загрузки
+            # увидел бы память занятой и выбрал выгрузку на CPU или не поместился бы вовсе
+            self.unloading.emit(model_id)
+            del entry
+            self.evict(model_id)
+        self._loading_id = model_id
+        self._load_started = time.perf_counter()
+        self._draft_model, self._timings = None, {}
+        self._loader = ModelLoaderThread(model_id=model_id, **self.loader_kwargs)
+        self._loader.plan_ready.connect(self.plan_ready.emit)
+        self._loader.draft_loaded.connect(self._on_draft_loaded)
+        self._loader.timings_ready.connect(self._on_timings)
+        self._loader.model_loaded.connect(self._on_loaded)
+        self._loader.error.connect(self._on_error)
+        self._loader.finished.connect(self._on_loader_finished)
+        self._loader.start()
+        self.loading.emit(model_id)
+
+    def set_active(self, model_id: str) -> None:
+        self.active_id = model_id
+        if model_id in self._entries:
+            self._entries.move_to_end(model_id)
+        if self._replaced_device is not None:
+            # Окно переключилось с заменённой копии - на неё больше никто не ссылается
+            gc.collect()
+            empty_device_cache(self._replaced_device)
+            self._replaced_device = None
+        self._make_room()
+
+    def evict(self, model_id: str) -> None:
+        entry = self._entries.pop(model_id, None)
+        if entry is None:
+            return
+        if model_id == self.active_id:
+            self.active_id = None
+        device = entry.device
+        del entry
+        gc.collect()
+        empty_device_cache(device)
+        self.changed.emit()
+
+    def _budget_bytes(self, device: str) -> float:
+        if self.budget_gb is not None:
+            return self.budget_gb * GB
+        if device == 'cuda':
+            import torch
+            total = torch.cuda.mem_get_info()[1]
+        else:
+            total = psutil.virtual_memory().total
+        return total * Config.LOAD_PLAN_HEADROOM - Config.LOAD_PLAN_OVERHEAD_GB * GB
+
+    def _estimate(self, model_id: str) -> int:
+        """Размер модели до загрузки: прошлый замер или, если её не загружали, самая большая из загруженных"""
+        if model_id in self._sizes:
+            return self._sizes[model_id]
+        return max((entry.resident_bytes for entry in self._entries.values()), default=0)
+
+    def _over_budget(self, incoming_bytes: int, incoming: bool) -> bool:
+        # Все модели реестра грузятся с одними настройками, поэтому бюджет один - устройства последней
+        device = next(reversed(self._entries.values())).device if self._entries else 'cpu'
+        used = sum(entry.resident_bytes for entry in self._entries.values()) + incoming_bytes
+        return len(self._entries) + incoming > self.max_models or used > self._budget_bytes(device)
+
+    def _make_room(self, incoming_bytes: int = 0, incoming: bool = False, keep: str | None = None) -> None:
+        """Выгружать давно не использованные модели, пока не поместится ещё одна размером incoming_bytes"""
+        for model_id in list(self._entries):
+            if not self._over_budget(incoming_bytes, incoming):
+                return
+            if model_id not in (self.active_id, keep):
+                self.evict(model_id)
+
+    def _on_draft_loaded(self, draft_model) -> None:
+        self._draft_model = draft_model
+
+    def _on_timings(self, timings: dict) -> None:
+        self._timings = timings
+        self.timings_ready.emit(timings)
+
+    def _on_loaded(self, model, tokenizer) -> None:
+        model_id = self._loading_id
+        entry = ModelEntry(model_id, model, tokenizer, self._draft_model, self._timings,
+                           time.perf_counter() - self._load_started)
+        self._draft_model = None
+        self._sizes[model_id] = entry.resident_bytes
+        # При перезагрузке старая копия заменяется; она освободится, когда окно переключится на новую
+        replaced = self._entries.pop(model_id, None)
+        if replaced is not None:
+            self._replaced_device = replaced.device
+        self._entries[model_id] = entry
+        self.changed.emit()
+        self.ready.emit(entry)
+        # Окно может отложить переключение до конца генерации, и active_id ещё указывает на старую
+        # модель: если оценка размера оказалась мала, выгружаться должна не только что загруженная
+        self._make_room(keep=model_id)
+
+    def _on_error(self, message: str) -> None:
+        self.failed.emit(self._loading_id, message)
+
+    def _on_loader_finished(self) -> None:
+        self._loader = None
+        self._loading_id = None
+        gc.collect()
+        if self._pending is not None:
+            model_id, reload = self._pending
+            self._pending = None
+            self.request(model_id, reload)
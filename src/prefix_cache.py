@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import threading
+
+import torch
+from transformers import DynamicCache
+
+from src.config import Config
+from src.kv_cache import layer_states
+
+
+class _Block:
+    """Узел дерева: block_tokens токенов и их K/V по всем слоям"""
+    __slots__ = ('tokens', 'keys', 'values', 'parent', 'children', 'last_used', 'nbytes')
+
+    def __init__(self, tokens: tuple[int, ...], keys: list[torch.Tensor], values: list[torch.Tensor],
+                 parent: '_Block | None'):
+        self.tokens = tokens
+        self.keys = keys
+        self.values = values
+        self.parent = parent
+        self.children: dict[tuple[int, ...], _Block] = {}
+        self.last_used = 0
+        self.nbytes = sum(t.numel() * t.element_size() for t in keys + values)
+
+
+class PrefixCache:
+    """
+    Общий между запросами кэш префиксов: радикс-дерево блоков KV-кэша, ключ -
+    последовательность токенов. Для нового запроса находится самый длинный
+    закэшированный префикс (целыми блоками), префилл идёт только по остатку.
+    Листья вытесняются по LRU, когда объём превышает бюджет
+    """
+
+    def __init__(self,
+                 block_tokens: int = Config.PREFIX_CACHE_BLOCK_TOKENS,
+                 budget_bytes: int = Config.PREFIX_CACHE_BUDGET_MB * 1024 ** 2,
+                 ):
+        self.block_tokens = block_tokens
+        self.budget_bytes = budget_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'hit_tokens': 0, 'lookup_tokens': 0,
+                      'inserted_blocks': 0, 'evicted_blocks': 0, 'bytes': 0, 'blocks': 0}
+        self._root = _Block((), [], [], None)
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def lookup(self, ids: list[int]) -> tuple[DynamicCache | None, int]:
+        """
+        Кэш для самого длинного известного префикса ids и его длина в токенах.
+        Последний токен всегда остаётся на префилл - он нужен для логитов
+        """
+        with self._lock:
+            blocks = self._match(ids, len(ids) - 1)
+            now = next(self._clock)
+            for block in blocks:
+                block.last_used = now
+            self.stats['lookup_tokens'] += len(ids)
+            if not blocks:
+                self.stats['misses'] += 1
+                return None, 0
+            self.stats['hits'] += 1
+            self.stats['hit_tokens'] += len(blocks) * self.block_tokens
+            cache = DynamicCache()
+            for layer in range(len(blocks[0].keys)):
+                cache.update(
+                    torch.cat([block.keys[layer] for block in blocks], dim=2),
+                    torch.cat([block.values[layer] for block in blocks], dim=2),
+                    layer,
+                )
+        return cache, len(blocks) * self.block_tokens
+
+    def insert(self, ids: list[int], cache: DynamicCache) -> int:
+        """Добавить целые блоки префикса ids, посчитанные в cache; возвращает число новых блоков"""
+        length = min(len(ids), cache.get_seq_length())
+        if not length:
+            return 0
+        # Больше бюджета всё равно не поместится - не копируем лишнего. Блоки хранятся
+        # в исходной точности при любом режиме кэша (src/kv_cache.py)
+        token_bytes = sum(t.numel() * t.element_size()
+                          for layer in range(len(cache)) for t in layer_states(cache, layer, 0, 1))
+        length = min(length, self.budget_bytes // token_bytes) // self.block_tokens * self.block_tokens
+        added = 0
+        with self._lock:
+            node = self._root
+            now = next(self._clock)
+            for start in range(0, length, self.block_tokens):
+                tokens = tuple(ids[start:start + self.block_tokens])
+                child = node.children.get(tokens)
+                if child is None:
+                    stop = start + self.block_tokens
+                    # Копия, чтобы блок не удерживал в памяти весь тензор кэша
+                    states = [layer_states(cache, layer, start, stop) for layer in range(len(cache))]
+                    child = _Block(
+                        tokens,
+                        [k.clone() for k, _ in states],
+                        [v.clone() for _, v in states],
+                        node,
+                    )
+                    node.children[tokens] = child
+                    self.stats['bytes'] += child.nbytes
+                    self.stats['blocks'] += 1
+                    self.stats['inserted_blocks'] += 1
+                    added += 1
+                child.last_used = now
+                node = child
+            self._evict()
+        return added
+
+    def clear(self) -> None:
+        with self._lock:
+            self._root.children.clear()
+            self.stats['bytes'] = self.stats['blocks'] = 0
+
+    def _match(self, ids: list[int], limit: int) -> list[_Block]:
+        blocks = []
+        node = self._root
+        for start in range(0, limit - self.block_tokens + 1, self.block_tokens):
+            node = node.children.get(tuple(ids[start:start + self.block_tokens]))
+            if node is None:
+                break
+            blocks.append(node)
+        return blocks
+
+    def _evict(self) -> None:
+        if self.stats['bytes'] <= self.budget_bytes:
+            return
+        leaves = [(node.last_used, id(node), node) for node in self._nodes() if not node.children]
+        heapq.heapify(leaves)
+        while self.stats['bytes'] > self.budget_bytes and leaves:
+            _, _, victim = heapq.heappop(leaves)
+            parent = victim.parent
+            del parent.children[victim.tokens]
+            self.stats['bytes'] -= victim.nbytes
+            self.stats['blocks'] -= 1
+            self.stats['evicted_blocks'] += 1
+            if parent is not self._root and not parent.children:
+                heapq.heappush(leaves, (parent.last_used, id(parent), parent))
+
+    def _nodes(self):
+        stack = list(self._root.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
@@ -0,0 +1,400 @@
+import itertools
+import json
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING
+
+from PyQt6.QtCore import QObject, QSocketNotifier, pyqtSignal
+
+from src.config import Config
+
+if TYPE_CHECKING:
+    from src.scheduler import GenerationRequest
+
+
+class SharedRing:
+    """
+    Кольцевой буфер в разделяемой памяти: один писатель (процесс модели), один
+    читатель (GUI). Заголовок - позиции записи и чтения (счётчики байт, u64) и
+    флаг «уведомление отправлено»; запись - 4 байта длины и JSON. Позиция записи
+    обновляется после копирования данных, поэтому читатель не видит половину записи
+    """
+    HEADER = 64
+    _POSITIONS = struct.Struct('<QQ')
+
+    def __init__(self, name: str | None = None, size: int = Config.WORKER_RING_BYTES):
+        # Процесс модели запускается через spawn и делит resource_tracker с GUI: сегмент,
+        # зарегистрированный обоими, удаляется один раз - в stop() или при выходе GUI
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=self.HEADER + size)
+        self.name = self.memory.name
+        self.capacity = self.memory.size - self.HEADER
+        self._buffer = self.memory.buf
+
+    def reset(self) -> None:
+        self._buffer[:self.HEADER] = bytes(self.HEADER)
+
+    def _positions(self) -> tuple[int, int]:
+        return self._POSITIONS.unpack_from(self._buffer, 0)
+
+    @property
+    def notified(self) -> bool:
+        return bool(self._buffer[16])
+
+    @notified.setter
+    def notified(self, value: bool) -> None:
+        self._buffer[16] = int(value)
+
+    def write(self, record, timeout: float = 10.0) -> None:
+        payload = json.dumps(record, ensure_ascii=False).encode()
+        data = struct.pack('<I', len(payload)) + payload
+        if len(data) > self.capacity:
+            raise ValueError(f'record of {len(data)} bytes does not fit into ring of {self.capacity}')
+        deadline = time.monotonic() + timeout
+        while True:
+            write, read = self._positions()
+            if self.capacity - (write - read) >= len(data):
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError('ring buffer is full: reader is not draining')
+            time.sleep(0.001)
+        self._copy_in(write % self.capacity, data)
+        struct.pack_into('<Q', self._buffer, 0, write + len(data))
+
+    def read_all(self) -> list:
+        write, read = self._positions()
+        records = []
+        while read < write:
+            length = struct.unpack('<I', self._copy_out(read % self.capacity, 4))[0]
+            records.append(json.loads(self._copy_out((read + 4) % self.capacity, length)))
+            read += 4 + length
+        struct.pack_into('<Q', self._buffer, 8, read)
+        return records
+
+    def _copy_in(self, offset: int, data: bytes) -> None:
+        first = min(len(data), self.capacity - offset)
+        start = self.HEADER + offset
+        self._buffer[start:start + first] = data[:first]
+        self._buffer[self.HEADER:self.HEADER + len(data) - first] = data[first:]
+
+    def _copy_out(self, offset: int, length: int) -> bytes:
+        first = min(length, self.capacity - offset)
+        start = self.HEADER + offset
+        return bytes(self._buffer[start:start + first]) + bytes(self._buffer[self.HEADER:self.HEADER + length - first])
+
+    def close(self, unlink: bool = False) -> None:
+        self._buffer = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def _worker_main(control, notify, ring_name: str, load_kwargs: dict) -> None:
+    """
+    Процесс модели: загрузка, генерация через StreamingThread.run (без цикла событий
+    Qt - сигналы подключены к обычным функциям), диалог и кэши. Команды приходят
+    по control; токены и события идут через SharedRing, о новых записях читателю
+    сообщает байт в notify, только если он уже вычитал предыдущие
+    """
+    from src.chat_session import ChatSession
+    from src.model_loader import load_model
+    from src.prefix_cache import PrefixCache
+    from src.response_cache import model_fingerprint, ResponseCache
+    from src.streaming_thread import StreamingThread
+
+    ring = SharedRing(ring_name)
+    commands = queue.Queue()
+    current = {'id': None, 'thread': None}
+    cancelled = set()  # отменённые до начала генерации
+    lock = threading.Lock()
+
+    def emit(*record) -> None:
+        ring.write(record)
+        if not ring.notified:
+            ring.notified = True
+            notify.send_bytes(b'!')
+
+    def listen() -> None:
+        while True:
+            try:
+                message = control.recv()
+            except (EOFError, OSError):
+                message = ('shutdown',)
+            if message[0] == 'cancel':
+                # Отмена обходит очередь команд: генерация идёт в основном потоке процесса
+                with lock:
+                    if current['id'] == message[1]:
+                        current['thread'].cancel()
+                    else:
+                        cancelled.add(message[1])
+                continue
+            commands.put(message)
+            if message[0] == 'shutdown':
+                return
+
+    threading.Thread(target=listen, name='worker-control', daemon=True).start()
+    model = tokenizer = draft_model = session = None
+    prefix_cache = PrefixCache() if Config.PREFIX_CACHE_ENABLED else None
+    response_cache = ResponseCache() if Config.RESPONSE_CACHE_ENABLED else None
+    while True:
+        message = commands.get()
+        kind = message[0]
+        if kind == 'shutdown':
+            return
+        if kind == 'load':
+            model = tokenizer = draft_model = session = None
+            if prefix_cache is not None:
+                prefix_cache.clear()
+            try:
+                model, tokenizer, draft_model, timings = load_model(
+                    **dict(load_kwargs, model_id=message[1]), on_plan=lambda plan: control.send(('plan', plan)))
+            except Exception as e:
+                control.send(('load_error', str(e)))
+                continue
+            session = ChatSession(tokenizer)
+            if response_cache is not None:
+                response_cache.set_model(model_fingerprint(model))
+            control.send(('loaded', {'model': model.config.name_or_path, 'timings': timings}))
+        elif kind == 'reset':
+            if session is not None:
+                session.reset()
+        elif kind == 'generate':
+            request_id, params = message[1], message[2]
+            if model is None:
+                emit('error', request_id, 'Модель не загружена.')
+                continue
+            errors = []
+            thread = StreamingThread(model, tokenizer, params['user_input'], params['temperature'],
+                                     session=session,
+                                     max_new_tokens=params['max_new_tokens'],
+                                     timeout=params['timeout'],
+                                     stop_strings=params['stop_strings'],
+                                     speculative=params['speculative'],
+                                     draft_model=draft_model,
+                                     prefix_cache=prefix_cache,
+                                     response_cache=response_cache,
+                                     kv_cache=params['kv_cache'])
+            thread.update_response.connect(lambda text: emit('text', request_id, text))
+            thread.prefill_stats.connect(lambda stats: emit('stats', request_id, stats))
+            thread.prefill_progress.connect(lambda done, total: emit('progress', request_id, done, total))
+            thread.error_occurred.connect(errors.append)
+            with lock:
+                if request_id in cancelled:
+                    cancelled.discard(request_id)
+                    emit('done', request_id, {'reason': 'cancelled'})
+                    continue
+                current['id'], current['thread'] = request_id, thread
+            emit('started', request_id)
+            thread.run()
+            with lock:
+                current['id'], current['thread'] = None, None
+            if errors:
+                emit('error', request_id, errors[0])
+                continue
+            streamer = thread.streamer
+            emit('done', request_id, {
+                'reason': thread.stop_reason,
+                'new_tokens': len(streamer.token_ids) if streamer is not None else 0,
+                'decode_steps': len(streamer.token_times) if streamer is not None else 0,
+                'response_cached': thread.cache_hit,
+                'response_cache_hit_rate': response_cache.hit_rate if response_cache is not None else None,
+            })
+
+
+class ProcessInferenceWorker(QObject):
+    """
+    Модель в отдельном процессе: GIL процесса GUI не занят декодированием, а падение
+    (CUDA, нехватка памяти) не закрывает окно - процесс перезапускается и модель
+    загружается заново. Интерфейс запросов тот же, что у InferenceWorker
+    (submit/cancel/stop, сигналы GenerationRequest); запросы выполняются по порядку,
+    без приоритетов и вытеснения
+    """
+    model_loaded = pyqtSignal(object)  # {'model': имя, 'timings': {...}}
+    load_error = pyqtSignal(str)
+    plan_ready = pyqtSignal(object)
+    crashed = pyqtSignal(str)  # процесс упал и перезапускается
+
+    def __init__(self, load_kwargs: dict, max_restarts: int = Config.WORKER_MAX_RESTARTS):
+        super().__init__()
+        self.load_kwargs = load_kwargs
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.response_cache_hit_rate: float | None = None
+        self.ring = SharedRing()
+        self._context = multiprocessing.get_context('spawn')
+        self._requests: dict[int, 'GenerationRequest'] = {}
+        self._ids = itertools.count(1)
+        self._process = None
+        self._notifiers: list[QSocketNotifier] = []
+        self._loaded = False
+        self._model_id = load_kwargs.get('model_id', Config.MODEL_ID)
+        self._stopping = False
+
+    @property
+    def pid(self) -> int | None:
+        return self._process.pid if self._process is not None else None
+
+    def start(self) -> None:
+        self.ring.reset()
+        self._control, child_control = self._context.Pipe()
+        self._notify, child_notify = self._context.Pipe(duplex=False)
+        self._process = self._context.Process(
+            target=_worker_main, args=(child_control, child_notify, self.ring.name, self.load_kwargs),
+            name='gpt-model-worker', daemon=True)
+        self._process.start()
+        child_control.close()
+        child_notify.close()
+        self._notifiers = [
+            self._watch(self._notify.fileno(), self._drain_ring),
+            self._watch(self._control.fileno(), self._drain_control),
+            self._watch(self._process.sentinel, self._on_exit),
+        ]
+
+    def _watch(self, fd: int, slot) -> QSocketNotifier:
+        notifier = QSocketNotifier(fd, QSocketNotifier.Type.Read, self)
+        notifier.activated.connect(slot)
+        return notifier
+
+    def load(self, model_id: str | None = None) -> None:
+        """Загрузить модель (по умолчанию последнюю загружавшуюся) вместо текущей"""
+        if model_id is not None:
+            self._model_id = model_id
+        self._loaded = False
+        self._send(('load', self._model_id))
+
+    def reset_session(self) -> None:
+        self._send(('reset',))
+
+    def queue_depth(self) -> int:
+        return len(self._requests)
+
+    def submit(self, request: 'GenerationRequest') -> 'GenerationRequest':
+        request_id = next(self._ids)
+        request._worker = self
+        request._process_id = request_id
+        request.submitted_at = time.perf_counter()
+        self._requests[request_id] = request
+        self._send(('generate', request_id, {
+            'user_input': request.user_input,
+            'temperature': request.temperature,
+            'max_new_tokens': request.max_new_tokens,
+            'timeout': request.timeout,
+            'stop_strings': list(request.stop_strings),
+            'speculative': request.speculative,
+            'kv_cache': request.kv_cache,
+        }))
+        return request
+
+    def cancel(self, request: 'GenerationRequest') -> None:
+        request_id = getattr(request, '_process_id', None)
+        if request_id in self._requests:
+            self._send(('cancel', request_id))
+
+    def stop(self) -> None:
+        self._stopping = True
+        for notifier in self._notifiers:
+            notifier.setEnabled(False)
+        if self._process is not None:
+            self._send(('shutdown',))
+            self._process.join(Config.WORKER_SHUTDOWN_TIMEOUT)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+        self.ring.close(unlink=True)
+
+    def _send(self, message) -> None:
+        try:
+            self._control.send(message)
+        except (BrokenPipeError, OSError):
+            pass  # процесс упал - перезапуск придёт через _on_exit
+
+    def _drain_ring(self) -> None:
+        try:
+            while self._notify.poll():
+                self._notify.recv_bytes()
+        except (EOFError, OSError):
+            self._notifiers[0].setEnabled(False)
+        # Флаг сбрасывается до чтения: запись после чтения пришлёт новое уведомление
+        self.ring.notified = False
+        for record in self.ring.read_all():
+            self._dispatch(record)
+
+    def _dispatch(self, record: list) -> None:
+        kind, request_id, *values = record
+        request = self._requests.get(request_id)
+        if request is None:
+            return
+        now = time.perf_counter()
+        if kind == 'started':
+            request.started_at = now
+            request.started.emit()
+        elif kind == 'text':
+            if request.first_token_at is None:
+                request.first_token_at = now
+            request.text_parts.append(values[0])
+            request.update_response.emit(values[0])
+        elif kind == 'stats':
+            request.prefill_stats.emit(values[0])
+        elif kind == 'progress':
+            request.prefill_progress.emit(*values)
+        elif kind == 'done':
+            info = values[0]
+            request.decode_steps = info.get('decode_steps', 0)
+            request.response_cached = info.get('response_cached', False)
+            request.generated_ids = [0] * info.get('new_tokens', 0)  # в GUI важно только число токенов
+            self.response_cache_hit_rate = info.get('response_cache_hit_rate')
+            self._finish(request_id, info['reason'])
+        elif kind == 'error':
+            self._fail(request_id, values[0])
+
+    def _drain_control(self) -> None:
+        try:
+            while self._control.poll():
+                kind, *values = self._control.recv()
+                if kind == 'plan':
+                    self.plan_ready.emit(values[0])
+                elif kind == 'loaded':
+                    self._loaded = True
+                    self.model_loaded.emit(values[0])
+                elif kind == 'load_error':
+                    self.load_error.emit(values[0])
+        except (EOFError, OSError):
+            self._notifiers[1].setEnabled(False)
+
+    def _on_exit(self) -> None:
+        for notifier in self._notifiers:
+            notifier.setEnabled(False)
+        if self._stopping:
+            return
+        self._drain_ring()
+        self._process.join(1.0)
+        code = self._process.exitcode
+        message = f'Процесс модели завершился (код {code})'
+        for request_id in list(self._requests):
+            self._fail(request_id, message)
+        self._process = None
+        if self.restarts >= self.max_restarts:
+            self.load_error.emit(f'{message}, перезапусков больше {self.max_restarts} - остановлено')
+            return
+        self.restarts += 1
+        self.crashed.emit(f'{message}, перезапуск {self.restarts}/{self.max_restarts}')
+        was_loaded = self._loaded
+        self.start()
+        if was_loaded:
+            self.load()
+
+    def _finish(self, request_id: int, reason: str) -> None:
+        request = self._requests.pop(request_id)
+        request.finished_at = time.perf_counter()
+        request.generation_finished.emit(reason)
+        request.future.set_result({'text': ''.join(request.text_parts), 'reason': reason,
+                                   'timings': request.timings})
+
+    def _fail(self, request_id: int, message: str) -> None:
+        request = self._requests.pop(request_id)
+        request.finished_at = time.perf_counter()
+        request.error_occurred.emit(message)
+        request.future.set_exception(RuntimeError(message))
@@ -0,0 +1,259 @@
+import functools
+import html
+import json
+import re
+import time
+
+from PyQt6.QtCore import QObject, QTimer, QUrl, pyqtSignal
+
+from src.config import Config
+from src.tracing import span, TRACER
+
+
+PAGE_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+  math[display="block"] { display: block math; margin: 0.5em 0; }
+  .tex { font-family: monospace; color: #555; }
+</style>
+<script type="text/javascript">
+  function scrollToEnd() {
+    window.scrollTo(0, document.body.scrollHeight);
+  }
+  function clearAnswer() {
+    document.getElementById('blocks').innerHTML = '';
+    document.getElementById('tail').innerHTML = '';
+  }
+  function appendAnswer(blocks, tail) {
+    if (blocks) {
+      document.getElementById('blocks').insertAdjacentHTML('beforeend', blocks);
+    }
+    document.getElementById('tail').innerHTML = tail;
+    scrollToEnd();
+  }
+  function setAnswer(html) {
+    document.getElementById('blocks').innerHTML = html;
+    document.getElementById('tail').innerHTML = '';
+    scrollToEnd();
+  }
+  function notifyPaint(id) {
+    // Два кадра: после первого стили и раскладка применены, после второго - отрисованы
+    requestAnimationFrame(() => requestAnimationFrame(() => { document.title = 'painted:' + id; }));
+  }
+</script>
+</head>
+<body>
+<div id="blocks"></div>
+<div id="tail"></div>
+</body>
+</html>
+"""
+
+
+# Блоки кода пропускаются как есть; $...$ не считается формулой, если после
+# открывающего или перед закрывающим знаком пробел или сразу за ним цифра ($5 и $10)
+MATH_PATTERN = re.compile(
+    r'(?P<code>```.*?(?:```|\Z)|~~~.*?(?:~~~|\Z)|`[^`\n]*`)'
+    r'|\$\$(?P<display>.+?)\$\$'
+    r'|\\\[(?P<display_brackets>.+?)\\\]'
+    r'|\\\((?P<inline_parens>.+?)\\\)'
+    r'|(?<![\\$\w])\$(?=\S)(?P<inline>[^$\n]+?)(?<=\S)\$(?!\d)',
+    re.S,
+)
+PLACEHOLDER = '@@math{}@@'
+
+
+@functools.lru_cache(maxsize=Config.MATH_CACHE_SIZE)
+def render_math(tex: str, display: bool) -> str:
+    """
+    LaTeX -> MathML без сети и JavaScript: QtWebEngine отображает MathML сам.
+    Результат кэшируется по исходнику, повторные формулы не конвертируются заново
+    """
+    try:
+        from latex2mathml.converter import convert
+    except ImportError:
+        return f'<span class="tex">{html.escape(tex)}</span>'
+    try:
+        return convert(tex, display='block' if display else 'inline')
+    except Exception:
+        return f'<span class="tex">{html.escape(tex)}</span>'
+
+
+def markdown(text: str) -> str:
+    """markdown с формулами: формулы вырезаются до разбора markdown и вставляются MathML"""
+    # Пакет markdown импортируется при первом ответе, а не при старте окна
+    from markdown import markdown as render
+
+    formulas = []
+
+    def extract(match: re.Match) -> str:
+        if match.group('code') is not None:
+            return match.group('code')
+        display = match.group('display') or match.group('display_brackets')
+        tex = display if display is not None else match.group('inline') or match.group('inline_parens')
+        formulas.append(render_math(tex.strip(), display is not None))
+        return PLACEHOLDER.format(len(formulas) - 1)
+
+    result = render(MATH_PATTERN.sub(extract, text))
+    for i, formula in enumerate(formulas):
+        result = result.replace(PLACEHOLDER.format(i), formula, 1)
+    return result
+
+
+class IncrementalMarkdown:
+    """
+    Инкрементальный рендер markdown: законченные блоки (разделённые пустой строкой
+    вне блока кода) рендерятся один раз, заново парсится только незаконченный хвост.
+    Границы блоков ищутся только в новом тексте: смещение просмотра и состояние
+    (внутри ли блока кода, была ли пустая строка) сохраняются между вызовами
+    """
+
+    def __init__(self):
+        self._parts: list[str] = []
+        self._tail = ''
+        self._scan_pos = 0  # начало первой непросмотренной строки хвоста
+        self._in_fence = False
+        self._blank = False
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._parts)
+
+    def clear(self) -> None:
+        self._parts.clear()
+        self._tail = ''
+        self._scan_pos = 0
+        self._in_fence = False
+        self._blank = False
+
+    def feed(self, text: str) -> tuple[str, str]:
+        """
+        Добавить текст. Возвращает html новых законченных блоков и html хвоста
+        """
+        self._parts.append(text)
+        self._tail += text
+        blocks_html = ''
+        cut = self._find_boundary()
+        if cut:
+            blocks_html = markdown(self._tail[:cut])
+            self._tail = self._tail[cut:]
+            self._scan_pos -= cut
+        return blocks_html, markdown(self._tail)
+
+    def render_all(self) -> str:
+        return markdown(self.text)
+
+    def _find_boundary(self) -> int:
+        # Граница блока - пустая строка, за которой идёт строка без отступа,
+        # при условии, что мы не внутри ``` блока кода
+        boundary = 0
+        pos = self._scan_pos
+        while (end := self._tail.find('\n', pos)) >= 0:
+            line = self._tail[pos:end + 1]
+            stripped = line.strip()
+            if stripped.startswith('```') or stripped.startswith('~~~'):
+                self._in_fence = not self._in_fence
+            elif self._blank and not self._in_fence and stripped and line[0] not in (' ', '\t'):
+                boundary = pos
+            self._blank = not stripped
+            pos = end + 1
+        self._scan_pos = pos
+        # Последняя строка ещё дописывается
+        if self._blank and not self._in_fence and self._tail[pos:pos + 1] not in ('', ' ', '\t'):
+            boundary = pos
+        return boundary
+
+
+class MarkdownView(QObject):
+    """
+    Потоковый вывод ответа в QWebEngineView: страница загружается один раз,
+    обновления объединяются и отправляются в DOM через runJavaScript не чаще RENDER_FPS.
+    Формулы приходят уже в MathML, так что каждый кусок отображается сразу с формулами
+    """
+    painted = pyqtSignal(float)  # секунды от finish() до отрисовки финального ответа
+
+    def __init__(self, view, fps: int = Config.RENDER_FPS):
+        super().__init__(view)
+        self._view = view
+        self._markdown = IncrementalMarkdown()
+        self._pending: list[str] = []
+        self._page_ready = False
+        self._finish_pending = False
+        self._finish_started = 0.0
+        self._paint_id = 0
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, round(1000 / fps)))
+        self._timer.timeout.connect(self._flush)
+        self._view.loadFinished.connect(self._on_load_finished)
+        self._view.titleChanged.connect(self._on_title_changed)
+        self._view.setHtml(PAGE_TEMPLATE, QUrl(''))
+
+    @property
+    def text(self) -> str:
+        return self._markdown.text + ''.join(self._pending)
+
+    def clear(self) -> None:
+        self._timer.stop()
+        self._pending.clear()
+        self._markdown.clear()
+        self._finish_pending = False
+        self._run_js('clearAnswer();')
+
+    def append(self, text: str) -> None:
+        if not text:
+            return
+        self._pending.append(text)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def finish(self) -> None:
+        """Финальный полный рендер ответа в уже открытой странице"""
+        self._finish_started = time.perf_counter()
+        self._timer.stop()
+        if not self._page_ready:
+            self._finish_pending = True
+            return
+        self._finish_pending = False
+        with span('markdown.finish'):
+            if self._pending:
+                self._markdown.feed(''.join(self._pending))
+                self._pending.clear()
+            answer_html = self._markdown.render_all()
+        self._paint_id += 1
+        with span('runJavaScript'):
+            self._run_js(f'setAnswer({json.dumps(answer_html)}); notifyPaint({self._paint_id});')
+
+    def _flush(self) -> None:
+        if not self._page_ready:
+            return
+        self._timer.stop()
+        if not self._pending:
+            return
+        with span('markdown'):
+            blocks_html, tail_html = self._markdown.feed(''.join(self._pending))
+        self._pending.clear()
+        with span('runJavaScript'):
+            self._run_js(f'appendAnswer({json.dumps(blocks_html)}, {json.dumps(tail_html)});')
+
+    def _on_load_finished(self, ok: bool) -> None:
+        self._page_ready = ok
+        if not ok:
+            return
+        if self._markdown.text:
+            self._run_js(f'setAnswer({json.dumps(self._markdown.render_all())});')
+        if self._finish_pending:
+            self.finish()
+        elif self._pending:
+            self._flush()
+
+    def _on_title_changed(self, title: str) -> None:
+        if title == f'painted:{self._paint_id}':
+            TRACER.complete('paint', self._finish_started)
+            self.painted.emit(time.perf_counter() - self._finish_started)
+
+    def _run_js(self, script: str) -> None:
+        if self._page_ready:
+            self._view.page().runJavaScript(script)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import torch
+
+from src.config import Config
+
+
+def model_fingerprint(model) -> str:
+    """
+    Идентичность загруженной модели: id, ревизия весов, квантование, dtype и устройство.
+    id и ревизию записывает get_model_and_tokenizer (utils.py) - config.name_or_path
+    у модели из кэша весов указывает на локальную копию
+    """
+    config = model.config
+    quantization = getattr(config, 'quantization_config', None)
+    if quantization is not None and not isinstance(quantization, dict):
+        quantization = quantization.to_dict()
+    dynamic_int8 = any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in model.modules())
+    payload = json.dumps([
+        getattr(model, 'source_model_id', config.name_or_path),
+        getattr(model, 'source_revision', getattr(config, '_commit_hash', None)),
+        quantization,
+        'int8' if dynamic_int8 else None,
+        str(model.dtype),
+        model.device.type,
+    ], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class ResponseCache:
+    """
+    Кэш ответов жадного декодирования (temperature = 0) на диске: при тех же
+    модели, токенах промпта и параметрах генерации ответ детерминирован.
+    Запись - JSON-файл, время последнего использования - его mtime; старые
+    записи вытесняются по бюджету размера (LRU). Ключ включает отпечаток модели,
+    так что записи нескольких моделей хранятся рядом
+    """
+
+    def __init__(self,
+                 root: str = Config.RESPONSE_CACHE_DIR,
+                 budget_bytes: int = Config.RESPONSE_CACHE_BUDGET_MB * 1024 ** 2,
+                 ):
+        self.root = os.path.expanduser(root)
+        self.budget_bytes = budget_bytes
+        self.fingerprint: str | None = None
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float | None:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else None
+
+    def set_model(self, fingerprint: str | None) -> None:
+        """
+        Запомнить текущую модель. Отпечаток входит в ключ, поэтому записи разных
+        моделей не пересекаются и остаются на диске: при возврате к модели её
+        ответы снова берутся из кэша, а лишнее вытесняется общим LRU по бюджету
+        """
+        with self._lock:
+            self.fingerprint = fingerprint
+
+    def key(self, prompt_ids: list[int], params: dict) -> str:
+        payload = json.dumps([self.fingerprint, prompt_ids, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:40]
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, encoding='utf-8') as file:
+                    entry = json.load(file)
+                os.utime(path)
+            except (OSError, ValueError):
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key: str, token_ids: list[int], text: str, reason: str) -> None:
+        path = self._path(key)
+        entry = {'token_ids': token_ids, 'text': text, 'reason': reason, 'created': time.time()}
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(entry, file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.stats['stores'] += 1
+            self._evict(keep=os.path.basename(path))
+
+    def _evict(self, keep: str) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for name, _, size in entries:
+            if total <= self.budget_bytes:
+                break
+            if name == keep:
+                continue
+            self._remove(name)
+            total -= size
+            self.stats['evictions'] += 1
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        """(имя файла, время последнего использования, размер)"""
+        if not os.path.isdir(self.root):
+            return []
+        result = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                result.append((entry.name, stat.st_mtime, stat.st_size))
+        return result
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.root, name))
+        except OSError:
+            pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f'{key}.json')
@@ -0,0 +1,282 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+from src.config import Config
+from src.tracing import TRACER
+
+if TYPE_CHECKING:
+    from src.chat_session import ChatSession
+    from src.prefix_cache import PrefixCache
+    from src.response_cache import ResponseCache
+    from src.streaming_thread import StreamingThread
+
+
+class Priority:
+    INTERACTIVE = 0
+    NORMAL = 10
+    BACKGROUND = 20
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class GenerationRequest(QObject):
+    """
+    Запрос к InferenceWorker. Сигналы те же, что у StreamingThread; результат
+    также доступен через future: {'text', 'reason', 'timings'}
+    """
+    update_response = pyqtSignal(str)
+    generation_finished = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    prefill_stats = pyqtSignal(object)
+    prefill_progress = pyqtSignal(int, int)
+    started = pyqtSignal()
+
+    def __init__(self,
+                 user_input: str,
+                 temperature: float,
+                 priority: int = Priority.NORMAL,
+                 session: 'ChatSession | None' = None,
+                 max_new_tokens: int = Config.MAX_NEW_TOKENS,
+                 timeout: float | None = Config.GENERATION_TIMEOUT,
+                 stop_strings: list[str] | tuple[str, ...] = Config.STOP_STRINGS,
+                 speculative: str = Config.SPECULATIVE_MODE,
+                 kv_cache: str = Config.KV_CACHE_MODE,
+                 ):
+        super().__init__()
+        self.user_input = user_input
+        self.temperature = temperature
+        self.priority = priority
+        self.session = session
+        self.max_new_tokens = max_new_tokens
+        self.timeout = timeout
+        self.stop_strings = stop_strings
+        self.speculative = speculative
+        self.kv_cache = kv_cache
+        self.future = Future()
+        self.generated_ids: list[int] = []
+        self.text_parts: list[str] = []
+        self.decode_steps = 0  # проходов модели при декодировании, для оценки спекуляции
+        self.preemptions = 0
+        self.response_cached = False
+        self.submitted_at = 0.0
+        self.started_at: float | None = None
+        self.first_token_at: float | None = None
+        self.finished_at: float | None = None
+        self._worker: 'InferenceWorker | None' = None
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+        if self._worker is not None:
+            self._worker.cancel(self)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def timings(self) -> dict:
+        def since_submit(moment):
+            return None if moment is None else moment - self.submitted_at
+        return {
+            'queue_wait': since_submit(self.started_at),
+            'ttft': since_submit(self.first_token_at),
+            'total': since_submit(self.finished_at),
+            'preemptions': self.preemptions,
+            'new_tokens': len(self.generated_ids),
+            'decode_steps': self.decode_steps,
+            'response_cached': self.response_cached,
+            'decode_time': (None if self.first_token_at is None or self.finished_at is None
+                            else self.finished_at - self.first_token_at),
+        }
+
+
+class InferenceWorker(QThread):
+    """
+    Долгоживущий поток - единственный владелец модели. Запросы выполняются по
+    очереди в порядке приоритета (меньше - важнее). Если приходит запрос важнее
+    выполняемого, текущий прерывается после шага декодирования и возвращается
+    в очередь, а потом продолжается с уже сгенерированных токенов
+    """
+
+    def __init__(self,
+                 max_queue: int = Config.SCHEDULER_MAX_QUEUE,
+                 preemption: bool = Config.SCHEDULER_PREEMPTION,
+                 prefix_cache: bool = Config.PREFIX_CACHE_ENABLED,
+                 response_cache: bool = Config.RESPONSE_CACHE_ENABLED,
+                 ):
+        super().__init__()
+        self.max_queue = max_queue
+        self.preemption = preemption
+        self.model = None
+        self.tokenizer = None
+        self.draft_model = None
+        # Кэши создаются с первой моделью (им нужен torch) и сбрасываются при её смене
+        self.use_prefix_cache = prefix_cache
+        self.use_response_cache = response_cache
+        self.prefix_cache: 'PrefixCache | None' = None
+        self.response_cache: 'ResponseCache | None' = None
+        self._queue: list[tuple[int, int, GenerationRequest]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._current: GenerationRequest | None = None
+        self._current_thread: 'StreamingThread | None' = None
+        self._stopping = False
+
+    def set_model(self, model, tokenizer, draft_model=None) -> None:
+        with self._condition:
+            self.model = model
+            self.tokenizer = tokenizer
+            self.draft_model = draft_model
+            if self.prefix_cache is not None:
+                self.prefix_cache.clear()
+            if model is None:
+                return
+            if self.use_prefix_cache and self.prefix_cache is None:
+                from src.prefix_cache import PrefixCache
+                self.prefix_cache = PrefixCache()
+            if self.use_response_cache:
+                from src.response_cache import model_fingerprint, ResponseCache
+                if self.response_cache is None:
+                    self.response_cache = ResponseCache()
+                self.response_cache.set_model(model_fingerprint(model))
+
+    @property
+    def response_cache_hit_rate(self) -> float | None:
+        return self.response_cache.hit_rate if self.response_cache is not None else None
+
+    def queue_depth(self) -> int:
+        with self._condition:
+            return len(self._queue)
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(f'Очередь заполнена ({self.max_queue} запросов)')
+            request._worker = self
+            request.submitted_at = time.perf_counter()
+            heapq.heappush(self._queue, (request.priority, next(self._counter), request))
+            current = self._current
+            if (self.preemption and current is not None and self._current_thread is not None
+                    and request.priority < current.priority):
+                self._current_thread.cancel('preempted')
+            self._condition.notify()
+        return request
+
+    def cancel(self, request: GenerationRequest) -> None:
+        with self._condition:
+            for i, (_, _, queued) in enumerate(self._queue):
+                if queued is request:
+                    self._queue.pop(i)
+                    heapq.heapify(self._queue)
+                    self._finish(request, 'cancelled')
+                    return
+            if request is self._current and self._current_thread is not None:
+                self._current_thread.cancel()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            if self._current_thread is not None:
+                self._current_thread.cancel()
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    for _, _, request in self._queue:
+                        self._finish(request, 'cancelled')
+                    self._queue.clear()
+                    return
+                _, _, request = heapq.heappop(self._queue)
+                self._current = request
+                model, tokenizer, draft_model = self.model, self.tokenizer, self.draft_model
+            try:
+                self._execute(request, model, tokenizer, draft_model)
+            finally:
+                with self._condition:
+                    self._current = None
+                    self._current_thread = None
+
+    def _execute(self, request: GenerationRequest, model, tokenizer, draft_model=None) -> None:
+        if request._cancelled:
+            self._finish(request, 'cancelled')
+            return
+        if model is None or tokenizer is None:
+            self._fail(request, 'Модель не загружена.')
+            return
+        if request.started_at is None:
+            request.started_at = time.perf_counter()
+            TRACER.complete('queue_wait', request.submitted_at, request.started_at)
+            request.started.emit()
+
+        from src.streaming_thread import StreamingThread
+        errors = []
+        thread = StreamingThread(
+            model, tokenizer, request.user_input, request.temperature,
+            session=request.session,
+            max_new_tokens=request.max_new_tokens - len(request.generated_ids),
+            timeout=request.timeout,
+            stop_strings=request.stop_strings,
+            continuation_ids=request.generated_ids,
+            speculative=request.speculative,
+            draft_model=draft_model,
+            prefix_cache=self.prefix_cache,
+            response_cache=self.response_cache,
+            kv_cache=request.kv_cache,
+        )
+        # Сигналы запроса испускаются из этого потока и доходят до GUI через очередь событий
+        thread.update_response.connect(lambda text: self._on_text(request, text))
+        thread.prefill_stats.connect(request.prefill_stats.emit)
+        thread.prefill_progress.connect(request.prefill_progress.emit)
+        thread.error_occurred.connect(errors.append)
+        with self._condition:
+            self._current_thread = thread
+            if request._cancelled:
+                thread.cancel()
+        thread.run()
+
+        if thread.streamer is not None:
+            if thread.streamer.token_times and request.first_token_at is None:
+                request.first_token_at = thread.streamer.token_times[0]
+            request.generated_ids = request.generated_ids + thread.streamer.token_ids
+            request.decode_steps += len(thread.streamer.token_times)
+            request.response_cached = thread.cache_hit
+        if errors:
+            self._fail(request, errors[0])
+        elif thread.stop_reason == 'preempted' and not request._cancelled:
+            with self._condition:
+                request.preemptions += 1
+                heapq.heappush(self._queue, (request.priority, next(self._counter), request))
+        else:
+            self._finish(request, thread.stop_reason)
+
+    @staticmethod
+    def _on_text(request: GenerationRequest, text: str) -> None:
+        request.text_parts.append(text)
+        request.update_response.emit(text)
+
+    def _finish(self, request: GenerationRequest, reason: str) -> None:
+        request.finished_at = time.perf_counter()
+        request.generation_finished.emit(reason)
+        request.future.set_result({
+            'text': ''.join(request.text_parts),
+            'reason': reason,
+            'timings': request.timings,
+        })
+
+    def _fail(self, request: GenerationRequest, message: str) -> None:
+        request.finished_at = time.perf_counter()
+        request.error_occurred.emit(message)
+        request.future.set_exception(RuntimeError(message))
@@ -0,0 +1,42 @@
+from src.config import Config
+
+
+SPECULATIVE_MODES = ('none', 'draft', 'prompt_lookup')
+
+
+def generation_kwargs(mode: str,
+                      draft_model=None,
+                      num_tokens: int = Config.SPECULATIVE_NUM_TOKENS,
+                      ) -> dict:
+    """
+    Аргументы generate для спекулятивного декодирования: кандидаты предлагает
+    черновая модель (draft) или поиск n-грамм в уже имеющемся тексте (prompt_lookup),
+    основная модель проверяет их все за один проход
+    """
+    if mode == 'draft':
+        if draft_model is None:
+            raise ValueError('Для режима draft нужна черновая модель (Config.DRAFT_MODEL_ID)')
+        draft_model.generation_config.num_assistant_tokens = num_tokens
+        draft_model.generation_config.num_assistant_tokens_schedule = 'constant'
+        return {'assistant_model': draft_model}
+    if mode == 'prompt_lookup':
+        return {'prompt_lookup_num_tokens': num_tokens}
+    if mode not in (None, 'none'):
+        raise ValueError(f'Неизвестный режим спекулятивного декодирования: {mode}')
+    return {}
+
+
+def speculative_stats(new_tokens: int, steps: int, num_tokens: int = Config.SPECULATIVE_NUM_TOKENS) -> dict:
+    """
+    steps - число проходов основной модели (порций токенов в стримере). Каждый шаг
+    даёт один собственный токен модели, остальные - принятые кандидаты. Черновик
+    может предложить меньше num_tokens, поэтому acceptance - оценка снизу
+    """
+    if not steps:
+        return {'tokens_per_step': None, 'accepted_tokens': 0, 'acceptance': None}
+    accepted = max(0, new_tokens - steps)
+    return {
+        'tokens_per_step': new_tokens / steps,
+        'accepted_tokens': accepted,
+        'acceptance': accepted / (steps * num_tokens) if num_tokens else None,
+    }
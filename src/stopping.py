@@ -0,0 +1,97 @@
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+
+from src.config import Config
+
+
+class GenerationStopper(StoppingCriteria):
+    """
+    Критерий остановки generate, проверяется после каждого шага декодирования:
+    отмена через cancel(), бюджет токенов, дедлайн по времени, стоп-строки
+    и зацикливание (один и тот же фрагмент повторяется подряд).
+    Причина остановки сохраняется в reason. При спекулятивном декодировании generate
+    вызывает критерий и для непроверенных кандидатов, поэтому reason отражает
+    последний вызов, а за шаг проверяются все step_tokens новых позиций
+    """
+
+    def __init__(self,
+                 tokenizer,
+                 prompt_length: int,
+                 max_new_tokens: int | None = Config.MAX_NEW_TOKENS,
+                 timeout: float | None = Config.GENERATION_TIMEOUT,
+                 stop_strings: list[str] | tuple[str, ...] = Config.STOP_STRINGS,
+                 repetition_max_period: int = Config.REPETITION_MAX_PERIOD,
+                 repetition_min_span: int = Config.REPETITION_MIN_SPAN,
+                 repetition_min_repeats: int = Config.REPETITION_MIN_REPEATS,
+                 step_tokens: int = 1,
+                 ):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.stop_strings = [stop for stop in stop_strings if stop]
+        self.repetition_max_period = repetition_max_period
+        self.repetition_min_span = repetition_min_span
+        self.repetition_min_repeats = repetition_min_repeats
+        self.step_tokens = step_tokens  # сколько токенов может добавиться за один шаг
+        self.reason: str | None = None
+        self._cancelled = threading.Event()
+        self._cancel_reason = 'cancelled'
+        # Сколько последних токенов декодировать для поиска стоп-строк
+        self._stop_window = max((len(stop) for stop in self.stop_strings), default=0) + 8
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        if not self._cancelled.is_set():
+            self._cancel_reason = reason
+        self._cancelled.set()
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        stop = self._check(input_ids)
+        if not stop:
+            self.reason = None
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+    def _check(self, input_ids: torch.LongTensor) -> bool:
+        if self._cancelled.is_set():
+            return self._stop(self._cancel_reason)
+        new_tokens = input_ids.shape[1] - self.prompt_length
+        step_tokens = min(self.step_tokens, new_tokens)
+        if self.stop_strings and new_tokens:
+            tail = self.tokenizer.decode(input_ids[0, -min(new_tokens, self._stop_window + step_tokens - 1):],
+                                         skip_special_tokens=True)
+            if any(stop in tail for stop in self.stop_strings):
+                return self._stop('stop_string')
+        if self.repetition_max_period and any(
+                self._is_looping(input_ids[:, :input_ids.shape[1] - back], new_tokens - back)
+                for back in range(step_tokens)):
+            return self._stop('repetition')
+        # Бюджет проверяется последним: шаг мог перешагнуть его уже после стоп-строки или цикла
+        if self.max_new_tokens is not None and new_tokens >= self.max_new_tokens:
+            return self._stop('max_tokens')
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return self._stop('deadline')
+        return False
+
+    def _is_looping(self, input_ids: torch.LongTensor, new_tokens: int) -> bool:
+        """Последние токены - это период длиной p, повторённый подряд достаточно раз"""
+        window = min(new_tokens, max(self.repetition_max_period * self.repetition_min_repeats,
+                                     self.repetition_min_span + self.repetition_max_period))
+        if window < self.repetition_min_span:
+            return False
+        tail = input_ids[0, -window:].tolist()
+        for period in range(1, self.repetition_max_period + 1):
+            repeats = max(self.repetition_min_repeats, -(-self.repetition_min_span // period))
+            span = period * repeats
+            if span > len(tail):
+                continue
+            pattern = tail[-period:]
+            if tail[-span:] == pattern * repeats:
+                return True
+        return False
+
+    def _stop(self, reason: str) -> bool:
+        self.reason = reason
+        return True
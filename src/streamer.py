@@ -1,13 +1,97 @@
-import torch
-from transformers import TextStreamer
+import time
 
+from transformers.generation.streamers import BaseStreamer
 
-class PyQtStreamer(TextStreamer):
-    def __init__(self, tokenizer, update_signal, skip_special_tokens=True):
-        super().__init__(tokenizer, skip_special_tokens)
+from src.config import Config
+from src.tracing import span, TRACER
+
+
+class PyQtStreamer(BaseStreamer):
+    """
+    Стример для generate: инкрементально детокенизирует новые токены по смещениям
+    (повторно декодируется только короткое окно последних токенов) и отправляет
+    текст в сигнал пачками - по числу токенов или по времени.
+    Один экземпляр на одну генерацию: token_ids и token_times остаются доступны после end()
+    """
+
+    def __init__(self,
+                 tokenizer,
+                 update_signal,
+                 skip_prompt: bool = True,
+                 skip_special_tokens: bool = True,
+                 batch_tokens: int = Config.STREAMER_BATCH_TOKENS,
+                 batch_interval: float = Config.STREAMER_BATCH_INTERVAL,
+                 max_tokens: int | None = None,
+                 ):
+        self.tokenizer = tokenizer
         self.update_signal = update_signal
+        self.skip_prompt = skip_prompt
+        self.skip_special_tokens = skip_special_tokens
+        self.batch_tokens = batch_tokens
+        self.batch_interval = batch_interval  # секунды
+        self.max_tokens = max_tokens  # лишние токены (спекулятивный шаг может перешагнуть бюджет) отбрасываются
+        self.token_ids: list[int] = []
+        self.token_times: list[float] = []  # время получения каждой порции токенов
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._pending: list[str] = []
+        self._pending_tokens = 0
+        self._last_emit = 0.0
+        self._next_tokens_are_prompt = True
 
     def put(self, value):
-        text = self.tokenizer.decode(value[0], skip_special_tokens=True)
-        self.update_signal.emit(text)  # Передача текста через сигнал
-        super().put(value)
+        if value.dim() > 1:
+            if value.shape[0] > 1:
+                raise ValueError("PyQtStreamer only supports batch size 1")
+            value = value[0]
+        if self.skip_prompt and self._next_tokens_are_prompt:
+            self._next_tokens_are_prompt = False
+            return
+        if self.max_tokens is not None:
+            value = value[:max(0, self.max_tokens - len(self.token_ids))]
+            if not value.numel():
+                return
+        now = time.perf_counter()
+        self.token_times.append(now)
+        self.token_ids.extend(value.tolist())
+        self._pending_tokens += value.numel()
+        with span('detokenize'):
+            text = self._decode_new()
+        if text:
+            self._pending.append(text)
+        if self._pending and (self._pending_tokens >= self.batch_tokens
+                              or now - self._last_emit >= self.batch_interval):
+            self._emit(now)
+
+    def end(self):
+        # Выдаём остаток, даже если он заканчивается неполным символом
+        text = self._decode(self._prefix_offset, len(self.token_ids))
+        prefix_text = self._decode(self._prefix_offset, self._read_offset)
+        if len(text) > len(prefix_text):
+            self._pending.append(text[len(prefix_text):])
+        if self._pending:
+            self._emit(time.perf_counter())
+        self._prefix_offset = self._read_offset = len(self.token_ids)
+
+    def _decode(self, start: int, stop: int) -> str:
+        if start >= stop:
+            return ''
+        return self.tokenizer.decode(self.token_ids[start:stop], skip_special_tokens=self.skip_special_tokens)
+
+    def _decode_new(self) -> str:
+        # Окно [prefix_offset, read_offset) даёт контекст для корректных пробелов и
+        # склеенных токенов; текст, оканчивающийся на U+FFFD - неполный многобайтный символ
+        prefix_text = self._decode(self._prefix_offset, self._read_offset)
+        new_text = self._decode(self._prefix_offset, len(self.token_ids))
+        if len(new_text) > len(prefix_text) and not new_text.endswith('�'):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(self.token_ids)
+            return new_text[len(prefix_text):]
+        return ''
+
+    def _emit(self, now: float) -> None:
+        TRACER.mark('update_response')  # доставку в поток GUI замеряет получатель
+        self.update_signal.emit(''.join(self._pending))
+        self._pending.clear()
+        self._pending_tokens = 0
+        self._last_emit = now
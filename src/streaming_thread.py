@@ -1,42 +1,267 @@
+import inspect
+import time
+
 import torch
 from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtCore import QThread
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteriaList
 
+from src.chat_session import ChatSession
+from src.config import Config
+from src.kv_cache import convert_cache, resolve_kv_cache_mode
+from src.prefix_cache import PrefixCache
+from src.response_cache import ResponseCache
+from src.speculative import generation_kwargs
+from src.stopping import GenerationStopper
 from src.streamer import PyQtStreamer
+from src.tracing import span, trace_forward
 
 
 class StreamingThread(QThread):
     update_response = pyqtSignal(str)  # Сигнал для передачи обновлений текста
-    generation_finished = pyqtSignal()  # Сигнал для завершения генерации
+    generation_finished = pyqtSignal(str)  # Сигнал завершения генерации с причиной остановки
     error_occurred = pyqtSignal(str)  # Сигнал для передачи ошибок
+    prefill_stats = pyqtSignal(object)  # Статистика переиспользования KV-кэша диалога
+    prefill_progress = pyqtSignal(int, int)  # Обработано токенов промпта, всего
 
     def __init__(self,
                  model: AutoModelForCausalLM,
                  tokenizer: AutoTokenizer,
                  user_input: str,
                  temperature: float,
+                 session: ChatSession | None = None,
+                 max_new_tokens: int = Config.MAX_NEW_TOKENS,
+                 timeout: float | None = Config.GENERATION_TIMEOUT,
+                 stop_strings: list[str] | tuple[str, ...] = Config.STOP_STRINGS,
+                 continuation_ids: list[int] | None = None,
+                 speculative: str = Config.SPECULATIVE_MODE,
+                 draft_model: AutoModelForCausalLM | None = None,
+                 prefix_cache: PrefixCache | None = None,
+                 prefill_chunk_tokens: int | None = Config.PREFILL_CHUNK_TOKENS,
+                 response_cache: ResponseCache | None = None,
+                 kv_cache: str = Config.KV_CACHE_MODE,
                  ):
         super().__init__()
         self.model = model
         self.tokenizer = tokenizer
         self.user_input = user_input
         self.temperature = temperature
+        self.session = session
+        self.max_new_tokens = max_new_tokens
+        self.timeout = timeout
+        self.stop_strings = stop_strings
+        self.continuation_ids = continuation_ids or []  # уже сгенерированная часть ответа
+        self.speculative = speculative
+        self.draft_model = draft_model
+        self.prefix_cache = prefix_cache
+        self.prefill_chunk_tokens = prefill_chunk_tokens
+        self.response_cache = response_cache
+        self.kv_cache = kv_cache
+        self.kv_cache_mode: str | None = None  # режим KV-кэша, выбранный для запроса (auto разрешается в run)
+        self.cache_hit = False
+        self.streamer: PyQtStreamer | None = None
+        self.stopper: GenerationStopper | None = None
+        self.stop_reason: str | None = None
+        self.started_at = 0.0
+        self._cancel_reason: str | None = None
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        """Остановить генерацию; срабатывает после текущего шага декодирования"""
+        self._cancel_reason = reason
+        if self.stopper is not None:
+            self.stopper.cancel(reason)
 
     def run(self):
+        self.started_at = time.perf_counter()
         try:
-            model_input = self.tokenizer(self.user_input, return_tensors="pt").to("cuda")
-            streamer = PyQtStreamer(self.tokenizer, self.update_response)
-            with torch.no_grad():
-                self.model.generate(
+            device = self.model.device
+            if self.session is None:
+                with span('tokenize'):
+                    model_input = self.tokenizer(self.user_input, return_tensors="pt")
+                with span('to_device'):
+                    model_input = model_input.to(device)
+                if self.prefix_cache is not None:
+                    cache, _ = self.prefix_cache.lookup(model_input['input_ids'][0].tolist())
+                    model_input['past_key_values'] = cache if cache is not None else DynamicCache()
+            else:
+                with span('tokenize'):
+                    input_ids, cache = self.session.prepare(self.user_input, self.prefix_cache)
+                self.prefill_stats.emit(self.session.last_stats)
+                with span('to_device'):
+                    model_input = {
+                        'input_ids': input_ids.to(device),
+                        'attention_mask': torch.ones_like(input_ids).to(device),
+                        'past_key_values': cache,
+                    }
+            answer_start = model_input['input_ids'].shape[1]
+            if self.continuation_ids:
+                continuation = torch.tensor([self.continuation_ids], device=device)
+                model_input['input_ids'] = torch.cat([model_input['input_ids'], continuation], dim=1)
+                model_input['attention_mask'] = torch.ones_like(model_input['input_ids'])
+            prompt_length = model_input['input_ids'].shape[1]
+            max_length = getattr(self.model.config, 'max_position_embeddings', None)
+            if max_length is not None and prompt_length >= max_length:
+                raise ValueError(f'Запрос слишком длинный: {prompt_length} токенов, '
+                                 f'модель поддерживает не больше {max_length - 1}')
+            self.streamer = PyQtStreamer(self.tokenizer, self.update_response, max_tokens=self.max_new_tokens)
+            self.stopper = GenerationStopper(
+                self.tokenizer,
+                prompt_length,
+                max_new_tokens=self.max_new_tokens,
+                timeout=self.timeout,
+                stop_strings=self.stop_strings,
+                step_tokens=1 if self.speculative == 'none' else Config.SPECULATIVE_NUM_TOKENS + 1,
+            )
+            if self._cancel_reason is not None:
+                self.stopper.cancel(self._cancel_reason)
+            # Режим KV-кэша выбирается до ключа кэша ответов: int8/int4 могут изменить ответ.
+            # Для auto ответ оценивается резервом диалога, а не пределом max_new_tokens
+            self.kv_cache_mode = resolve_kv_cache_mode(
+                self.kv_cache, self.model, prompt_length + min(self.max_new_tokens, Config.CHAT_RESERVE_TOKENS))
+            decoder = getattr(self.model, 'compiled_decoder', None)
+            if not (decoder is not None and self.speculative == 'none' and self.kv_cache_mode == 'full'
+                    and decoder.fits(prompt_length + self.max_new_tokens)):
+                decoder = None
+            cache_key = self._response_cache_key(model_input['input_ids'], compiled=decoder is not None)
+            if cache_key is not None:
+                entry = self.response_cache.get(cache_key)
+                if entry is not None:
+                    with span('replay'):
+                        self._replay(entry, model_input['input_ids'], answer_start)
+                    return
+            self._prepare_kv_cache(model_input)
+            if not self._prefill(model_input, prompt_length):
+                self.stop_reason = self._cancel_reason
+                self.generation_finished.emit(self.stop_reason)
+                return
+            # Режим compiled (src/compiled_decode.py): generate идёт по статическому кэшу,
+            # кэш диалога остаётся динамическим и обновляется после генерации
+            dynamic_cache = model_input.get('past_key_values')
+            if decoder is not None:
+                model_input['past_key_values'] = decoder.load(dynamic_cache)
+            with torch.no_grad(), span('generate'), trace_forward(self.model):
+                output = self.model.generate(
                     **model_input,
-                    max_new_tokens=128*1024,
+                    max_new_tokens=self.max_new_tokens,
                     do_sample=bool(self.temperature),
                     temperature=self.temperature,
                     pad_token_id=self.tokenizer.eos_token_id,
                     eos_token_id=self.tokenizer.eos_token_id,
-                    streamer=streamer,
+                    streamer=self.streamer,
+                    stopping_criteria=StoppingCriteriaList([self.stopper]),
+                    **generation_kwargs(self.speculative, self.draft_model),
                 )
-            self.generation_finished.emit()  # Сигнал завершения генерации
+            if decoder is not None and dynamic_cache is not None:
+                model_input['past_key_values'] = decoder.store(dynamic_cache, output.shape[1] - 1)
+            output = output[:, :prompt_length + self.max_new_tokens]
+            if self.prefix_cache is not None:
+                self.prefix_cache.insert(output[0, :answer_start].tolist(), model_input['past_key_values'])
+            self.stop_reason = self.stopper.reason or self._finish_reason(output[0], prompt_length)
+            if cache_key is not None and self.stop_reason in ('eos', 'max_tokens', 'stop_string', 'repetition'):
+                token_ids = self.streamer.token_ids
+                self.response_cache.put(cache_key, token_ids,
+                                        self.tokenizer.decode(token_ids, skip_special_tokens=True), self.stop_reason)
+            if self.session is not None and self.stop_reason == 'preempted':
+                # Вытесненный запрос запустят заново с тем же ходом: в историю он ещё не попадает
+                self.session.suspend(output[0])
+            elif self.session is not None:
+                answer = self.tokenizer.decode(output[0][answer_start:], skip_special_tokens=True)
+                self.session.commit(output[0], answer)
+            self.generation_finished.emit(self.stop_reason)  # Сигнал завершения генерации
         except Exception as e:
             self.error_occurred.emit(str(e))
+
+    def _response_cache_key(self, input_ids: torch.Tensor, compiled: bool = False) -> str | None:
+        """
+        Ключ кэша ответов; None, если ответ не детерминирован или это продолжение.
+        В ключе настройки, которые меняют логиты и могут перевернуть жадный выбор
+        токена: режим KV-кэша, compiled, спекулятивное декодирование, префилл кусками.
+        Сколько токенов промпта взято из кэша диалога или префиксов, в ключ не входит:
+        это зависит от истории, а не от запроса, - после ответа из кэша у диалога нет
+        KV-кэша, и следующий ход с таким ключом никогда бы не совпал с прошлым прогоном
+        """
+        if self.response_cache is None or self.temperature or self.continuation_ids:
+            return None
+        draft = self.draft_model if self.speculative == 'draft' else None
+        return self.response_cache.key(input_ids[0].tolist(), {
+            'max_new_tokens': self.max_new_tokens,
+            'stop_strings': list(self.stop_strings),
+            'eos_token_id': self.tokenizer.eos_token_id,
+            'repetition': [Config.REPETITION_MAX_PERIOD, Config.REPETITION_MIN_SPAN, Config.REPETITION_MIN_REPEATS],
+            'kv_cache': self.kv_cache_mode,
+            'compiled': compiled,
+            'speculative': self.speculative,
+            'draft_model': getattr(draft, 'source_model_id', draft.config.name_or_path) if draft is not None else None,
+            'prefill_chunk_tokens': self.prefill_chunk_tokens,
+        })
+
+    def _replay(self, entry: dict, input_ids: torch.Tensor, answer_start: int) -> None:
+        """Выдать сохранённый ответ через тот же стример, что и генерация"""
+        self.cache_hit = True
+        rate = Config.RESPONSE_CACHE_REPLAY_TOKENS_PER_SECOND
+        self.streamer.put(input_ids.cpu())
+        self.stop_reason = entry['reason']
+        for token in entry['token_ids']:
+            if self._cancel_reason is not None:
+                self.stop_reason = self._cancel_reason
+                break
+            self.streamer.put(torch.tensor([token]))
+            if rate:
+                time.sleep(1 / rate)
+        self.streamer.end()
+        if self.session is not None:
+            answer_ids = self.streamer.token_ids
+            sequence = torch.cat([input_ids[0].cpu(), torch.tensor(answer_ids, dtype=input_ids.dtype)])
+            if self.stop_reason == 'preempted':
+                self.session.suspend(sequence)
+            else:
+                self.session.commit(sequence, self.tokenizer.decode(sequence[answer_start:], skip_special_tokens=True))
+        self.generation_finished.emit(self.stop_reason)
+
+    def _prepare_kv_cache(self, model_input: dict) -> None:
+        """Кэш диалога и найденный префикс переводятся в выбранный режим хранения KV-кэша (src/kv_cache.py)"""
+        cache = model_input.get('past_key_values')
+        if cache is None and self.kv_cache_mode == 'full':
+            return  # generate сам создаст DynamicCache
+        cache = model_input['past_key_values'] = convert_cache(cache, self.kv_cache_mode)
+        if self.session is not None:
+            self.session.cache = cache
+
+    def _prefill(self, model_input: dict, prompt_length: int) -> bool:
+        """
+        Префилл длинного промпта кусками по prefill_chunk_tokens в KV-кэш: пик памяти
+        активаций ограничен размером куска, а не длиной промпта. Последний токен
+        остаётся для generate. Возвращает False, если генерацию отменили
+        """
+        cache = model_input.get('past_key_values')
+        start = cache.get_seq_length() if cache is not None else 0
+        total = prompt_length - 1
+        if not self.prefill_chunk_tokens or total - start <= self.prefill_chunk_tokens:
+            return True
+        if cache is None:
+            cache = model_input['past_key_values'] = DynamicCache()
+        # Логиты промпта не нужны - считаем только для последней позиции куска
+        logits_kwargs = (
+            {'num_logits_to_keep': 1}
+            if 'num_logits_to_keep' in inspect.signature(self.model.forward).parameters else {}
+        )
+        input_ids = model_input['input_ids']
+        self.prefill_progress.emit(start, total)
+        with torch.no_grad():
+            for begin in range(start, total, self.prefill_chunk_tokens):
+                if self._cancel_reason is not None:
+                    return False
+                end = min(begin + self.prefill_chunk_tokens, total)
+                with span('prefill_chunk', tokens=end - begin):
+                    self.model(input_ids=input_ids[:, begin:end], past_key_values=cache, use_cache=True,
+                               **logits_kwargs)
+                if self.session is not None:
+                    # Уже посчитанная часть пригодится, если запрос вытеснят и запустят заново
+                    self.session.cached_ids = input_ids[0, :end].tolist()
+                self.prefill_progress.emit(end, total)
+        return True
+
+    def _finish_reason(self, sequence: torch.Tensor, prompt_length: int) -> str:
+        if len(sequence) > prompt_length and sequence[-1].item() == self.tokenizer.eos_token_id:
+            return 'eos'
+        return 'max_tokens'
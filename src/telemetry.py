@@ -0,0 +1,296 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+from PyQt6.QtCore import QAbstractEventDispatcher, QObject, QThread, QTimer, pyqtSignal
+
+from src.config import Config
+
+
+class Probe:
+    """
+    Источник метрик для TelemetrySampler. interval - минимальный период опроса
+    (для дорогих проб); между опросами сэмплер использует последние значения
+    """
+    name = 'probe'
+    interval = 0.0
+
+    def sample(self) -> dict[str, float]:
+        raise NotImplementedError
+
+
+class SystemMemoryProbe(Probe):
+    name = 'ram'
+
+    def sample(self) -> dict[str, float]:
+        memory_info = psutil.virtual_memory()
+        return {
+            'ram_total': memory_info.total,
+            'ram_used': memory_info.total - memory_info.available,
+        }
+
+
+class CpuProbe(Probe):
+    name = 'cpu'
+
+    def __init__(self):
+        psutil.cpu_percent(None)  # первый вызов всегда возвращает 0
+
+    def sample(self) -> dict[str, float]:
+        return {'cpu_percent': psutil.cpu_percent(None)}
+
+
+class ProcessProbe(Probe):
+    name = 'process'
+
+    def __init__(self):
+        self._process = psutil.Process()
+
+    def sample(self) -> dict[str, float]:
+        return {
+            'process_rss': self._process.memory_info().rss,
+            'process_cpu_percent': self._process.cpu_percent(None),
+        }
+
+
+class TorchAllocatorProbe(Probe):
+    name = 'torch'
+
+    def sample(self) -> dict[str, float]:
+        import torch
+        if not torch.cuda.is_available():
+            return {}
+        return {
+            'torch_allocated': torch.cuda.memory_allocated(),
+            'torch_reserved': torch.cuda.memory_reserved(),
+            'torch_max_allocated': torch.cuda.max_memory_allocated(),
+        }
+
+
+class GpuProbe(Probe):
+    """
+    Память и температура GPU через NVML (nvidia-ml-py), если он установлен,
+    иначе через GPUtil, который на каждый опрос запускает nvidia-smi
+    """
+    name = 'gpu'
+    interval = Config.TELEMETRY_GPU_INTERVAL
+
+    def __init__(self, index: int = 0):
+        self.index = index
+        self._handle = None
+        try:
+            import pynvml
+            pynvml.nvmlInit()
+            self._nvml = pynvml
+            self._handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+        except Exception:
+            self._nvml = None
+
+    def sample(self) -> dict[str, float]:
+        if self._handle is not None:
+            memory = self._nvml.nvmlDeviceGetMemoryInfo(self._handle)
+            temperature = self._nvml.nvmlDeviceGetTemperature(self._handle, self._nvml.NVML_TEMPERATURE_GPU)
+            return {'gpu_total': memory.total, 'gpu_used': memory.used, 'gpu_temperature': temperature}
+        import GPUtil
+        gpus = GPUtil.getGPUs()
+        if len(gpus) <= self.index:
+            return {}
+        gpu = gpus[self.index]
+        return {
+            'gpu_total': round(gpu.memoryTotal * 1024 * 1024),
+            'gpu_used': round(gpu.memoryUsed * 1024 * 1024),
+            'gpu_temperature': gpu.temperature,
+        }
+
+
+def default_probes(device: str) -> list[Probe]:
+    probes = [SystemMemoryProbe(), CpuProbe(), ProcessProbe()]
+    if device == 'cuda':
+        probes += [TorchAllocatorProbe(), GpuProbe()]
+    return probes
+
+
+class RingBuffer:
+    """Потокобезопасный буфер фиксированного размера"""
+
+    def __init__(self, size: int):
+        self._items = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def append(self, item) -> None:
+        with self._lock:
+            self._items.append(item)
+
+    def latest(self):
+        with self._lock:
+            return self._items[-1] if self._items else None
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return list(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class TelemetrySampler(QThread):
+    """
+    Фоновый опрос проб. Сэмплы складываются в RingBuffer, о каждом новом сообщает
+    сигнал sampled - GUI обновляется по нему, а не по своему таймеру.
+    Пока генерация активна, опрос идёт с коротким интервалом; в простое интервал
+    растёт, если значения почти не меняются. set_background_interval задаёт нижнюю
+    границу интервала, пока окно свёрнуто или не в фокусе
+    """
+    sampled = pyqtSignal(dict)
+
+    def __init__(self,
+                 probes: list[Probe],
+                 buffer_size: int = Config.TELEMETRY_BUFFER_SIZE,
+                 interval: float = Config.TELEMETRY_INTERVAL,
+                 active_interval: float = Config.TELEMETRY_ACTIVE_INTERVAL,
+                 max_interval: float = Config.TELEMETRY_MAX_INTERVAL,
+                 ):
+        super().__init__()
+        self.probes = probes
+        self.buffer = RingBuffer(buffer_size)
+        self.interval = interval
+        self.active_interval = active_interval
+        self.max_interval = max_interval
+        self._active = False
+        self._current_interval = interval
+        self._background_interval: float | None = None
+        self._last_values: dict[str, dict[str, float]] = {}
+        self._last_sampled: dict[str, float] = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def add_probes(self, probes: list[Probe]) -> None:
+        # Список подменяется целиком, чтобы поток опроса не видел его частично изменённым
+        self.probes = self.probes + probes
+
+    def set_active(self, active: bool) -> None:
+        self._active = active
+        self._current_interval = self.active_interval if active else self.interval
+        self._wake.set()
+
+    def set_intervals(self, interval: float, max_interval: float) -> None:
+        self.interval = interval
+        self.max_interval = max_interval
+        if not self._active:
+            self._current_interval = interval
+        self._wake.set()
+
+    def set_background_interval(self, interval: float | None) -> None:
+        """None - окно на переднем плане, иначе опрашивать не чаще раза в interval секунд"""
+        if interval != self._background_interval:
+            self._background_interval = interval
+            self._wake.set()
+
+    def latest(self) -> dict | None:
+        return self.buffer.latest()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self.wait()
+
+    def run(self):
+        previous = None
+        while not self._stop.is_set():
+            sample = self.sample_once()
+            self.buffer.append(sample)
+            self.sampled.emit(sample)
+            self._adapt(previous, sample)
+            previous = sample
+            self._wake.wait(max(self._current_interval, self._background_interval or 0.0))
+            self._wake.clear()
+
+    def sample_once(self) -> dict:
+        now = time.time()
+        sample = {'time': now}
+        for probe in self.probes:
+            if now - self._last_sampled.get(probe.name, 0.0) >= probe.interval:
+                try:
+                    self._last_values[probe.name] = probe.sample()
+                except Exception as e:
+                    self._last_values[probe.name] = {}
+                    print(f'telemetry probe {probe.name} failed: {e}')
+                self._last_sampled[probe.name] = now
+            sample.update(self._last_values.get(probe.name, {}))
+        return sample
+
+    def _adapt(self, previous: dict | None, sample: dict) -> None:
+        if self._active or previous is None:
+            return
+        changed = any(
+            abs(sample[key] - previous.get(key, 0)) > Config.TELEMETRY_CHANGE_THRESHOLD * max(abs(sample[key]), 1)
+            for key in ('ram_used', 'process_rss', 'gpu_used') if key in sample
+        )
+        if changed:
+            self._current_interval = self.interval
+        else:
+            self._current_interval = min(self.max_interval, self._current_interval * 1.5)
+
+    def export(self, path: str) -> None:
+        """Сохранить временной ряд в CSV или JSON (по расширению файла)"""
+        samples = self.buffer.snapshot()
+        if os.path.splitext(path)[1].lower() == '.json':
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(samples, file, indent=1)
+            return
+        columns = ['time'] + sorted({key for sample in samples for key in sample} - {'time'})
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(samples)
+
+
+class WakeupMonitor(QObject):
+    """
+    Замер фоновой нагрузки GUI: сколько раз в секунду просыпается цикл событий
+    главного потока и сколько процессорного времени он тратит. Отчёт печатается
+    каждые interval секунд (сам отчёт добавляет одно пробуждение за период)
+    """
+
+    def __init__(self, interval: float = Config.IDLE_REPORT_INTERVAL, parent: QObject | None = None):
+        super().__init__(parent)
+        self.interval = interval
+        self.wakeups = 0
+        self._process = psutil.Process()
+        QAbstractEventDispatcher.instance().awake.connect(self._on_awake)
+        self._timer = QTimer(self)
+        self._timer.setInterval(round(interval * 1000))
+        self._timer.timeout.connect(self.report)
+        self._reset()
+
+    def start(self) -> None:
+        self._reset()
+        self._timer.start()
+
+    def _reset(self) -> None:
+        self.wakeups = 0
+        self._started = time.perf_counter()
+        self._thread_cpu = time.thread_time()  # вызывается в потоке GUI - это его время
+        self._process_cpu = sum(self._process.cpu_times()[:2])
+
+    def _on_awake(self) -> None:
+        self.wakeups += 1
+
+    def snapshot(self) -> dict[str, float]:
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        return {
+            'wakeups_per_second': self.wakeups / elapsed,
+            'gui_cpu_ms_per_second': (time.thread_time() - self._thread_cpu) * 1000 / elapsed,
+            'process_cpu_percent': (sum(self._process.cpu_times()[:2]) - self._process_cpu) * 100 / elapsed,
+        }
+
+    def report(self) -> None:
+        stats = self.snapshot()
+        print(f"idle: {stats['wakeups_per_second']:.1f} wakeups/s, "
+              f"GUI thread CPU {stats['gui_cpu_ms_per_second']:.2f} ms/s, "
+              f"process CPU {stats['process_cpu_percent']:.1f}%")
+        self._reset()
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from src.config import Config
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.start, **self.args)
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Замеры этапов горячего пути (промпт -> токены -> отрисовка). Выключенный
+    трассировщик возвращает из span() общий пустой контекст - это одна проверка
+    флага. События хранятся в кольцевом буфере и выгружаются в формате
+    Chrome trace (chrome://tracing, ui.perfetto.dev) или сводкой по этапам.
+    Время - time.perf_counter, как и в остальных замерах
+    """
+
+    def __init__(self, buffer_size: int = Config.TRACE_BUFFER_EVENTS):
+        self.enabled = False
+        self._origin = time.perf_counter()
+        self._events: deque = deque(maxlen=buffer_size)  # (name, tid, start, duration, args)
+        self._thread_names: dict[int, str] = {}
+        # Метки отправки по ключу: принимающая сторона снимает их по порядку (FIFO),
+        # очередь сигналов Qt сохраняет порядок доставки
+        self._marks: dict[str, deque] = defaultdict(lambda: deque(maxlen=1024))
+
+    def enable(self, enabled: bool = True) -> None:
+        self._marks.clear()
+        self.enabled = enabled
+
+    def clear(self) -> None:
+        self._events.clear()
+        self._marks.clear()
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def complete(self, name: str, start: float, end: float | None = None, **args) -> None:
+        """Добавить этап, начало и конец которого измерены отдельно"""
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        self._events.append((name, tid, start, end - start, args))
+
+    def mark(self, key: str) -> None:
+        """Отметить отправку (например, испускание сигнала в другой поток)"""
+        if self.enabled:
+            self._marks[key].append(time.perf_counter())
+
+    def arrive(self, key: str, name: str) -> None:
+        """Получение отмеченного: этап name длится от mark(key) до этого вызова"""
+        if self.enabled and self._marks[key]:
+            self.complete(name, self._marks[key].popleft())
+
+    def events(self) -> list[tuple]:
+        return list(self._events)
+
+    def export_chrome(self, path: str) -> None:
+        pid = os.getpid()
+        trace = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in self._thread_names.items()
+        ]
+        trace += [
+            {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': (start - self._origin) * 1e6,
+             'dur': duration * 1e6, 'args': args}
+            for name, tid, start, duration, args in self.events()
+        ]
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file, default=str)
+
+    def durations(self) -> dict[str, list[float]]:
+        result = defaultdict(list)
+        for name, _, _, duration, _ in self.events():
+            result[name].append(duration)
+        return result
+
+    def summary(self) -> dict[str, dict]:
+        """Сводка по этапам: число, сумма, перцентили (мс) и гистограмма по степеням двойки (мкс)"""
+        result = {}
+        for name, values in self.durations().items():
+            values.sort()
+
+            def percentile(q):
+                return values[min(len(values) - 1, int(q / 100 * len(values)))] * 1000
+
+            histogram = defaultdict(int)
+            for value in values:
+                histogram[2 ** max(0, int(value * 1e6)).bit_length()] += 1
+            result[name] = {
+                'count': len(values),
+                'total_ms': sum(values) * 1000,
+                'p50_ms': percentile(50),
+                'p90_ms': percentile(90),
+                'p99_ms': percentile(99),
+                'max_ms': values[-1] * 1000,
+                'histogram_us': dict(sorted(histogram.items())),
+            }
+        return result
+
+    def format_summary(self) -> str:
+        lines = [f"{'stage':<24}{'count':>7}{'total ms':>11}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}"]
+        summary = sorted(self.summary().items(), key=lambda item: -item[1]['total_ms'])
+        for name, stats in summary:
+            lines.append(f"{name:<24}{stats['count']:>7}{stats['total_ms']:>11.1f}{stats['p50_ms']:>9.3f}"
+                         f"{stats['p90_ms']:>9.3f}{stats['p99_ms']:>9.3f}{stats['max_ms']:>9.3f}")
+        for name, stats in summary:
+            buckets = ' '.join(f'<{bound}us:{count}' for bound, count in stats['histogram_us'].items())
+            lines.append(f'{name}: {buckets}')
+        return '\n'.join(lines)
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **args):
+    if not TRACER.enabled:
+        return _NULL_SPAN
+    return _Span(TRACER, name, args)
+
+
+@contextmanager
+def trace_forward(model):
+    """
+    Этап на каждый проход модели (хуки ставятся, только если трассировка включена):
+    decode_step - один новый токен, forward - префилл или проверка кандидатов.
+    На CUDA проход без синхронизации измеряет постановку ядер в очередь
+    """
+    if not TRACER.enabled:
+        yield
+        return
+    starts = []
+
+    def before(module, args, kwargs):
+        starts.append(time.perf_counter())
+
+    def after(module, args, kwargs, output):
+        input_ids = kwargs.get('input_ids', args[0] if args else None)
+        tokens = input_ids.shape[1] if input_ids is not None else 0
+        TRACER.complete('decode_step' if tokens == 1 else 'forward', starts.pop(), tokens=tokens)
+
+    handles = [
+        model.register_forward_pre_hook(before, with_kwargs=True),
+        model.register_forward_hook(after, with_kwargs=True),
+    ]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
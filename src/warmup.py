@@ -0,0 +1,57 @@
+import importlib
+import time
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+
+# Модули, которые не должны импортироваться до показа окна
+HEAVY_MODULES = ('torch', 'transformers', 'markdown', 'GPUtil', 'bitsandbytes')
+# Что заранее импортирует WarmupThread, пока пользователь видит окно
+WARMUP_MODULES = ('torch', 'transformers', 'markdown', 'src.chat_session', 'src.streaming_thread')
+
+
+class WarmupThread(QThread):
+    """Фоновый импорт тяжёлых модулей сразу после показа окна"""
+    finished_warmup = pyqtSignal(object)  # время импорта каждого модуля
+
+    def __init__(self, modules: tuple[str, ...] = WARMUP_MODULES):
+        super().__init__()
+        self.modules = modules
+
+    def run(self):
+        timings = {}
+        for name in self.modules:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                print(f'warmup import {name} failed: {e}')
+                continue
+            timings[name] = time.perf_counter() - start
+        self.finished_warmup.emit(timings)
+
+
+def warmup_model(model, tokenizer, timings: dict | None = None) -> None:
+    """
+    Прогреть только что загруженную модель: шаблон чата токенизатора и короткий
+    generate, чтобы первый настоящий запрос не платил за инициализацию ядер
+    """
+    import torch
+
+    start = time.perf_counter()
+    messages = [{'role': 'user', 'content': 'Привет'}]
+    if tokenizer.chat_template is not None:
+        input_ids = tokenizer.apply_chat_template(messages, add_generation_prompt=True, return_tensors='pt')
+    else:
+        input_ids = tokenizer(messages[0]['content'], return_tensors='pt')['input_ids']
+    input_ids = input_ids.to(model.device)
+    with torch.no_grad():
+        model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=2,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id,
+        )
+    if timings is not None:
+        timings['warmup'] = time.perf_counter() - start
@@ -0,0 +1,23 @@
+import pytest
+
+from benchmarks.tiny_model import make_tiny_model
+
+
+@pytest.fixture(scope='session')
+def tiny_model_path(tmp_path_factory) -> str:
+    """Крошечная случайная Llama с BPE-токенизатором (benchmarks/tiny_model.py) - без загрузки с хаба"""
+    path = str(tmp_path_factory.mktemp('tiny-llama'))
+    make_tiny_model(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def tiny_tokenizer(tiny_model_path):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(tiny_model_path)
+
+
+@pytest.fixture(scope='session')
+def tiny_model(tiny_model_path):
+    from transformers import AutoModelForCausalLM
+    return AutoModelForCausalLM.from_pretrained(tiny_model_path).eval()
@@ -0,0 +1,121 @@
+import torch
+from transformers import DynamicCache
+
+from src.chat_session import ChatSession
+from src.prefix_cache import PrefixCache
+
+BLOCK = 4
+
+
+def forward(model, ids: list[int], cache: DynamicCache | None = None) -> tuple[DynamicCache, torch.Tensor]:
+    """Префилл ids поверх cache; кэш и логиты последней позиции"""
+    cache = cache if cache is not None else DynamicCache()
+    start = cache.get_seq_length()
+    with torch.no_grad():
+        output = model(input_ids=torch.tensor([ids[start:]]), past_key_values=cache, use_cache=True)
+    return cache, output.logits[0, -1]
+
+
+def prompt_ids(tokenizer, text: str) -> list[int]:
+    return tokenizer(text)['input_ids']
+
+
+def test_lookup_returns_whole_blocks_of_the_inserted_prefix(tiny_model, tiny_tokenizer):
+    ids = prompt_ids(tiny_tokenizer, 'The quick brown fox jumps over the lazy dog.')
+    cache, logits = forward(tiny_model, ids)
+    prefix_cache = PrefixCache(block_tokens=BLOCK, budget_bytes=1 << 30)
+    assert prefix_cache.insert(ids, cache) == len(ids) // BLOCK
+
+    found, length = prefix_cache.lookup(ids)
+    # Последний токен всегда остаётся на префилл
+    assert length == (len(ids) - 1) // BLOCK * BLOCK
+    assert found.get_seq_length() == length
+    for layer in range(len(cache)):
+        assert torch.equal(found.key_cache[layer], cache.key_cache[layer][:, :, :length])
+        assert torch.equal(found.value_cache[layer], cache.value_cache[layer][:, :, :length])
+    # Префилл остатка поверх найденного кэша даёт те же логиты
+    _, cached_logits = forward(tiny_model, ids, found)
+    torch.testing.assert_close(cached_logits, logits, atol=1e-5, rtol=1e-5)
+    assert prefix_cache.stats['hits'] == 1
+
+
+def test_lookup_stops_at_the_first_diverging_block(tiny_model, tiny_tokenizer):
+    ids = prompt_ids(tiny_tokenizer, 'The quick brown fox jumps over the lazy dog.')
+    prefix_cache = PrefixCache(block_tokens=BLOCK, budget_bytes=1 << 30)
+    prefix_cache.insert(ids, forward(tiny_model, ids)[0])
+
+    diverged = ids[:BLOCK + 1] + [token + 1 for token in ids[BLOCK + 1:]]
+    _, length = prefix_cache.lookup(diverged)
+    assert length == BLOCK
+    assert prefix_cache.lookup([ids[0] + 1] + ids[1:]) == (None, 0)
+    assert prefix_cache.stats['misses'] == 1
+
+
+def test_returned_cache_does_not_alias_stored_blocks(tiny_model, tiny_tokenizer):
+    ids = prompt_ids(tiny_tokenizer, 'The quick brown fox jumps over the lazy dog.')
+    prefix_cache = PrefixCache(block_tokens=BLOCK, budget_bytes=1 << 30)
+    prefix_cache.insert(ids, forward(tiny_model, ids)[0])
+    found, length = prefix_cache.lookup(ids)
+    expected = found.key_cache[0].clone()
+    found.key_cache[0].zero_()
+    found.crop(1)
+    again, _ = prefix_cache.lookup(ids)
+    assert torch.equal(again.key_cache[0], expected)
+
+
+def test_least_recently_used_leaves_are_evicted(tiny_model, tiny_tokenizer):
+    first = prompt_ids(tiny_tokenizer, 'The quick brown fox jumps over the lazy dog.') * 2
+    second = prompt_ids(tiny_tokenizer, 'def main():\n    print("hello, world")\n')
+    first_cache, second_cache = forward(tiny_model, first)[0], forward(tiny_model, second)[0]
+    probe = PrefixCache(block_tokens=BLOCK, budget_bytes=1 << 30)
+    probe.insert(first, first_cache)
+    block_bytes = probe.stats['bytes'] // probe.stats['blocks']
+
+    prefix_cache = PrefixCache(block_tokens=BLOCK, budget_bytes=2 * block_bytes)
+    assert prefix_cache.insert(first, first_cache) == 2  # больше бюджета не копируется
+    prefix_cache.insert(second, second_cache)
+    assert prefix_cache.stats['bytes'] <= prefix_cache.budget_bytes
+    assert prefix_cache.stats['evicted_blocks'] == 2
+    # Вытеснены давно использованные блоки первого префикса, свежий второй на месте
+    assert prefix_cache.lookup(second)[1] == 2 * BLOCK
+    assert prefix_cache.lookup(first) == (None, 0)
+
+
+def test_session_crops_its_cache_where_the_dialogue_diverges(tiny_model, tiny_tokenizer):
+    session = ChatSession(tiny_tokenizer, system_prompt='You are brief.')
+    ids, cache = session.prepare('The quick brown fox')
+    ids = ids[0].tolist()
+    cache, _ = forward(tiny_model, ids, cache)
+    session.commit(torch.tensor(ids), 'jumps over the lazy dog.')
+    full_length = cache.get_seq_length()
+
+    # Тот же вопрос заново (перегенерация): кэш диалога обрезается до общего префикса
+    session.messages = []
+    regenerated, cropped = session.prepare('The quick brown fox runs')
+    regenerated = regenerated[0].tolist()
+    common = next(i for i, (a, b) in enumerate(zip(ids, regenerated)) if a != b)
+    assert cropped is cache and cropped.get_seq_length() == common < full_length
+    assert session.last_stats['reused_tokens'] == common
+    assert session.cached_ids == regenerated[:common]
+    _, logits = forward(tiny_model, regenerated, cropped)
+    _, expected = forward(tiny_model, regenerated)
+    torch.testing.assert_close(logits, expected, atol=1e-5, rtol=1e-5)
+
+
+def test_session_falls_back_to_the_prefix_cache(tiny_model, tiny_tokenizer):
+    prefix_cache = PrefixCache(block_tokens=BLOCK, budget_bytes=1 << 30)
+    first = ChatSession(tiny_tokenizer, system_prompt='You are brief.')
+    ids, cache = first.prepare('The quick brown fox', prefix_cache)
+    ids = ids[0].tolist()
+    prefix_cache.insert(ids, forward(tiny_model, ids, cache)[0])
+
+    # Новый диалог с тем же началом берёт префикс из общего кэша
+    second = ChatSession(tiny_tokenizer, system_prompt='You are brief.')
+    other, cache = second.prepare('The quick brown cat', prefix_cache)
+    other = other[0].tolist()
+    shared = second.last_stats['prefix_cache_tokens']
+    assert shared and shared % BLOCK == 0 and other[:shared] == ids[:shared]
+    assert cache.get_seq_length() == second.last_stats['reused_tokens'] == shared
+    _, logits = forward(tiny_model, other, cache)
+    _, expected = forward(tiny_model, other)
+    torch.testing.assert_close(logits, expected, atol=1e-5, rtol=1e-5)
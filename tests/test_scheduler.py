@@ -0,0 +1,49 @@
+import heapq
+
+from src.chat_session import ChatSession
+from src.scheduler import GenerationRequest, InferenceWorker, Priority
+
+
+def run_next(worker: InferenceWorker) -> None:
+    """Выполнить следующий запрос очереди в текущем потоке - как run(), но без запуска QThread"""
+    _, _, request = heapq.heappop(worker._queue)
+    worker._current = request
+    worker._execute(request, worker.model, worker.tokenizer)
+    worker._current = worker._current_thread = None
+
+
+def test_preempted_session_request_continues_the_same_turn(tiny_model, tiny_tokenizer):
+    worker = InferenceWorker(prefix_cache=False, response_cache=False)
+    worker.set_model(tiny_model, tiny_tokenizer)
+    session = ChatSession(tiny_tokenizer, system_prompt=None)
+    background = GenerationRequest('Расскажи про лису', 0.0, priority=Priority.BACKGROUND, session=session,
+                                   max_new_tokens=32, timeout=None, stop_strings=(), speculative='none',
+                                   kv_cache='full')
+    interactive = GenerationRequest('Привет', 0.0, priority=Priority.INTERACTIVE, max_new_tokens=4,
+                                    timeout=None, stop_strings=(), speculative='none', kv_cache='full')
+
+    # Срочный запрос приходит, как только фоновый выдал первый текст
+    def preempt(_text: str) -> None:
+        if not interactive._worker:
+            worker.submit(interactive)
+    background.update_response.connect(preempt)
+
+    worker.submit(background)
+    run_next(worker)
+
+    assert background.preemptions == 1
+    assert not background.done()
+    # Прерванный ход не попал в историю, вопрос ждёт повторного запуска, посчитанный кэш сохранён
+    assert session.messages == []
+    assert session._pending_user == 'Расскажи про лису'
+    assert session.cached_ids and len(session.cached_ids) == session.cache.get_seq_length()
+
+    while worker._queue:
+        run_next(worker)
+    assert interactive.future.result()['reason'] != 'preempted'
+    result = background.future.result()
+    assert result['reason'] != 'preempted'
+    assert [message['role'] for message in session.messages] == ['user', 'assistant']
+    assert session.messages[0]['content'] == 'Расскажи про лису'
+    assert session.messages[1]['content'] == tiny_tokenizer.decode(background.generated_ids,
+                                                                   skip_special_tokens=True)
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+import torch
+
+from src.streamer import PyQtStreamer
+
+SAMPLES = [
+    'The quick brown fox jumps over the lazy dog.',
+    'Съешь же ещё этих мягких французских булок, да выпей чаю.',
+    'Emoji 🤖🚀 и иероглифы 漢字 в одной строке.',
+    'def main():\n    print("hello, world")\n\n$$\\int_0^1 x^2 dx$$',
+]
+
+
+class Collector:
+    def __init__(self):
+        self.chunks: list[str] = []
+
+    def emit(self, text: str) -> None:
+        self.chunks.append(text)
+
+
+def stream(tokenizer, ids: list[int], steps: list[int], **kwargs) -> tuple[PyQtStreamer, list[str]]:
+    collector = Collector()
+    streamer = PyQtStreamer(tokenizer, collector, **kwargs)
+    streamer.put(torch.tensor([[tokenizer.bos_token_id]]))  # промпт
+    pos = 0
+    for step in steps:
+        streamer.put(torch.tensor(ids[pos:pos + step]))
+        pos += step
+    streamer.end()
+    return streamer, collector.chunks
+
+
+@pytest.mark.parametrize('sample', SAMPLES)
+@pytest.mark.parametrize('batch_tokens', [1, 4])
+def test_streamed_text_matches_full_decode(tiny_tokenizer, sample, batch_tokens):
+    ids = tiny_tokenizer.encode(sample, add_special_tokens=False)
+    rng = random.Random(len(sample))
+    steps = []
+    while sum(steps) < len(ids):
+        steps.append(rng.randint(1, 3))  # спекулятивный шаг добавляет несколько токенов
+    streamer, chunks = stream(tiny_tokenizer, ids, steps, batch_tokens=batch_tokens, batch_interval=60.0)
+    assert ''.join(chunks) == tiny_tokenizer.decode(ids, skip_special_tokens=True)
+    assert streamer.token_ids == ids
+    # Неполный многобайтный символ не выдаётся, пока не придёт его последний токен
+    assert not any('�' in chunk for chunk in chunks)
+
+
+def test_first_text_is_sent_at_once_then_batched(tiny_tokenizer):
+    ids = tiny_tokenizer.encode(SAMPLES[0], add_special_tokens=False)
+    _, chunks = stream(tiny_tokenizer, ids, [1] * len(ids), batch_tokens=len(ids) + 1, batch_interval=60.0)
+    # Первый токен уходит сразу (время до первого токена), остальное копится до end()
+    assert chunks == [tiny_tokenizer.decode(ids[:1]), tiny_tokenizer.decode(ids)[len(chunks[0]):]]
+
+
+def test_max_tokens_drops_overshoot(tiny_tokenizer):
+    ids = tiny_tokenizer.encode(SAMPLES[1], add_special_tokens=False)
+    streamer, chunks = stream(tiny_tokenizer, ids, [3] * (len(ids) // 3 + 1), batch_tokens=1, max_tokens=5)
+    assert streamer.token_ids == ids[:5]
+    assert ''.join(chunks) == tiny_tokenizer.decode(ids[:5], skip_special_tokens=True)
+
+
+def test_prompt_is_streamed_when_not_skipped(tiny_tokenizer):
+    ids = tiny_tokenizer.encode(SAMPLES[0], add_special_tokens=False)
+    collector = Collector()
+    streamer = PyQtStreamer(tiny_tokenizer, collector, skip_prompt=False, batch_tokens=1, batch_interval=0.0)
+    streamer.put(torch.tensor([ids]))
+    streamer.end()
+    assert ''.join(collector.chunks) == SAMPLES[0]
@@ -1,5 +1,15 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, TextStreamer
+import time
+from typing import TYPE_CHECKING
+
+from src.backend import quantize_dynamic_int8, resolve_device, resolve_quantization
+from src.config import Config
+from src.model_cache import ModelCache, weights_signature
+
+if TYPE_CHECKING:
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from src.load_planner import LoadPlan
+
+# torch и transformers импортируются при загрузке модели: getGb нужен окну сразу при старте
 
 
 def getGb(bites: int) -> str:
@@ -10,22 +20,118 @@ def getGb(bites: int) -> str:
     return f'{gb:.1f}'
 
 
-def get_model_and_tokenizer() -> tuple[AutoModelForCausalLM, AutoTokenizer]:
-    # base_model_id = "mistralai/Ministral-8B-Instruct-2410"
-    base_model_id = r"C:\Users\User\.cache\huggingface\hub\models--mistralai--Ministral-8B-Instruct-2410\snapshots\4847e87e5975a573a2a190399ca62cd266c899ad"
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_quant_type="nf4",
-        bnb_4bit_compute_dtype=torch.bfloat16
-    )
-    model = AutoModelForCausalLM.from_pretrained(
-        base_model_id,
-        quantization_config=bnb_config,
-        low_cpu_mem_usage=True)
+def get_model_and_tokenizer(
+        model_id: str = Config.MODEL_ID,
+        revision: str | None = None,
+        use_cache: bool = Config.MODEL_CACHE_ENABLED,
+        device: str = Config.DEVICE,
+        quantization: str | None = Config.QUANTIZATION,
+        timings: dict | None = None,
+        plan: 'LoadPlan | None' = None,
+) -> tuple['AutoModelForCausalLM', 'AutoTokenizer']:
+    """
+    Загрузить модель и токенизатор на выбранное устройство (cuda / cpu / auto).
+    Квантованные NF4-веса сохраняются в ModelCache, и последующие загрузки читают
+    их через mmap без повторного квантования. На CPU доступно динамическое int8.
+    plan (src.load_planner) задаёт устройство, точность и выгрузку слоёв вместо device/quantization.
+    В timings (если передан) записываются источник и время этапов
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    if revision is None and model_id == Config.MODEL_ID:
+        revision = Config.MODEL_REVISION
+    device_map, max_memory, offload = device, None, False
+    if plan is not None:
+        device, quantization = plan.device, plan.quantization
+        device_map, max_memory, offload = plan.device_map, plan.max_memory, plan.offload
+    device = resolve_device(device)
+    quantization = resolve_quantization(device, quantization)
+    timings['device'] = device
+    timings['quantization'] = quantization or 'none'
+    bnb_config = None
+    if quantization == 'nf4':
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            llm_int8_enable_fp32_cpu_offload=offload,
+        )
+    torch_dtype = getattr(torch, Config.CPU_DTYPE) if device == 'cpu' else 'auto'
+    # Кэшировать имеет смысл только результат NF4-квантования
+    use_cache = use_cache and bnb_config is not None and not offload
+    cache = ModelCache()
+    cache_key = cache.key(model_id, revision, bnb_config and bnb_config.to_dict())
+    cached_path = cache.get(cache_key) if use_cache else None
+    if cached_path is not None:
+        timings['source'] = 'cache'
+        # Конфиг квантования сохранён вместе с весами
+        model = AutoModelForCausalLM.from_pretrained(
+            cached_path,
+            device_map=device,
+            low_cpu_mem_usage=True)
+        tokenizer_path, tokenizer_revision = cached_path, None
+    else:
+        timings['source'] = 'hub'
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id,
+            revision=revision,
+            quantization_config=bnb_config,
+            torch_dtype=torch_dtype,
+            device_map=device_map,
+            max_memory=max_memory,
+            low_cpu_mem_usage=True)
+        tokenizer_path, tokenizer_revision = model_id, revision
     model.eval()
+    if quantization == 'int8':
+        model = quantize_dynamic_int8(model)
+    # Логическая модель для отпечатка в src/response_cache.py: из кэша весов она грузится
+    # по локальному пути, и config.name_or_path при повторном запуске уже другой
+    if cached_path is not None:
+        weights_revision = (cache.meta(cache_key) or {}).get('weights_revision')
+    else:
+        weights_revision = getattr(model.config, '_commit_hash', None) or weights_signature(model_id)
+    model.source_model_id, model.source_revision = model_id, weights_revision or revision
     tokenizer = AutoTokenizer.from_pretrained(
-        base_model_id,
+        tokenizer_path,
+        revision=tokenizer_revision,
         add_bos_token=True,
         legacy=False,
     )
+    timings['load'] = time.perf_counter() - start
+
+    if use_cache and cached_path is None:
+        start = time.perf_counter()
+        cache.put(cache_key, model, tokenizer,
+                  {'model_id': model_id, 'revision': revision, 'weights_revision': weights_revision})
+        timings['cache_save'] = time.perf_counter() - start
     return model, tokenizer
+
+
+def get_draft_model(
+        model_id: str = Config.DRAFT_MODEL_ID,
+        revision: str | None = Config.DRAFT_MODEL_REVISION,
+        device: str = Config.DEVICE,
+        timings: dict | None = None,
+) -> 'AutoModelForCausalLM':
+    """
+    Загрузить черновую модель для спекулятивного декодирования. Она маленькая,
+    поэтому не квантуется; токенизатор должен совпадать с основной моделью
+    """
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    start = time.perf_counter()
+    device = resolve_device(device)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        revision=revision,
+        torch_dtype=getattr(torch, Config.CPU_DTYPE) if device == 'cpu' else 'auto',
+        device_map=device,
+        low_cpu_mem_usage=True)
+    model.eval()
+    if timings is not None:
+        timings['draft_load'] = time.perf_counter() - start
+    return model
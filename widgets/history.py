@@ -0,0 +1,93 @@
+import time
+
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
+from PyQt6.QtWidgets import QLineEdit, QListWidget, QListWidgetItem, QVBoxLayout, QWidget
+
+from src.config import Config
+
+
+class HistoryPanel(QWidget):
+    """
+    Панель истории: список ходов от новых к старым и поиск. Первая страница
+    читается при первом показе панели, следующие - когда список докручен до конца
+    """
+    turn_selected = pyqtSignal(int)
+
+    def __init__(self, store, parent: QWidget | None = None, page_size: int = Config.HISTORY_PAGE_SIZE):
+        super().__init__(parent)
+        self.store = store
+        self.page_size = page_size
+        self._query = ''
+        self._last_id: int | None = None
+        self._exhausted = False
+        self._loaded = False
+
+        self.searchEdit = QLineEdit(self)
+        self.searchEdit.setPlaceholderText('Поиск по истории')
+        self.searchEdit.setClearButtonEnabled(True)
+        self.listWidget = QListWidget(self)
+        self.listWidget.setWordWrap(True)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.searchEdit)
+        layout.addWidget(self.listWidget)
+
+        # Поиск запускается, когда ввод затих, а не на каждую букву
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(200)
+        self._search_timer.timeout.connect(self._apply_search)
+        self.searchEdit.textChanged.connect(self._search_timer.start)
+        self.listWidget.verticalScrollBar().valueChanged.connect(self._on_scroll)
+        self.listWidget.itemActivated.connect(self._on_activated)
+        self.listWidget.itemClicked.connect(self._on_activated)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self._loaded:
+            self.reload()
+
+    def invalidate(self) -> None:
+        """История изменилась: видимая панель перечитывается сразу, скрытая - при показе"""
+        if self.isVisible():
+            self.reload()
+        else:
+            self._loaded = False
+
+    def reload(self) -> None:
+        """Перечитать с первой страницы (после нового хода или смены запроса)"""
+        self._loaded = True
+        self._last_id = None
+        self._exhausted = False
+        self.listWidget.clear()
+        self._load_page()
+
+    def _apply_search(self) -> None:
+        self._query = self.searchEdit.text().strip()
+        self.reload()
+
+    def _load_page(self) -> None:
+        if self._exhausted:
+            return
+        if self._query:
+            rows = self.store.search(self._query, self.page_size, self._last_id)
+        else:
+            rows = self.store.page(self.page_size, self._last_id)
+        self._exhausted = len(rows) < self.page_size
+        for row in rows:
+            created = time.strftime('%d.%m.%Y %H:%M', time.localtime(row['created']))
+            text = f"{created}  {' '.join(row['prompt'].split())}"
+            if row.get('snippet'):
+                text += f"\n{' '.join(row['snippet'].split())}"
+            item = QListWidgetItem(text)
+            item.setData(Qt.ItemDataRole.UserRole, row['id'])
+            self.listWidget.addItem(item)
+        if rows:
+            self._last_id = rows[-1]['id']
+
+    def _on_scroll(self, value: int) -> None:
+        if value >= self.listWidget.verticalScrollBar().maximum() - 2:
+            self._load_page()
+
+    def _on_activated(self, item: QListWidgetItem) -> None:
+        self.turn_selected.emit(item.data(Qt.ItemDataRole.UserRole))
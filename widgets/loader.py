@@ -1,10 +1,15 @@
 from PyQt6 import QtGui, QtWidgets
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import QEvent, QTimer
 from PyQt6.QtGui import QColor, QPainter
 from PyQt6.QtWidgets import QWidget
 
 
 class LoaderWidget(QWidget):
+    """
+    Индикатор загрузки. Таймер анимации работает, только пока виджет включён,
+    виден, окно не свёрнуто и прогресс неизвестен - в остальное время он не будит поток GUI
+    """
+
     def __init__(
             self,
             parent: QWidget | None = None
@@ -19,10 +24,23 @@ class LoaderWidget(QWidget):
         self._fps = 60
         self._duration = 2.0
         self._width_color = 0.25
-        self._animation_timer = QTimer()
+        self._progress: float | None = None  # None - бегущая полоса без известного прогресса
+        self._animation_timer = QTimer(self)
         self._animation_timer.setInterval(int(1000 / self._fps))
         self._animation_timer.timeout.connect(self._animate)
-        self._animation_timer.start()
+
+    def _update_timer(self) -> None:
+        window = self.window()
+        animate = (self.isEnabled() and self._progress is None and self.isVisible()
+                   and not window.isMinimized())
+        if animate and not self._animation_timer.isActive():
+            self._animation_timer.start()
+        elif not animate:
+            self._animation_timer.stop()
+
+    @property
+    def animating(self) -> bool:
+        return self._animation_timer.isActive()
 
     def _animate(self) -> None:
         self._position += 1 / (self._fps * self.duration)
@@ -30,6 +48,20 @@ class LoaderWidget(QWidget):
             self._position = 0.0
         self.update()
 
+    @property
+    def progress(self) -> float | None:
+        return self._progress
+
+    @progress.setter
+    def progress(self, progress: float | None) -> None:
+        if progress is not None and not 0.0 <= progress <= 1.0:
+            raise ValueError("Progress must be between 0.0 and 1.0")
+        previous, self._progress = self._progress, progress
+        self._update_timer()
+        # Перерисовка, только если заполненная часть изменилась хотя бы на пиксель
+        if previous is None or progress is None or round(previous * self.width()) != round(progress * self.width()):
+            self.update()
+
     @property
     def width_color(self) -> float:
         return self._width_color * 2
@@ -67,9 +99,7 @@ class LoaderWidget(QWidget):
         if fps > 1000:
             raise ValueError("FPS must be less than or equal to 1000")
         self._fps = fps
-        self._animation_timer.stop()
-        self._animation_timer.setInterval(1000 / self._fps)
-        self._animation_timer.start()
+        self._animation_timer.setInterval(int(1000 / self._fps))
 
     @property
     def background_active(self) -> QColor:
@@ -116,6 +146,11 @@ class LoaderWidget(QWidget):
         qp.setBrush(self._background_active)
         qp.drawRect(0, 0, w, h)
 
+        if self._progress is not None:
+            qp.fillRect(border, border, round((w - 2 * border) * self._progress), h - 2 * border, self._color)
+            qp.end()
+            return
+
         for x in range(border, w - border):
             float_x = x / w
             dx = min(
@@ -137,12 +172,26 @@ class LoaderWidget(QWidget):
 
         qp.end()
 
-    def setEnabled(self, a0: bool) -> None:
-        if a0:
-            self._animation_timer.start()
-        else:
-            self._animation_timer.stop()
-        super().setEnabled(a0)
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Сворачивание окна виджету не приходит - следим за состоянием окна сами
+        if self.window() is not self:
+            self.window().installEventFilter(self)
+        self._update_timer()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self._update_timer()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.EnabledChange:
+            self._update_timer()
+
+    def eventFilter(self, source, event):
+        if source is self.window() and event.type() == QEvent.Type.WindowStateChange:
+            self._update_timer()
+        return super().eventFilter(source, event)
 
 
 if __name__ == '__main__':